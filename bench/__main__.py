@@ -0,0 +1,360 @@
+"""
+End-to-end benchmark of the tweet pipeline against local stand-ins.
+
+Flexa, Pyth and Etherscan are served by a local HTTP fixture server, on-chain
+reads go to a fake JSON-RPC node, utils.database runs on in-memory SQLite and
+Twitter is stubbed, so nothing leaves the machine. Each run is the bot's own
+AmpyJr.build_post() and dispatch(), timed stage by stage.
+
+    python -m bench --pools 10,100,1000,10000 --repeat 3
+    python -m bench --save-baseline
+    python -m bench --pools 1000 --rpc 300:0,0:0.5,20:0
+    python -m bench --pools 1000 --rpc 0:0:5,20:0
+    python -m bench --pools 1000 --repeat 30 --indexer
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import statistics
+from functools import wraps
+
+STAGES = ['collection', 'persistence', 'diffing', 'table', 'render', 'publish']
+
+##
+## (module, function, stage) for every step AmpyJr.build_post() looks up when it runs
+STAGE_FUNCTIONS = [
+    ('commands', 'collect_snapshot', 'collection'),
+    ('commands', 'tvl', 'persistence'),
+    ('utils', 'get_saved_totals', 'diffing'),
+    ('utils', 'get_saved_tvl', 'diffing'),
+    ('utils.report', 'build_summary', 'diffing'),
+    ('utils.report', 'build_pool_rows', 'diffing'),
+    ('utils.render', 'build_table', 'table'),
+    ('utils.render', 'render_table', 'render'),
+    ('utils.publish', 'build_report', 'publish'),
+]
+
+##
+## images taller than this many rows are far beyond anything tweeted and take gigabytes
+MAX_RENDER_ROWS = 1000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the tweet pipeline offline')
+    parser.add_argument('--pools', default='10,100,1000,10000', help="comma separated synthetic pool counts")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per pool count, the median is reported")
+    parser.add_argument('--baseline', default=None, help="baseline JSON file, defaults to bench_baseline.json in the cache directory")
+    parser.add_argument('--save-baseline', action='store_true', help="write these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown against the baseline before failing")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    parser.add_argument('--indexer', action='store_true', help="read balances through the log indexer, checked against the stand-in's balances every run")
+    parser.add_argument('--rpc', default=None, help="comma separated delay_ms:error_rate[:lag_blocks] specs, one stand-in RPC node each, to exercise failover")
+    return parser.parse_args()
+
+
+def configure(base_url, cache_dir):
+    """
+    Point every upstream at the stand-ins before anything reads the environment.
+    """
+    os.environ.update({
+        'RPC_URL': f'{base_url}/rpc',
+        'FLEXA_POOLS_URL': f'{base_url}/flexa/collateral_pools',
+        'PYTH_PRICE_URL': f'{base_url}/pyth',
+        'ETHERSCAN_API_URL': f'{base_url}/etherscan',
+        'CACHE_DIR': cache_dir,
+        'INDEXER_ENABLED': '0',
+        'HTTP_RETRIES': '0',
+        'HTTP_CACHE_TTL': '0',
+        'MULTICALL_ADDRESS': '',
+        'PUBLISH_SINKS': 'twitter',
+        'TWITTER_TWEETS_PER_DAY': '1000000',
+        'TWITTER_UPLOADS_PER_DAY': '1000000',
+        'TWITTER_BURST': '1000000',
+    })
+
+
+def instrument(current):
+    """
+    Wrap the functions build_post() calls so their wall time adds up per stage in `current`.
+
+    Tables too tall to render are left unrendered, their render stage is skipped.
+    """
+    import importlib
+    from PIL import Image
+
+    for module_name, name, stage in STAGE_FUNCTIONS:
+        module = importlib.import_module(module_name)
+        fn = getattr(module, name)
+
+        def wrapper(*args, fn=fn, stage=stage, **kwargs):
+            if stage == 'render' and len(args[0].rows) > MAX_RENDER_ROWS:
+                return Image.new('RGB', (1, 1), color=(255, 255, 255))
+
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                current[stage] = current.get(stage, 0.0) + time.perf_counter() - started
+
+        setattr(module, name, wraps(fn)(wrapper))
+
+
+def create_bot(login=True):
+    """
+    The bot as main.py builds it, with the stand-in Twitter clients in place of a login.
+
+    @params login: False to have the login fail the way a bad credential does
+    """
+    from main import AmpyJr
+    from bench.fakes import FakeTwitterAPI, FakeTwitterClient
+    from utils.twitter import TwitterPublisher
+
+    class BenchBot(AmpyJr):
+        def _authenticate(self):
+            self.api, client = FakeTwitterAPI(), FakeTwitterClient()
+            self.publisher = TwitterPublisher(self.api, client)
+            return client if login else None
+
+    return BenchBot()
+
+
+def run_pipeline(bot, current, timings):
+    """
+    One tweet run, AmpyJr.build_post() then dispatch() as AmpyJr.tweet does it, recording wall time per stage.
+    """
+    from utils import request_cache
+    from utils.publish import dispatch
+
+    current.clear()
+
+    with request_cache():
+        report = bot.build_post()
+        if report is None:
+            raise RuntimeError("build_post() failed, see the log above")
+
+        started = time.perf_counter()
+        statuses = dispatch(report, bot.sinks)
+        current['publish'] = current.get('publish', 0.0) + time.perf_counter() - started
+
+    if any(status != 'sent' for status in statuses.values()):
+        raise RuntimeError(f"Publishing failed: {statuses}")
+
+    for stage, seconds in current.items():
+        timings[stage].append(seconds)
+
+
+def verify_balances(state):
+    """
+    Check the balances the last run collected against the ones the stand-in serves at its block.
+    """
+    from bench.fakes import pool_balance
+    from commands import collect_snapshot
+    from commands.collect import parse_pools
+
+    ##
+    ## the same block again, so the balances come from the collector's cache
+    snapshot = collect_snapshot()
+    wrong = [
+        pool[1] for pool, balance in zip(parse_pools(snapshot['pools']), snapshot['balances'])
+        if balance[1] != pool_balance(pool[1], snapshot['block_number'])
+    ]
+    if wrong:
+        raise RuntimeError(f"{len(wrong)} of {len(snapshot['balances'])} pool balances are stale at block {snapshot['block_number']}")
+
+
+def verify_order():
+    """
+    Check the table lists pools in the order Flexa does, however recently each one changed.
+    """
+    from commands import collect_snapshot
+    from commands.collect import parse_pools
+    from utils import get_saved_totals, get_saved_tvl
+    from utils.report import build_pool_rows
+
+    snapshot = collect_snapshot()
+    saved_totals = get_saved_totals()
+    saved_tvl = get_saved_tvl(saved_totals[0][0], saved_totals[1][0])
+    rows = build_pool_rows(saved_tvl, saved_totals[0][0], saved_totals[1][0], snapshot['pools'])
+
+    expected = [pool[0] for pool in parse_pools(snapshot['pools'])]
+    if [row[0] for row in rows] != expected:
+        raise RuntimeError("The table lists pools out of order, changed pools moved")
+
+
+def verify_failed_login(state, cache_dir):
+    """
+    Check a failed Twitter login leaves the other sinks publishing.
+    """
+    from utils.publish import dispatch
+
+    archive_dir = os.path.join(cache_dir, 'archive')
+    os.environ.update({'PUBLISH_SINKS': 'twitter,archive', 'ARCHIVE_DIR': archive_dir})
+    try:
+        bot = create_bot(login=False)
+    finally:
+        os.environ['PUBLISH_SINKS'] = 'twitter'
+
+    if [sink.name for sink in bot.sinks] != ['archive']:
+        raise RuntimeError(f"A failed login left sinks {[sink.name for sink in bot.sinks]}, expected only archive")
+
+    state.block += 1
+    report = bot.build_post()
+    if report is None:
+        raise RuntimeError("build_post() failed after a failed login, see the log above")
+
+    statuses = dispatch(report, bot.sinks)
+    if statuses != {'archive': 'sent'} or not os.listdir(archive_dir):
+        raise RuntimeError(f"The archive sink didn't receive the report after a failed login: {statuses}")
+
+
+def bench_pool_count(state, bot, current, pool_count, repeat):
+    """
+    Benchmark the pipeline for one synthetic pool count on a fresh database.
+
+    @returns: Dict of stage => median seconds, None for skipped stages
+    """
+    from bench.fakes import FakeConnection
+    from commands import tvl, collect_snapshot
+    from commands.collect import _balances_cache
+    from utils import database, clear_response_cache
+
+    connection = FakeConnection()
+    database.get_db_connection = lambda: connection
+    database._latest_pools.clear()
+    _balances_cache.clear()
+    clear_response_cache()
+
+    state.pool_count = pool_count
+
+    ##
+    ## the first batch only gives the warm-up run something to compare against
+    tvl(collect_snapshot())
+    state.block += 1
+
+    timings = {stage: [] for stage in STAGES}
+    run_pipeline(bot, current, timings)
+
+    timings = {stage: [] for stage in STAGES}
+    for _ in range(repeat):
+        state.block += 1
+        run_pipeline(bot, current, timings)
+        verify_balances(state)
+        verify_order()
+
+    return {stage: statistics.median(values) if values else None for stage, values in timings.items()}
+
+
+def compare(results, baseline, tolerance):
+    """
+    List stages that got slower than the baseline by more than the tolerance.
+
+    Differences under 5ms are ignored as noise.
+    """
+    regressions = []
+    for pool_count, stages in results.items():
+        for stage, seconds in stages.items():
+            before = baseline.get(pool_count, {}).get(stage)
+            if seconds is None or before is None:
+                continue
+            if seconds > before * (1 + tolerance) and seconds - before > 0.005:
+                regressions.append(f"{stage} at {pool_count} pools: {before * 1000:.1f}ms -> {seconds * 1000:.1f}ms")
+    return regressions
+
+
+def print_table(results):
+    header = f"{'pools':>7} " + ' '.join(f"{stage:>12}" for stage in STAGES) + f" {'total':>12}"
+    print(header)
+    print('-' * len(header))
+    for pool_count, stages in results.items():
+        cells = [f"{stages[stage] * 1000:>10.1f}ms" if stages[stage] is not None else f"{'-':>12}" for stage in STAGES]
+        total = sum(seconds for seconds in stages.values() if seconds is not None)
+        print(f"{pool_count:>7} " + ' '.join(cells) + f" {total * 1000:>10.1f}ms")
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from bench.fakes import FixtureState, start_stand_in
+    from utils.helpers import get_cache_dir
+
+    ##
+    ## resolved before CACHE_DIR is pointed at a scratch directory
+    baseline_path = args.baseline or os.path.join(get_cache_dir(), 'bench_baseline.json')
+
+    state = FixtureState()
+    server, base_url = start_stand_in(state)
+    cache_dir = tempfile.mkdtemp(prefix='ampy-bench-')
+    configure(base_url, cache_dir)
+    if args.indexer:
+        os.environ['INDEXER_ENABLED'] = '1'
+
+    ##
+    ## extra RPC nodes with injected latency, errors and lag, all serving the same chain
+    nodes = []
+    for spec in (args.rpc.split(',') if args.rpc else []):
+        delay_ms, error_rate, lag = (spec.split(':') + ['', ''])[:3]
+        nodes.append(start_stand_in(state, delay=float(delay_ms) / 1000, error_rate=float(error_rate or 0), lag=int(lag or 0)))
+    if nodes:
+        os.environ['RPC_URLS'] = ','.join(f'{url}/rpc' for _, url in nodes)
+
+    from commands import close_collector
+    from commands.collect import get_async_web3
+
+    try:
+        bot = create_bot()
+        current = {}
+        instrument(current)
+
+        results = {}
+        for pool_count in [int(count) for count in args.pools.split(',')]:
+            results[str(pool_count)] = bench_pool_count(state, bot, current, pool_count, args.repeat)
+
+        verify_failed_login(state, cache_dir)
+
+        if nodes:
+            for stats in get_async_web3().provider.get_stats():
+                latency = f"{stats['latency'] * 1000:.1f}ms" if stats['latency'] is not None else '-'
+                print(f"{stats['endpoint']:>22}  latency {latency:>9}  errors {stats['error_rate']:>4.0%}{'  paused' if stats['open'] else ''}")
+    finally:
+        close_collector()
+        server.shutdown()
+        for node, _ in nodes:
+            node.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {baseline_path}")
+        return 0
+
+    try:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        print(f"No baseline at {baseline_path}, run with --save-baseline to create one")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print('Regressions against baseline:')
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+
+    print('No regressions against baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
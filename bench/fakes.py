@@ -0,0 +1,259 @@
+import json
+import random
+import hashlib
+import threading
+import time
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from eth_abi import decode, encode
+from eth_utils import keccak
+from utils.abi import ACCOUNT_BALANCES_ABI
+from utils.multicall import MULTICALL3_ADDRESS
+from commands.collect import ANVIL_CONTRACT
+from utils.storage import SQLiteConnection, create_schema
+
+AGGREGATE3_SELECTOR = keccak(text='aggregate3((address,bool,bytes)[])')[:4]
+ACCOUNT_BALANCES_SELECTOR = keccak(text='accountBalances(address,address)')[:4]
+
+##
+## stands in for whichever collateral manager event a balance change emits, the indexer only looks for the pool address
+BALANCE_CHANGED_TOPIC = '0x' + keccak(text='BalanceChanged(address,uint256)').hex()
+
+
+def pool_address(index):
+    """
+    Deterministic synthetic pool contract address for an index.
+    """
+    return '0x' + hashlib.sha256(f'pool:{index}'.encode()).hexdigest()[:40]
+
+
+def pool_seed(address):
+    return int(hashlib.sha256(address.lower().encode()).hexdigest(), 16)
+
+
+def pool_changes(address):
+    """
+    Whether the pool's balance changes every block, true for about a third of them.
+    """
+    return pool_seed(address) % 3 == 0
+
+
+def pool_balance(address, block):
+    """
+    Deterministic synthetic balance, see pool_changes().
+    """
+    balance = (pool_seed(address) % 10 ** 9) * 10 ** 18
+    if pool_changes(address):
+        balance += block * 10 ** 18
+    return balance
+
+
+class FixtureState:
+    """
+    Shared, mutable state behind the stand-in servers.
+    """
+    def __init__(self, pool_count=10, block=1000000):
+        self.pool_count = pool_count
+        self.block = block
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def pools(self):
+        return [
+            {
+                'id': f'eip155:1:{pool_address(i)}',
+                'entity': {'name': f'Pool {i} Wallet'},
+                'reward_rate': {'7_day': {'label': '5.1%'}, '30_day': {'label': '4.9%'}}
+            }
+            for i in range(self.pool_count)
+        ]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Serves the Flexa, Pyth and Etherscan fixtures over GET and a fake JSON-RPC node over POST.
+    """
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            ##
+            ## the client gave up on this request, e.g. it lost a hedge race
+            pass
+
+    def do_GET(self):
+        state = self.server.state
+        with state.lock:
+            state.requests += 1
+
+        if self.path.startswith('/flexa/collateral_pools'):
+            self.send_json({'data': state.pools()})
+        elif self.path.startswith('/pyth'):
+            self.send_json({'parsed': [{'price': {'price': '512345', 'expo': -8, 'publish_time': int(time.time())}}]})
+        elif self.path.startswith('/etherscan'):
+            self.send_json({'status': '1', 'message': 'OK', 'result': json.dumps(ACCOUNT_BALANCES_ABI)})
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        state = self.server.state
+        with state.lock:
+            state.requests += 1
+
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+
+        ##
+        ## injected faults, to exercise RPC failover
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            self.send_json({'error': 'injected failure'}, 503)
+            return
+
+        if isinstance(request, list):
+            self.send_json([self.handle_rpc(item) for item in request])
+        else:
+            self.send_json(self.handle_rpc(request))
+
+    def handle_rpc(self, request):
+        method = request['method']
+        params = request.get('params', [])
+        response = {'jsonrpc': '2.0', 'id': request['id']}
+
+        if method == 'eth_chainId':
+            response['result'] = '0x1'
+        elif method == 'eth_blockNumber':
+            response['result'] = hex(self.server.state.block)
+        elif method == 'eth_getLogs':
+            response['result'] = self.get_logs(params[0])
+        elif method == 'eth_call':
+            ##
+            ## a lagging node knows the head but has no state for the latest blocks yet
+            block = params[1] if len(params) > 1 else 'latest'
+            if self.server.lag and isinstance(block, str) and block.startswith('0x') and int(block, 16) > self.server.state.block - self.server.lag:
+                response['error'] = {'code': -32000, 'message': 'header not found'}
+            else:
+                response['result'] = '0x' + self.eth_call(params[0], block).hex()
+        else:
+            response['error'] = {'code': -32601, 'message': f'{method} not supported'}
+
+        return response
+
+    def get_logs(self, log_filter):
+        """
+        One log per pool per block its balance changed in, the way pool_balance() changes them.
+        """
+        state = self.server.state
+        addresses = log_filter.get('address') or []
+        if ANVIL_CONTRACT.lower() not in [address.lower() for address in ([addresses] if isinstance(addresses, str) else addresses)]:
+            return []
+
+        from_block = int(log_filter['fromBlock'], 16)
+        to_block = min(int(log_filter['toBlock'], 16), state.block)
+        changing = [pool_address(i) for i in range(state.pool_count) if pool_changes(pool_address(i))]
+
+        logs = []
+        for block in range(from_block, to_block + 1):
+            block_hash = '0x' + hashlib.sha256(f'block:{block}'.encode()).hexdigest()
+            for index, pool in enumerate(changing):
+                logs.append({
+                    'address': ANVIL_CONTRACT,
+                    'topics': [BALANCE_CHANGED_TOPIC, '0x' + '00' * 12 + pool[2:]],
+                    'data': '0x' + encode(['uint256'], [pool_balance(pool, block)]).hex(),
+                    'blockNumber': hex(block),
+                    'blockHash': block_hash,
+                    'transactionHash': '0x' + hashlib.sha256(f'tx:{block}:{index}'.encode()).hexdigest(),
+                    'transactionIndex': hex(index),
+                    'logIndex': hex(index),
+                    'removed': False
+                })
+
+        return logs
+
+    def eth_call(self, tx, block):
+        block = int(block, 16) if isinstance(block, str) and block.startswith('0x') else self.server.state.block
+        data = bytes.fromhex((tx.get('data') or tx.get('input'))[2:])
+        to = tx['to'].lower()
+
+        if to == MULTICALL3_ADDRESS.lower() and data[:4] == AGGREGATE3_SELECTOR:
+            (calls,) = decode(['(address,bool,bytes)[]'], data[4:])
+            results = [(True, self.account_balances(call_data, block)) for _, _, call_data in calls]
+            return encode(['(bool,bytes)[]'], [results])
+
+        if to == ANVIL_CONTRACT.lower() and data[:4] == ACCOUNT_BALANCES_SELECTOR:
+            return self.account_balances(data, block)
+
+        return b''
+
+    def account_balances(self, call_data, block):
+        pool, _ = decode(['address', 'address'], bytes(call_data)[4:])
+        return encode(['uint256', 'uint256'], [0, pool_balance(pool, block)])
+
+
+def start_stand_in(state, delay=0, error_rate=0, lag=0):
+    """
+    Start the stand-in server on a free local port in a background thread.
+
+    @params state: The FixtureState to serve
+    @params delay: Seconds every JSON-RPC request is held before answering
+    @params error_rate: Fraction of JSON-RPC requests answered with a 503
+    @params lag: Blocks the node's state trails the head by, eth_call at a newer block answers header not found
+    @returns: Tuple of (server, base URL)
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.state = state
+    server.delay = delay
+    server.error_rate = error_rate
+    server.lag = lag
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+class FakeConnection(SQLiteConnection):
+    """
+    In-process stand-in for a pooled MySQL connection, backed by an in-memory SQLite database.
+    """
+    def __init__(self):
+        super().__init__(':memory:', check_same_thread=False)
+        create_schema(self)
+
+    def close(self):
+        ##
+        ## handing a pooled connection back, the database itself stays open
+        pass
+
+
+class FakeTwitterAPI:
+    """
+    Stub for the tweepy v1.1 API, only media_upload is used.
+    """
+    def __init__(self):
+        self.uploaded = []
+
+    def media_upload(self, filename, file=None, **kwargs):
+        self.uploaded.append((filename, len(file.read()) if file else 0))
+        return SimpleNamespace(media_id=len(self.uploaded))
+
+
+class FakeTwitterClient:
+    """
+    Stub for the tweepy v2 Client.
+    """
+    def __init__(self):
+        self.tweets = []
+
+    def create_tweet(self, text=None, media_ids=None, **kwargs):
+        self.tweets.append((text, media_ids))
+        return SimpleNamespace(data={'id': str(len(self.tweets))})
+
+    def get_me(self, **kwargs):
+        return SimpleNamespace(data=SimpleNamespace(username='ampy_bench'))
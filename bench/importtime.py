@@ -0,0 +1,103 @@
+"""
+Measure the cold-start import cost of `main.py --check` with `python -X importtime`.
+
+Fails when the imports take longer than the budget, or when a heavy dependency
+that only the tweet path needs gets pulled in at startup. mysql.connector is
+allowed once the MySQL settings are complete, --check reads the schema version.
+
+    python -m bench.importtime --budget-ms 150
+"""
+import os
+import sys
+import argparse
+import subprocess
+from dotenv import load_dotenv
+from utils.check import can_check_schema
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+##
+## none of these are needed to parse arguments or validate the configuration
+FORBIDDEN = ['tweepy', 'web3', 'eth_account', 'aiohttp', 'PIL', 'prettytable', 'numpy', 'mysql', 'requests']
+
+DEFAULT_BUDGET_MS = 150
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Check the startup import time budget')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS, help="maximum total import time in milliseconds")
+    parser.add_argument('--top', type=int, default=10, help="number of slowest top-level imports to list")
+    parser.add_argument('--repeat', type=int, default=3, help="runs to take the fastest of, the first one warms the disk cache")
+    return parser.parse_args()
+
+
+def parse_importtime(output):
+    """
+    Parse -X importtime output.
+
+    @params output: The stderr of the measured process
+    @returns: Tuple of ({top-level module => cumulative microseconds}, set of every module imported)
+    """
+    top_level = {}
+    modules = set()
+
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.add(name.strip())
+
+        ##
+        ## nested imports are indented two spaces per level under their parent
+        if not name.startswith('   '):
+            top_level[name.strip()] = int(cumulative)
+
+    return top_level, modules
+
+
+def measure():
+    """
+    Run `main.py --check` once under -X importtime.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', os.path.join(ROOT, 'main.py'), '--check'],
+        cwd=ROOT,
+        capture_output=True,
+        text=True
+    )
+    return parse_importtime(result.stderr)
+
+
+def main():
+    args = parse_args()
+
+    runs = [measure() for _ in range(max(1, args.repeat))]
+    top_level, modules = min(runs, key=lambda run: sum(run[0].values()))
+    total_ms = sum(top_level.values()) / 1000
+
+    for name, micros in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{micros / 1000:>9.1f}ms  {name}")
+    print(f"{total_ms:>9.1f}ms  total (budget {args.budget_ms:.0f}ms)")
+
+    failed = False
+
+    ##
+    ## with the MySQL settings in place --check reads the schema version, which needs the driver
+    load_dotenv(os.path.join(ROOT, '.env'))
+    forbidden = [name for name in FORBIDDEN if not (name == 'mysql' and can_check_schema())]
+
+    loaded = [name for name in forbidden if name in modules or any(module.startswith(f'{name}.') for module in modules)]
+    if loaded:
+        print(f"Imported at startup but only needed to tweet: {', '.join(loaded)}")
+        failed = True
+
+    if total_ms > args.budget_ms:
+        print(f"Startup imports are over budget by {total_ms - args.budget_ms:.1f}ms")
+        failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,34 @@
-from .apy import apy
-from .tvl import tvl
+import importlib
+
+##
+## resolved on first access, so `import commands` doesn't load web3 until a command runs
+_exports = {
+	'apy': 'apy',
+	'tvl': 'tvl',
+	'preview': 'tvl',
+	'collect': 'collect',
+	'collect_snapshot': 'collect',
+	'close_collector': 'collect'
+}
 
 __all__ = [
 	'apy',
-	'tvl'
-]
\ No newline at end of file
+	'tvl',
+	'preview',
+	'collect',
+	'collect_snapshot',
+	'close_collector'
+]
+
+
+def __getattr__(name):
+	if name not in _exports:
+		raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+	value = getattr(importlib.import_module(f'.{_exports[name]}', __name__), name)
+	globals()[name] = value
+	return value
+
+
+def __dir__():
+	return sorted(set(globals()) | set(__all__))
@@ -1,7 +1,9 @@
-from utils import run_curl
+from utils import run_curl, get_env
+
+FLEXA_POOLS_URL = 'https://api.flexa.co/collateral_pools'
 
 def apy():
-    url = 'https://api.flexa.co/collateral_pools'
+    url = get_env('FLEXA_POOLS_URL') or FLEXA_POOLS_URL
 
     ##
     ## attempt to get data from API
@@ -0,0 +1,229 @@
+from utils.helpers import get_rpc_urls, get_env_int, get_env_float
+from utils.rpc import FailoverProvider
+from utils.price import get_price_data
+from utils.abi import get_abi, ACCOUNT_BALANCES_ABI
+from utils.multicall import async_multicall
+from utils import indexer
+from utils.metrics import span
+from .apy import apy
+from web3 import AsyncWeb3
+import asyncio
+import contextvars
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+ANVIL_CONTRACT = '0x5d2725fdE4d7Aa3388DA4519ac0449Cc031d675f'
+AMP_CONTRACT = '0xff20817765cb7f73d4bde2e66e067e58d11095c2'
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_CONCURRENCY = 4
+
+BALANCES_CACHE_SIZE = 8
+
+##
+## kept across runs by collect_snapshot() so a daemon reuses its connections
+_runner = None
+_w3 = None
+
+##
+## recent balance reads keyed by (block number, calls)
+_balances_cache = OrderedDict()
+
+
+def get_timeout(source):
+    """
+    Retrieves the timeout in seconds for a collection source.
+
+    Parameters
+    ----------
+    source : str
+        The source name, e.g. 'price', 'pools', 'abi' or 'balances'.
+
+    Returns
+    -------
+    float
+        COLLECT_TIMEOUT_<SOURCE> if set, otherwise COLLECT_TIMEOUT, otherwise DEFAULT_TIMEOUT.
+    """
+    return get_env_float(f'COLLECT_TIMEOUT_{source.upper()}', get_env_float('COLLECT_TIMEOUT', DEFAULT_TIMEOUT))
+
+
+def get_concurrency():
+    """
+    Retrieves the maximum number of collection requests in flight at once.
+
+    Returns
+    -------
+    int
+        COLLECT_CONCURRENCY if set, otherwise DEFAULT_CONCURRENCY.
+    """
+    return max(1, get_env_int('COLLECT_CONCURRENCY', DEFAULT_CONCURRENCY))
+
+
+def parse_pools(data):
+    """
+    Build the list of [name, contract address] pairs from the flexa collateral_pools response.
+    """
+    pools = []
+    for pool in data['data']:
+        name = pool['entity']['name']
+
+        ##
+        ## remove wallet from name
+        if 'wallet' in name.lower():
+            name = name.replace('Wallet', '').replace('wallet', '').strip()
+
+        id = pool['id']
+        ids = id.split(':')
+        id = ids[2]
+
+        pools.append([name, id])
+
+    return pools
+
+
+async def collect():
+    """
+    Collect everything a tweet needs with the independent sources fetched concurrently.
+
+    The AMP price, flexa pools, contract ABI and current block number are requested
+    at the same time, then every pool balance is read at that one block so the
+    snapshot is internally consistent. Each source has its own timeout and the
+    number of requests in flight is bounded.
+
+    Returns
+    -------
+    dict
+        {'price', 'price_time', 'pools', 'abi', 'block_number', 'balances'} where
+        price_time is the pyth publish time and balances line up with
+        parse_pools(pools), or {'Status': 'Error', 'Message': <error message>}.
+    """
+    started = time.monotonic()
+    semaphore = asyncio.Semaphore(get_concurrency())
+    w3 = get_async_web3()
+
+    async def run(source, awaitable):
+        async with semaphore:
+            with span('collect', source=source):
+                return await asyncio.wait_for(awaitable, get_timeout(source))
+
+    ##
+    ## the blocking HTTP helpers run in worker threads so they overlap
+    sources = ['price', 'pools', 'abi', 'block']
+    results = await asyncio.gather(
+        run('price', asyncio.to_thread(get_price_data)),
+        run('pools', asyncio.to_thread(apy)),
+        run('abi', asyncio.to_thread(get_abi, ANVIL_CONTRACT, 1, ACCOUNT_BALANCES_ABI)),
+        run('block', w3.eth.block_number),
+        return_exceptions=True
+    )
+
+    for source, result in zip(sources, results):
+        if isinstance(result, BaseException):
+            logger.error(f"Failed to collect {source}: {result!r}")
+            return {'Status': 'Error', 'Message': f"Failed to collect {source}."}
+
+    price_data, pools_data, abi, block_number = results
+
+    if 'Status' in price_data and price_data['Status'] == 'Error':
+        return {'Status': 'Error', 'Message': f"Failed to get AMP price: {price_data['Message']}"}
+
+    if not isinstance(pools_data, dict) or 'data' not in pools_data:
+        return {'Status': 'Error', 'Message': f"Failed to get flexa pools: {pools_data}"}
+
+    ##
+    ## read every pool's balance at the block resolved above
+    contract = w3.eth.contract(address=AsyncWeb3.to_checksum_address(ANVIL_CONTRACT), abi=abi)
+    amp_address = AsyncWeb3.to_checksum_address(AMP_CONTRACT)
+    calls = [(AsyncWeb3.to_checksum_address(pool[1]), amp_address) for pool in parse_pools(pools_data)]
+
+    ##
+    ## balances at a given block never change, so a repeat read is served from memory
+    cache_key = (block_number, tuple(calls))
+    balances = _balances_cache.get(cache_key)
+
+    if balances is None:
+        try:
+            with span('collect', source='balances'):
+                ##
+                ## the indexer only re-reads pools with new events since its checkpoint
+                if indexer.is_enabled():
+                    balances = await asyncio.wait_for(
+                        indexer.read_balances(w3, contract, calls, block_number, concurrency=get_concurrency()),
+                        get_timeout('balances')
+                    )
+                else:
+                    _, balances = await asyncio.wait_for(
+                        async_multicall(w3, contract, 'accountBalances', calls, block_identifier=block_number, concurrency=get_concurrency()),
+                        get_timeout('balances')
+                    )
+        except Exception as e:
+            logger.error(f"Failed to collect balances: {e!r}")
+            return {'Status': 'Error', 'Message': 'Failed to collect balances.'}
+
+        _balances_cache[cache_key] = balances
+        while len(_balances_cache) > BALANCES_CACHE_SIZE:
+            _balances_cache.popitem(last=False)
+    else:
+        logger.info(f"Serving pool balances for block {block_number} from cache")
+
+    logger.info(f"Collected {len(balances)} pool balances at block {block_number} in {time.monotonic() - started:.2f}s")
+
+    return {
+        'price': price_data['price'],
+        'price_time': price_data['publish_time'],
+        'pools': pools_data,
+        'abi': abi,
+        'block_number': block_number,
+        'balances': balances
+    }
+
+
+def get_async_web3():
+    """
+    Retrieves the shared AsyncWeb3 instance so its HTTP sessions stay warm between runs.
+
+    Reads are spread over every endpoint in RPC_URLS (or the single RPC_URL / Alchemy
+    endpoint) by a FailoverProvider, which also keeps each endpoint's latency and
+    error history across runs.
+    """
+    global _w3
+
+    if _w3 is None:
+        _w3 = AsyncWeb3(FailoverProvider(get_rpc_urls()))
+
+    return _w3
+
+
+def collect_snapshot():
+    """
+    Synchronous entry point for collect().
+
+    Every call runs on the same event loop, so the web3 provider's connections
+    are reused by a long running process.
+    """
+    global _runner
+
+    if _runner is None:
+        _runner = asyncio.Runner()
+
+    ##
+    ## run in the caller's context so request_cache() scopes carry over
+    return _runner.run(collect(), context=contextvars.copy_context())
+
+
+def close_collector():
+    """
+    Closes the web3 provider and the event loop used by collect_snapshot().
+    """
+    global _runner, _w3
+
+    if _runner is not None:
+        if _w3 is not None:
+            _runner.run(_w3.provider.disconnect())
+        _runner.close()
+
+    _runner = None
+    _w3 = None
@@ -1,79 +1,42 @@
-from utils import run_curl, save_totals, save_tvl
-from utils.helpers import get_alchemy_key, get_etherscan_key
-from utils.price import get_price
-from web3 import Web3
-import time
+from utils import get_saved_totals, get_snapshot
+from utils import spool
+from utils.helpers import get_env_float
+from utils.amounts import usd_cents, usd_dollars, cents_to_decimal
+from .collect import collect_snapshot, parse_pools
 import logging
 
+##
+## batch id given to a snapshot that is previewed rather than saved, real ids start at 1
+PREVIEW_BATCH_ID = 0
 
-def tvl():
-    amp_price = get_price()
 
-    ##
-    ## attempt to get data from flexa API
-    ## if it fails, return error message
-    data = run_curl('https://api.flexa.co/collateral_pools')
-    
-    if 'Status' in data and data['Status'] == 'Error':
-        return data['Message']
-    
-    ##
-    ## generate array of names and contract addresses
-    pools = []
-    for pool in data['data']:
-        name = pool['entity']['name']
-        
-        ##
-        ## remove wallet from name
-        if 'wallet' in name.lower():
-            name = name.replace('Wallet', '').replace('wallet', '').strip()
-
-        id = pool['id']
-        ids = id.split(':')
-        id = ids[2] 
-        
-        pools.append([name, id])
-        
-    ##
-    ## URL for the API
-    w3 = Web3(Web3.HTTPProvider(f"https://eth-mainnet.g.alchemy.com/v2/{get_alchemy_key()}"))
-    anvil_contract = "0x5d2725fdE4d7Aa3388DA4519ac0449Cc031d675f"
-
-    contract_address = Web3.to_checksum_address(anvil_contract)
-    
-    data = run_curl(f'https://api.etherscan.io/v2/api?chainid=1&module=contract&action=getabi&address=0x5d2725fdE4d7Aa3388DA4519ac0449Cc031d675f&apikey={get_etherscan_key()}')
-    
-    if 'Status' in data and data['Status'] == 'Error':
-        return data['Message']
-    
-    abi = data['result']
+def build_tvl(snapshot):
+    """
+    Value every pool in a collected snapshot.
 
-    ##
-    ## Create contract instance
-    contract = w3.eth.contract(address=contract_address, abi=abi)
+    Balances stay integer wei and USD values are worked out exactly from the
+    Decimal price, rounded to whole dollars per pool and to the cent for the total.
 
-    amp_contract = "0xff20817765cb7f73d4bde2e66e067e58d11095c2"
+    @params snapshot: The dict from collect_snapshot()
+    @returns: Tuple of ([name, contract, amp_total, usd_value] rows, total AMP wei, total USD Decimal)
+    """
+    amp_price = snapshot['price']
+
+    ##
+    ## generate array of names and contract addresses
+    pools = parse_pools(snapshot['pools'])
 
-    amp_address = Web3.to_checksum_address(amp_contract)
+    logging.info(f"Read {len(snapshot['balances'])} pool balances at block {snapshot['block_number']}")
 
     return_data = []
     total_amp_tvl = 0
-    total_usd_tvl = 0
-    for pool in pools:
-
-        time.sleep(1)
-                
-        pool_contract = Web3.to_checksum_address(pool[1])
-
-        ##
-        ## get list of pools and then loop through
-        tvl = contract.functions.accountBalances(pool_contract, amp_address).call()
+    for pool, tvl in zip(pools, snapshot['balances']):
 
         pool_data = [
             pool[0],  # name
             pool[1],  # contract address
             tvl[1],   # amp_amount
-            int(round((tvl[1] / 1e18) * amp_price))  # usd_value
+            usd_dollars(tvl[1], amp_price)  # usd_value
         ]
 
         return_data.append(pool_data)
@@ -81,13 +44,94 @@ def tvl():
         # return_data.append('$' + human_readable(int(round(tvl[1] / 1e18 * amp_price))))
 
         total_amp_tvl += tvl[1]
-        total_usd_tvl += (tvl[1] / 1e18) * amp_price
 
+    ##
+    ## valued from the exact AMP total rather than summing rounded pool values
+    total_usd_tvl = cents_to_decimal(usd_cents(total_amp_tvl, amp_price))
+
+    return return_data, total_amp_tvl, total_usd_tvl
+
+
+def tvl(snapshot=None):
+    """
+    Save a snapshot through the spool.
 
-    insert_totals_id = save_totals(total_amp_tvl, total_usd_tvl)
-    insert_tvl_id = save_tvl(return_data, insert_totals_id)
+    Batches are stored as deltas against the previous one, so the snapshot can
+    only be written after everything spooled before it. The flush here stops
+    starting transactions after SPOOL_INLINE_FLUSH_TIME seconds, and if a long
+    backlog is still ahead of the snapshot, it is left spooled for the daemon's
+    flusher or the next run rather than holding this run up.
+
+    @params snapshot: The dict from collect_snapshot(), collected here if omitted
+    @returns: Dict of totals_id, tvl_id and spooled, or an error message
+    """
+    ##
+    ## collect prices, pools and balances unless the caller already has them
+    if snapshot is None:
+        snapshot = collect_snapshot()
+
+    if 'Status' in snapshot and snapshot['Status'] == 'Error':
+        return snapshot['Message']
+
+    return_data, total_amp_tvl, total_usd_tvl = build_tvl(snapshot)
+
+    ##
+    ## spool the snapshot first so a database outage can't lose the run, then
+    ## write it along with what the budget allows of anything spooled earlier
+    batch_key = spool.append(
+        return_data,
+        total_amp_tvl,
+        total_usd_tvl,
+        block_number=snapshot['block_number'],
+        price=snapshot['price'],
+        price_time=snapshot['price_time']
+    )
+
+    saved = spool.flush(budget=max(0.0, get_env_float('SPOOL_INLINE_FLUSH_TIME', spool.DEFAULT_INLINE_FLUSH_TIME)))
+
+    if batch_key not in saved:
+        ##
+        ## still spooled if the database is down or a backlog is ahead of it, set aside if the snapshot itself won't write
+        return {
+            'totals_id': None,
+            'tvl_id': None,
+            'spooled': spool.is_pending(batch_key)
+        }
+
+    insert_totals_id, insert_tvl_id = saved[batch_key]
 
     return {
         'totals_id': insert_totals_id,
-        'tvl_id': insert_tvl_id
+        'tvl_id': insert_tvl_id,
+        'spooled': False
     }
+
+
+def preview(snapshot):
+    """
+    Lay out a snapshot next to the last saved batch without writing anything.
+
+    The snapshot takes PREVIEW_BATCH_ID as its batch id. If the database can't be
+    read, or is empty, the snapshot is compared against itself so rendering still works.
+
+    @params snapshot: The dict from collect_snapshot()
+    @returns: Tuple of (saved_totals, saved_tvl) shaped like get_saved_totals() and get_saved_tvl()
+    """
+    return_data, total_amp_tvl, total_usd_tvl = build_tvl(snapshot)
+
+    current_totals = (PREVIEW_BATCH_ID, total_amp_tvl, total_usd_tvl)
+    current_tvl = [(None, name, contract, amp, usd, PREVIEW_BATCH_ID) for name, contract, amp, usd in return_data]
+
+    try:
+        saved_totals = get_saved_totals()
+        previous_totals = saved_totals[0] if saved_totals else None
+        previous_tvl = get_snapshot(previous_totals[0]) if previous_totals else []
+    except Exception as e:
+        logging.warning(f"Could not read the last saved batch, comparing the snapshot against itself: {e}")
+        previous_totals = None
+
+    if previous_totals is None:
+        previous_totals = (PREVIEW_BATCH_ID - 1, total_amp_tvl, total_usd_tvl)
+        previous_tvl = [row[:5] + (PREVIEW_BATCH_ID - 1,) for row in current_tvl]
+
+    return [current_totals, previous_totals], previous_tvl + current_tvl
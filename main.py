@@ -1,12 +1,18 @@
 import os
+import sys
+import time
+import signal
 import logging
-import prettytable as pt
-import tweepy
+import argparse
+import threading
 from dotenv import load_dotenv
-from commands import apy, tvl
-from utils import is_dev, get_saved_totals, get_saved_tvl, get_price
-from utils.helpers import human_readable, get_sign
-from PIL import Image, ImageDraw, ImageFont
+from utils import is_dev, request_cache
+from utils.helpers import get_env_int, get_cache_dir
+from utils import metrics
+
+##
+## tweepy, web3, PIL and mysql.connector are imported by the code paths that use
+## them, so --check and failed logins don't pay for loading them
 
 
 ##
@@ -27,8 +33,22 @@ logger = logging.getLogger(__name__)
 
 
 class AmpyJr:
-    def __init__(self):
-        """Initialize the simple Twitter bot using Tweepy v2 client."""
+    def __init__(self, dry_run=False, from_db=False, output_dir=None):
+        """
+        Initialize the simple Twitter bot using Tweepy v2 client.
+
+        Each run is published to every sink in PUBLISH_SINKS, Twitter by default,
+        and Twitter is only logged into when it is one of them.
+
+        In dry run mode Twitter is never contacted: tweet() writes the text and
+        image to output_dir instead of posting, and nothing is saved to the
+        database. With from_db the last two saved batches are rendered without
+        collecting anything.
+        """
+        self.dry_run = dry_run or from_db
+        self.from_db = from_db
+        self.output_dir = output_dir or os.path.join(get_cache_dir(), 'dry_run')
+
         if is_dev():
             self.api_key = os.getenv('DEV_TWITTER_API_KEY')
             self.api_secret = os.getenv('DEV_TWITTER_API_SECRET')
@@ -41,41 +61,90 @@ class AmpyJr:
             self.access_token = os.getenv('TWITTER_ACCESS_TOKEN')
             self.access_token_secret = os.getenv('TWITTER_ACCESS_TOKEN_SECRET')
             self.bot_name = os.getenv('BOT_NAME', 'Ampy Jr.')
-        
-        ##
-        ## Initialize Twitter API v2 client
-        self.client = self._authenticate()
-        
-        if self.client:
-            logger.info(f"Bot '{self.bot_name}' initialized successfully with v2 client!")
-        else:
-            logger.error("Failed to initialize Twitter API v2 client")
+
+        from utils.publish import ArchiveSink, get_sink_names, build_sinks
+
+        self.api = None
+        self.client = None
+        self.publisher = None
+
+        if self.dry_run:
+            self.sinks = [ArchiveSink(self.output_dir, flat=True)]
+            logger.info(f"Bot '{self.bot_name}' initialized in dry run mode, writing to {self.output_dir}")
+            return
+
+        sink_names = get_sink_names()
+
+        if 'twitter' in sink_names:
+            ##
+            ## Initialize Twitter API v2 client
+            self.client = self._authenticate()
+            
+            if self.client:
+                logger.info(f"Bot '{self.bot_name}' initialized successfully with v2 client!")
+            else:
+                ##
+                ## the other sinks still get every report, only twitter is left out
+                logger.error("Failed to initialize Twitter API v2 client, not publishing to twitter")
+                self.publisher = None
+
+        self.sinks = build_sinks(sink_names, self.publisher)
+        logger.info(f"Publishing to {', '.join(sink.name for sink in self.sinks) or 'nothing'}")
     
     def _authenticate(self):
-        """Authenticate with Twitter API v2."""
+        """
+        Authenticate with Twitter API v2.
+
+        get_me() is rate limited, so once the credentials are verified the username
+        is cached and reused until TWITTER_IDENTITY_TTL runs out.
+        """
+        import tweepy
+        import requests
+        import functools
+        from utils.twitter import TwitterPublisher, get_credentials_key, load_identity, save_identity
+        from utils.publish import get_timeout
+
         try:
             ##
             ## Create OAuth 1.0a User Context authentication handler
             auth = tweepy.OAuthHandler(self.api_key, self.api_secret)
             auth.set_access_token(self.access_token, self.access_token_secret)
-            api = tweepy.API(auth)
+
+            ##
+            ## requests end within the twitter sink's timeout, so a hung upload doesn't outlive the dispatch
+            timeout = get_timeout('twitter')
+            api = tweepy.API(auth, timeout=timeout)
             self.api = api
             
             ##
-            ## Create API v2 client
+            ## Create API v2 client, rate limits are handled by the publisher
+            ## rather than by sleeping, and raw responses carry the limit headers
             client = tweepy.Client(
                 consumer_key=self.api_key,
                 consumer_secret=self.api_secret,
                 access_token=self.access_token,
                 access_token_secret=self.access_token_secret,
-                wait_on_rate_limit=True
+                return_type=requests.Response,
+                wait_on_rate_limit=False
             )
+
+            ##
+            ## tweepy.Client has no timeout option, its session gets the same one
+            client.session.request = functools.partial(client.session.request, timeout=timeout)
+            self.publisher = TwitterPublisher(api, client)
+
+            credentials_key = get_credentials_key(self.api_key, self.api_secret, self.access_token, self.access_token_secret)
+            username = load_identity(credentials_key)
+            if username:
+                logger.info(f"Twitter v2 client ready, logged in as: @{username} (verified earlier)")
+                return client
             
             ##
             ## Verify credentials by getting user info
-            me = client.get_me()
-            if me.data:
-                logger.info(f"Twitter v2 authentication successful! Logged in as: @{me.data.username}")
+            me = client.get_me().json().get('data')
+            if me:
+                save_identity(credentials_key, me['username'])
+                logger.info(f"Twitter v2 authentication successful! Logged in as: @{me['username']}")
                 return client
             else:
                 logger.error("Failed to verify Twitter v2 credentials")
@@ -88,216 +157,302 @@ class AmpyJr:
     
     
     
-    def tweet(self):
-        if not self.client:
-            logger.error("Twitter v2 client not initialized")
-            return False
-        
-        tweet_text = ''
-        
-        ##
-        ## Get the current data
-        ## this will save the data to the database
-        tvl_result = tvl()
-        
-        if tvl_result['totals_id'] == None:
-            logger.error("Failed to save TVL data. Exiting.")
-            return
-        
-        if tvl_result['tvl_id'] == None:
-            logger.error("Failed to save TVL data. Exiting.")
-            return
+    def build_post(self):
+        """
+        Collect, compare and render the tweet.
+
+        @returns: The Report every sink is sent, or None if a step failed
+        """
+        from commands import tvl, preview, collect_snapshot
+        from utils import get_saved_totals, get_saved_tvl
+        from utils.report import build_summary, build_pool_rows
+        from utils.render import build_table, render_table
+        from utils.amounts import implied_price
+        from utils.publish import build_report
+
+        if self.from_db:
+            ##
+            ## nothing collected, the price is implied by the current totals
+            ## and there are no APYs to show
+            snapshot = {'pools': {}}
+        else:
+            ##
+            ## Collect price, pools and balances concurrently, once per tweet
+            snapshot = collect_snapshot()
+
+            if 'Status' in snapshot and snapshot['Status'] == 'Error':
+                logger.error(f"Failed to collect data: {snapshot['Message']}. Exiting.")
+                return None
+
+        if self.dry_run and not self.from_db:
+            ##
+            ## compare against the last saved batch without saving this one
+            saved_totals, saved_tvl = preview(snapshot)
+        else:
+            if not self.dry_run:
+                ##
+                ## Get the current data
+                ## this will save the data to the database
+                tvl_result = tvl(snapshot)
+                
+                ##
+                ## tvl_id is None when no pool balance changed, which is fine
+                if tvl_result['spooled']:
+                    logger.error("The snapshot couldn't be saved yet, it is spooled and will be saved by the next flush. Exiting.")
+                    return None
+
+                if tvl_result['totals_id'] == None:
+                    logger.error("Failed to save TVL data. Exiting.")
+                    return None
+
+            ##
+            ## Get the last two entries so we can compare
+            saved_totals = get_saved_totals()
+            
+            if not saved_totals or len(saved_totals) < 2:
+                logger.error("Insufficient saved totals data. Need at least 2 records to compare.")
+                return None
+            
+            ##
+            ## Get TVL data for both batches and validate
+            saved_tvl = get_saved_tvl(saved_totals[0][0], saved_totals[1][0])
+            
+            if not saved_tvl:
+                logger.error("No TVL data found for the specified batch IDs.")
+                return None
+
+        if self.from_db:
+            snapshot['price'] = implied_price(saved_totals[0][1], saved_totals[0][2])
 
-        ##
-        ## Get the last two entries so we can compare
-        saved_totals = get_saved_totals()
-        
-        if not saved_totals or len(saved_totals) < 2:
-            logger.error("Insufficient saved totals data. Need at least 2 records to compare.")
-            return
-        
         ##
         ## Extract batch IDs for current and previous records
         current_batch_id = saved_totals[0][0]
         previous_batch_id = saved_totals[1][0]
-        
+
         ##
-        ## Get TVL data for both batches and validate
-        saved_tvl = get_saved_tvl(current_batch_id, previous_batch_id)
-        
-        if not saved_tvl:
-            logger.error("No TVL data found for the specified batch IDs.")
-            return
+        ## Build the tweet text and table rows from the two batches
+        tweet_text = build_summary(saved_totals, snapshot['price'])
+        current_tvl = build_pool_rows(saved_tvl, current_batch_id, previous_batch_id, snapshot['pools'])
 
         ##
-        ## Calculate the total spending capacity and change.
-        current_spending = float(saved_totals[0][2])
-        previous_spending = float(saved_totals[1][2])
-            
-        total_spending = f"${human_readable(current_spending)}"
+        ## create table and render it
+        table = build_table(current_tvl)
+
+        logger.info(table)
 
-        tweet_text += f"Spending Capacity: {total_spending}\n"
+        img = render_table(table)
 
         ##
-        ## staked amp total and change
-        current_amp = float(saved_totals[0][1]) / 1e18
-        previous_amp = float(saved_totals[1][1]) / 1e18
+        ## rendered and encoded once, however many sinks it goes to
+        return build_report(tweet_text, table, img, batch_id=current_batch_id or None)
 
-        total_amp_change = abs(current_amp - previous_amp)
-        sign = get_sign(current_amp, previous_amp)
+    def tweet(self):
+        """
+        Collect and render once, then publish the report to every sink concurrently.
 
-        if total_amp_change == 0:
-            total_amp_change = 0
-            sign = ''
+        @returns: True if at least one sink took the report, a failing sink doesn't
+                  fail the run once another has published it
+        """
+        from utils.publish import dispatch
 
-        amp_price = get_price()
+        if not self.sinks:
+            logger.error("No sinks to publish to")
+            return False
 
-        if amp_price == None:
-            logger.error("Failed to get AMP price. Exiting.")
+        report = self.build_post()
+        if report is None:
             return
 
-        total_amp = f"{human_readable(current_amp)} ({sign}{human_readable(total_amp_change)} AMP, ${human_readable(total_amp_change * amp_price)} USD)"
+        statuses = dispatch(report, self.sinks)
 
-        tweet_text += f"Staked AMP: {total_amp}\n"
+        if self.dry_run:
+            print(report.text)
+            logger.info(f"Dry run written to {os.path.join(self.output_dir, report.filename)}")
+        else:
+            logger.info(f"Published: {', '.join(f'{name} {status}' for name, status in statuses.items())}")
 
-        ##
-        ## setup the output array for the image. 
-        apy_result = apy()
-        current_tvl = []
-        for i in range(len(saved_tvl)):
-            if saved_tvl[i][5] == current_batch_id:
-                current_pool_capacity = float(saved_tvl[i][4])
-                current_pool_amp = float(saved_tvl[i][3]) / 1e18
-                
-                ##
-                ## Find matching APY for this pool
-                pool_name = saved_tvl[i][1]
-                pool_apy = 'N/A'
-                
-                for apy_pool in apy_result['data']:
-                    if apy_pool['entity']['name'] == pool_name:
-                        apy_short = apy_pool['reward_rate']['7_day']['label']
-                        apy_long = apy_pool['reward_rate']['30_day']['label']
-                        break
-                
-                ##
-                ## Find how many amp from last jawn.
-                previous_pool_amp = 0
-                for j in range(len(saved_tvl)):
-                    if saved_tvl[j][5] == previous_batch_id and saved_tvl[j][1] == pool_name:
-                        previous_pool_amp = float(saved_tvl[j][3]) / 1e18
-                        break
-                
-                current_pool_amp_change = abs(current_pool_amp - previous_pool_amp)
-                sign = get_sign(current_pool_amp, previous_pool_amp)
-
-                if current_pool_amp_change == 0:
-                    current_pool_amp_change = 0
-                    sign = ''
-                else:
-                    current_pool_amp_change = f"{sign}{human_readable(current_pool_amp_change)}"
-
-                current_tvl.append([
-                    saved_tvl[i][1],
-                    apy_long,
-                    f"${human_readable(current_pool_capacity)}",
-                    human_readable(current_pool_amp),
-                    current_pool_amp_change
-                ])
-        ##
-        ## create table
-        ## setup columns and alignment
-        table = pt.PrettyTable(['Pool', '30D', 'USD', 'AMP', 'Change'])
-        table.align['Pool'] = 'l'
-        table.align['30D'] = 'r'
-        table.align['USD'] = 'r'
-        table.align['AMP'] = 'r'
-        table.align['Change'] = 'r'
-        table.padding_width = 1
-        table.header_style = 'upper'
-        
+        return any(status != 'failed' for status in statuses.values())
 
-        ##
-        ## add rows to table
-        for row in current_tvl:
-            table.add_row(row)
 
-        logger.info(table)
+def parse_args():
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(description='Ampy Jr. Twitter bot')
+    parser.add_argument('env', nargs='?', choices=['dev'], help="run against the dev Twitter account and database")
+    parser.add_argument('--daemon', action='store_true', help="stay running and tweet on a schedule")
+    parser.add_argument('--interval', type=int, default=get_env_int('TWEET_INTERVAL_MINUTES', 60), help="minutes between tweets in daemon mode")
+    parser.add_argument('--check', action='store_true', help="validate the configuration and exit without tweeting")
+    parser.add_argument('--dry-run', action='store_true', help="collect and render without saving or posting, skips Twitter login")
+    parser.add_argument('--from-db', action='store_true', help="dry run that renders the last two saved batches without collecting")
+    parser.add_argument('--output', default=None, help="directory dry runs write tweet.txt and the image to, defaults to cache/dry_run")
+    return parser.parse_args()
+
+
+def get_last_run_path():
+    """Path of the file recording when the daemon last tweeted successfully."""
+    return os.path.join(get_cache_dir(), 'last_run_dev' if is_dev() else 'last_run')
+
+
+def load_last_run():
+    """Timestamp of the last successful daemon run, or None if there isn't one."""
+    try:
+        with open(get_last_run_path()) as f:
+            return float(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def save_last_run(timestamp):
+    """Record the timestamp of a successful daemon run."""
+    path = get_last_run_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(str(timestamp))
+    except OSError as e:
+        logger.warning(f"Failed to record last run: {e}")
 
-        base_dir = os.path.dirname(__file__)
-        font_path = os.path.join(base_dir, "UbuntuMono-R.ttf")
-            
-        fnt = ImageFont.truetype(os.path.abspath(font_path), 30)
-        
-        ##
-        ## create a blank image that we can measure the text bounding box
-        img = Image.new('RGB', (1000, 1000), color = (255, 255, 255))
-        d = ImageDraw.Draw(img)
-        bbox = d.textbbox((0, 0), f'{table}', font=fnt)
-        
-        ##
-        ## create the final image
-        img = Image.new('RGB', (bbox[2] + 40, bbox[3] + 40), color = (255, 255, 255))
-        d = ImageDraw.Draw(img)
-        d.multiline_text((20, 20), f'{table}', font=fnt, fill=(0, 0, 0))
 
-        img_path = os.path.join(base_dir, f'img/twitter.jpg')
-        img.save(img_path, 'JPEG')
+def run_once(bot):
+    """Collect, render and post a single tweet, then write out its timings."""
+    try:
+        with request_cache(), metrics.span('tweet'):
+            return bot.tweet()
+    finally:
+        if metrics.is_enabled():
+            timings = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in metrics.summarize().items())
+            logger.info(f"Run timings: {timings}")
+            metrics.flush()
 
-        media = self.api.media_upload(filename=img_path)
-        
+
+def run_daemon(bot, interval):
+    """
+    Keep the bot warm in memory and tweet every `interval` minutes.
+
+    The authenticated Twitter clients, web3 provider, database pool and font stay
+    loaded between runs, and background threads flush the snapshot spool and post
+    queued tweets. If the last successful run is older than one interval at
+    startup (e.g. after a restart or downtime) a tweet is posted straight away.
+    SIGINT/SIGTERM let the current run finish and then exit.
+    """
+    import schedule
+
+    stop = threading.Event()
+
+    def shutdown(signum, frame):
+        logger.info(f"Received signal {signum}, shutting down after the current run...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    def job():
+        if stop.is_set():
+            return
+
+        logger.info("Posting scheduled tweet...")
+
+        ##
+        ## an exception escaping here would end schedule.run_pending() and the daemon with it
         try:
+            posted = run_once(bot)
+        except Exception:
+            logger.exception("❌ Scheduled tweet raised, the daemon keeps running.")
+            return
+
+        if posted:
             ##
-            ## Post the tweet using v2 API
+            ## a dry run mustn't stop a real bot from catching up
+            if not bot.dry_run:
+                save_last_run(time.time())
+        else:
+            logger.error("❌ Failed to post scheduled tweet. Check the error above.")
 
-            response = self.client.create_tweet(
-                text=tweet_text,
-                media_ids=[media.media_id]
-            )
-            if response.data:
-                logger.info(f"Tweet posted successfully: {response.data['id']}")
-                return True
-            else:
-                logger.error("Tweet response didn't contain data")
-                return False
-            
-        except tweepy.errors.Forbidden as e:
-            if "453" in str(e):
-                logger.error("❌ Twitter API Error 453: Your API access level doesn't include posting tweets")
-                logger.error("You need 'Elevated' or 'Enterprise' access to post tweets")
-                logger.error("Visit: https://developer.twitter.com/en/portal/products")
-            else:
-                logger.error(f"❌ Twitter API Forbidden Error: {e}")
-            return False
-            
-        except tweepy.errors.Unauthorized as e:
-            logger.error(f"❌ Twitter API Unauthorized: {e}")
-            logger.error("Check your API credentials in the .env file")
-            return False
-            
-        except Exception as e:
-            logger.error(f"❌ Unexpected error posting tweet: {e}")
-            return False
+    schedule.every(interval).minutes.do(job)
+
+    ##
+    ## write snapshots spooled during a database outage as soon as it is back
+    if not bot.dry_run:
+        from utils.spool import start_flusher
+        start_flusher(stop)
+
+    ##
+    ## and post tweets held back by a rate limit once it resets, between scheduled runs
+    if bot.publisher is not None:
+        from utils.twitter import start_publisher
+        start_publisher(stop, bot.publisher)
+
+    ##
+    ## catch up on a run missed while the bot was down
+    last_run = load_last_run()
+    if last_run is None or time.time() - last_run >= interval * 60:
+        logger.info("Last run is overdue, posting now...")
+        job()
+
+    logger.info(f"Bot running as a daemon, tweeting every {interval} minutes")
+
+    while not stop.is_set():
+        schedule.run_pending()
+
+        idle = schedule.idle_seconds()
+        stop.wait(min(max(idle if idle is not None else 1, 1), 30))
+
+    schedule.clear()
+
+
+def run_check():
+    """Log every configuration problem, returning 1 if any of them would stop the bot."""
+    from utils.check import check_config
+
+    problems = check_config()
+    for level, message in problems:
+        getattr(logger, level)(message)
+
+    if any(level == 'error' for level, _ in problems):
+        logger.error("Configuration check failed.")
+        return 1
+
+    logger.info("Configuration OK.")
+    return 0
+
+
+def close_collector():
+    """Close the collector's web3 provider and event loop, if a run ever loaded them."""
+    if 'commands.collect' in sys.modules:
+        from commands import close_collector
+        close_collector()
 
 
 def main():
     """Main function to run the bot."""   
+    args = parse_args()
+
+    if args.check:
+        return run_check()
+
     ##
     ## Initialize bot
-    bot = AmpyJr()
+    bot = AmpyJr(dry_run=args.dry_run, from_db=args.from_db, output_dir=args.output)
     
-    if not bot.client:
+    if not bot.sinks:
         logger.error("Bot initialization failed. Exiting.")
         return
 
-    ##
-    ## Tweet immediately when starting
-    logger.info("Posting tweet...")
-    if not bot.tweet():
-        logger.error("❌ Failed to post initial tweet. Check the error above.")
-        return
+    try:
+        if args.daemon:
+            run_daemon(bot, args.interval)
+            logger.info("Bot stopped.")
+            return
+
+        ##
+        ## Tweet immediately when starting
+        logger.info("Posting tweet...")
+        if not run_once(bot):
+            logger.error("❌ Failed to post initial tweet. Check the error above.")
+            return
+    finally:
+        close_collector()
     
     logger.info("Bot completed successfully!")
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -1,6 +1,5 @@
 #!/bin/bash
 
-ENV=${1:-}
 echo "🤖 Starting AMPY Jr. Twitter bot..."
 
 ##
@@ -32,4 +31,4 @@ fi
 ##
 ## Run the bot
 echo "🚀 Starting bot"
-python main.py $ENV
+python main.py "$@"
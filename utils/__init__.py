@@ -1,18 +1,61 @@
-from .helpers import run_curl, is_dev, get_alchemy_key, get_etherscan_key, get_env, human_readable, get_sign
-from .database import save_totals, save_tvl, get_saved_totals, get_saved_tvl
-from .price import get_price
+import importlib
+
+##
+## names are resolved from their submodule on first access, so importing a light
+## helper doesn't pull in mysql.connector, requests or anything else it doesn't use
+_exports = {
+	'run_curl': 'helpers',
+	'request_cache': 'helpers',
+	'clear_response_cache': 'helpers',
+	'is_dev': 'helpers',
+	'get_alchemy_key': 'helpers',
+	'get_rpc_url': 'helpers',
+	'get_etherscan_key': 'helpers',
+	'get_env': 'helpers',
+	'human_readable': 'helpers',
+	'get_sign': 'helpers',
+	'save_totals': 'database',
+	'save_tvl': 'database',
+	'save_batches': 'database',
+	'get_saved_totals': 'database',
+	'get_saved_tvl': 'database',
+	'get_snapshot': 'database',
+	'get_totals_series': 'database',
+	'get_pool_series': 'database',
+	'get_price': 'price'
+}
 
 __all__ = [
 	'run_curl',
+	'request_cache',
+	'clear_response_cache',
 	'is_dev',
 	'get_alchemy_key',
+	'get_rpc_url',
 	'get_etherscan_key',
 	'get_env',
 	'human_readable',
 	'save_totals',
 	'save_tvl',
+	'save_batches',
 	'get_saved_totals',
 	'get_saved_tvl',
+	'get_snapshot',
+	'get_totals_series',
+	'get_pool_series',
 	'get_sign',
 	'get_price'
-]
\ No newline at end of file
+]
+
+
+def __getattr__(name):
+	if name not in _exports:
+		raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+	value = getattr(importlib.import_module(f'.{_exports[name]}', __name__), name)
+	globals()[name] = value
+	return value
+
+
+def __dir__():
+	return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from utils.helpers import run_curl, get_env, get_env_int, get_etherscan_key, get_cache_dir, write_atomic
+
+logger = logging.getLogger(__name__)
+
+ETHERSCAN_API_URL = 'https://api.etherscan.io/v2/api'
+
+##
+## minimal ABI used when nothing is cached and etherscan can't be reached.
+## only covers the accountBalances getter, which is all tvl() needs.
+ACCOUNT_BALANCES_ABI = [
+    {
+        'name': 'accountBalances',
+        'type': 'function',
+        'stateMutability': 'view',
+        'inputs': [
+            {'name': '', 'type': 'address'},
+            {'name': '', 'type': 'address'}
+        ],
+        'outputs': [
+            {'name': '', 'type': 'uint256'},
+            {'name': '', 'type': 'uint256'}
+        ]
+    }
+]
+
+
+def get_abi_cache_dir():
+    """
+    Retrieves the directory ABIs are cached in.
+
+    Returns
+    -------
+    str
+        The ABI_CACHE_DIR environment variable, or abi/ inside the cache directory.
+    """
+    return get_env('ABI_CACHE_DIR') or os.path.join(get_cache_dir(), 'abi')
+
+
+def get_abi_cache_ttl():
+    """
+    Retrieves how long a cached ABI is considered fresh.
+
+    Returns
+    -------
+    int or None
+        The TTL in seconds from ABI_CACHE_TTL, or None if cached ABIs never expire.
+    """
+    ttl = get_env_int('ABI_CACHE_TTL', 0)
+    return ttl if ttl > 0 else None
+
+
+def get_abi_cache_path(chain_id, address):
+    """
+    Build the cache file path for a contract ABI.
+
+    Parameters
+    ----------
+    chain_id : int
+        The chain the contract is deployed on.
+    address : str
+        The contract address.
+
+    Returns
+    -------
+    str
+        The path of the cache file, named by the sha256 of chain id + lowercased address.
+    """
+    key = hashlib.sha256(f"{chain_id}:{address.lower()}".encode()).hexdigest()
+    return os.path.join(get_abi_cache_dir(), f"{key}.json")
+
+
+def read_cached_abi(chain_id, address, ttl=None):
+    """
+    Read an ABI from the on-disk cache.
+
+    Parameters
+    ----------
+    chain_id : int
+        The chain the contract is deployed on.
+    address : str
+        The contract address.
+    ttl : int
+        Maximum age in seconds, or None to accept any age.
+
+    Returns
+    -------
+    list or None
+        The cached ABI, or None if it is missing, unreadable or older than ttl.
+    """
+    try:
+        with open(get_abi_cache_path(chain_id, address)) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if ttl is not None and time.time() - entry.get('fetched_at', 0) > ttl:
+        return None
+
+    return entry.get('abi')
+
+
+def write_cached_abi(chain_id, address, abi):
+    """
+    Write an ABI to the on-disk cache atomically.
+
+    Parameters
+    ----------
+    chain_id : int
+        The chain the contract is deployed on.
+    address : str
+        The contract address.
+    abi : list
+        The contract ABI.
+    """
+    try:
+        write_atomic(get_abi_cache_path(chain_id, address), json.dumps({
+            'chain_id': chain_id,
+            'address': address,
+            'fetched_at': time.time(),
+            'abi': abi
+        }))
+    except OSError as e:
+        logger.warning(f"Failed to cache ABI for {address}: {e}")
+
+
+def fetch_abi(chain_id, address):
+    """
+    Fetch a verified contract ABI from etherscan.
+
+    Parameters
+    ----------
+    chain_id : int
+        The chain the contract is deployed on.
+    address : str
+        The contract address.
+
+    Returns
+    -------
+    list or None
+        The contract ABI, or None if etherscan returned an error.
+    """
+    base_url = get_env('ETHERSCAN_API_URL') or ETHERSCAN_API_URL
+    data = run_curl(f'{base_url}?chainid={chain_id}&module=contract&action=getabi&address={address}&apikey={get_etherscan_key()}')
+
+    if 'Status' in data and data['Status'] == 'Error':
+        logger.warning(f"Etherscan ABI request failed: {data['Message']}")
+        return None
+
+    ##
+    ## etherscan answers 200 with status 0 when rate limited
+    if str(data.get('status')) != '1':
+        logger.warning(f"Etherscan ABI request failed: {data.get('result')}")
+        return None
+
+    try:
+        return json.loads(data['result'])
+    except (TypeError, ValueError) as e:
+        logger.warning(f"Etherscan returned an invalid ABI: {e}")
+        return None
+
+
+def get_abi(address, chain_id=1, fallback=None):
+    """
+    Get a contract ABI, preferring the on-disk cache over etherscan.
+
+    A fresh cache entry is returned without any network I/O. Otherwise the ABI is
+    fetched from etherscan and cached; if that fails, a stale cache entry or the
+    fallback ABI is used instead.
+
+    Parameters
+    ----------
+    address : str
+        The contract address.
+    chain_id : int
+        The chain the contract is deployed on.
+    fallback : list
+        The ABI to return when neither the cache nor etherscan can provide one.
+
+    Returns
+    -------
+    list or None
+        The contract ABI.
+    """
+    abi = read_cached_abi(chain_id, address, get_abi_cache_ttl())
+    if abi:
+        return abi
+
+    abi = fetch_abi(chain_id, address)
+    if abi:
+        write_cached_abi(chain_id, address, abi)
+        return abi
+
+    abi = read_cached_abi(chain_id, address)
+    if abi:
+        logger.warning(f"Using stale cached ABI for {address}")
+        return abi
+
+    logger.warning(f"Using bundled fallback ABI for {address}")
+    return fallback
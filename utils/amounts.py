@@ -0,0 +1,152 @@
+from decimal import Decimal
+from fractions import Fraction
+
+##
+## AMP has 18 decimals, balances are kept as integer wei end to end
+AMP_DECIMALS = 18
+WEI_PER_AMP = 10 ** AMP_DECIMALS
+
+##
+## totals.usd is DECIMAL(20, 2), so USD totals are exact to the cent
+USD_DECIMALS = 2
+CENTS_PER_USD = 10 ** USD_DECIMALS
+
+##
+## thresholds for the K / M / B suffixes human_readable() uses, largest first
+SUFFIXES = ((10 ** 9, 'B'), (10 ** 6, 'M'), (10 ** 3, 'K'))
+
+
+def round_div(numerator, denominator):
+    """
+    Integer division rounding half away from zero, for a positive denominator.
+    """
+    if numerator < 0:
+        return -((-numerator * 2 + denominator) // (denominator * 2))
+    return (numerator * 2 + denominator) // (denominator * 2)
+
+
+def parse_price(price, expo):
+    """
+    Exact price from a Pyth integer price and exponent, e.g. (512345, -8) => Decimal('0.00512345').
+    """
+    return Decimal(int(price)).scaleb(int(expo))
+
+
+def to_scaled(value, decimals):
+    """
+    Convert a DB or API value (int, Decimal, str or float) to an integer with `decimals` implied places.
+
+    Floats go through their shortest repr, so a DOUBLE read back from MySQL
+    converts to the decimal that was written.
+    """
+    if isinstance(value, int):
+        return value * 10 ** decimals
+
+    scaled = Fraction(Decimal(str(value))) * 10 ** decimals
+    return round_div(scaled.numerator, scaled.denominator)
+
+
+def to_wei(value):
+    """
+    Convert a stored AMP amount (DECIMAL(40, 0), text or int) to integer wei.
+    """
+    return value if isinstance(value, int) else int(Decimal(str(value)))
+
+
+def to_price(value):
+    """
+    Convert a stored or fetched price to an exact Fraction, None stays None.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (Fraction, int)):
+        return Fraction(value)
+    return Fraction(Decimal(str(value)))
+
+
+def implied_price(amp_wei, usd):
+    """
+    The AMP price implied by a batch's totals, for batches saved before prices were recorded.
+
+    @params amp_wei: The total AMP in wei
+    @params usd: The total USD value
+    @returns: Fraction USD per AMP, 0 if there is no AMP
+    """
+    amp_wei = to_wei(amp_wei)
+    if not amp_wei:
+        return Fraction(0)
+    return Fraction(to_scaled(usd, USD_DECIMALS), CENTS_PER_USD) * WEI_PER_AMP / amp_wei
+
+
+def usd_cents(amp_wei, price):
+    """
+    Exact USD value of an AMP amount, rounded to the cent.
+
+    @params amp_wei: The AMP amount in wei
+    @params price: USD per AMP as a Decimal, Fraction or int
+    @returns: int cents
+    """
+    numerator, denominator = to_price(price).as_integer_ratio()
+    return round_div(amp_wei * numerator * CENTS_PER_USD, WEI_PER_AMP * denominator)
+
+
+def usd_dollars(amp_wei, price):
+    """
+    USD value of an AMP amount rounded to whole dollars, as stored in tvl.usd.
+    """
+    numerator, denominator = to_price(price).as_integer_ratio()
+    return round_div(amp_wei * numerator, WEI_PER_AMP * denominator)
+
+
+def cents_to_decimal(cents):
+    """
+    Integer cents as a Decimal with two places, ready for a DECIMAL(20, 2) column.
+    """
+    return Decimal(cents).scaleb(-USD_DECIMALS)
+
+
+def format_scaled(value, decimals=0):
+    """
+    human_readable() for an exact integer with `decimals` implied places, e.g. wei with 18.
+
+    Picks the suffix from the unrounded value and rounds half up to one decimal,
+    dropping a trailing .0, so 1,250,000 AMP formats as "1.3M" and 2,000 as "2K".
+    """
+    return format_column([value], decimals)[0]
+
+
+def format_column(values, decimals=0):
+    """
+    Format a whole column of exact integers the way human_readable() formats numbers.
+
+    The suffix thresholds are scaled once per column, so each cell costs a few
+    integer comparisons and one division however many rows there are.
+
+    @params values: Iterable of ints with `decimals` implied places
+    @params decimals: 18 for AMP wei, 2 for USD cents, 0 for whole units
+    @returns: List of strings, e.g. ['1.2M', '950', '-3K']
+    """
+    unit = 10 ** decimals
+    thresholds = [(threshold * unit, suffix) for threshold, suffix in SUFFIXES]
+    half_unit = unit // 2 if unit > 1 else 0
+
+    formatted = []
+    append = formatted.append
+    for value in values:
+        negative = value < 0
+        magnitude = -value if negative else value
+
+        for threshold, suffix in thresholds:
+            if magnitude >= threshold:
+                tenths = (magnitude * 20 + threshold) // (threshold * 2)
+                whole, tenth = divmod(tenths, 10)
+                text = f"{whole}{suffix}" if tenth == 0 else f"{whole}.{tenth}{suffix}"
+                break
+        else:
+            whole = (magnitude + half_unit) // unit
+            negative = negative and whole != 0
+            text = str(whole)
+
+        append(f"-{text}" if negative else text)
+
+    return formatted
@@ -0,0 +1,226 @@
+import logging
+import argparse
+from datetime import datetime, timezone
+import numpy as np
+from PIL import Image, ImageDraw
+from utils.database import get_pool_series, DEFAULT_SERIES_POINTS
+from utils.helpers import human_readable
+from utils.render import load_font
+
+logger = logging.getLogger(__name__)
+
+WIDTH = 1600
+HEIGHT = 900
+MARGIN_LEFT = 130
+MARGIN_RIGHT = 330
+MARGIN_TOP = 90
+MARGIN_BOTTOM = 70
+
+##
+## pools beyond this many are stacked together as "Other"
+MAX_POOLS = 8
+
+COLORS = [
+    (31, 119, 180), (255, 127, 14), (44, 160, 44), (214, 39, 40),
+    (148, 103, 189), (140, 86, 75), (227, 119, 194), (23, 190, 207),
+    (160, 160, 160)
+]
+
+
+def moving_average(values, window):
+    """
+    Trailing moving average, with an expanding window for the first points.
+
+    @params values: 1-d numpy array
+    @params window: The number of points to average over
+    @returns: numpy array the same length as values
+    """
+    values = values.astype(float)
+    if window <= 1 or len(values) == 0:
+        return values
+
+    window = min(window, len(values))
+    cumsum = np.cumsum(np.insert(values, 0, 0.0))
+    head = cumsum[1:window] / np.arange(1, window)
+    tail = (cumsum[window:] - cumsum[:-window]) / window
+
+    return np.concatenate([head, tail])
+
+
+def build_series(totals, pools, max_pools=MAX_POOLS, ma_window=None):
+    """
+    Turn the rows from get_pool_series() into numpy arrays for charting.
+
+    @params totals: The totals series from get_pool_series()
+    @params pools: The per-pool series from get_pool_series()
+    @params max_pools: The number of largest pools to keep, the rest are summed into "Other"
+    @params ma_window: Moving average window in points, defaults to a tenth of the series
+    @returns: Dict of numpy arrays: timestamps, total_amp, total_usd, usd_ma, amp_ma,
+              plus names with matching pool_amp / pool_usd rows (pools x points)
+    """
+    count = len(totals)
+    timestamps = np.fromiter((point['timestamp'] for point in totals), dtype=np.int64, count=count)
+    total_amp = np.array([point['amp'] for point in totals], dtype=float) / 1e18
+    total_usd = np.array([point['usd'] for point in totals], dtype=float)
+
+    keys = list(pools)
+    names = [pools[key]['name'] for key in keys]
+    pool_amp = np.array([pools[key]['amp'] for key in keys], dtype=float).reshape(len(keys), count) / 1e18
+    pool_usd = np.array([pools[key]['usd'] for key in keys], dtype=float).reshape(len(keys), count)
+
+    ##
+    ## largest pools by latest USD first, everything past max_pools folded into one row
+    if len(keys):
+        order = np.argsort(-pool_usd[:, -1])
+        pool_amp, pool_usd = pool_amp[order], pool_usd[order]
+        names = [names[i] for i in order]
+
+        if len(keys) > max_pools:
+            pool_amp = np.vstack([pool_amp[:max_pools], pool_amp[max_pools:].sum(axis=0)])
+            pool_usd = np.vstack([pool_usd[:max_pools], pool_usd[max_pools:].sum(axis=0)])
+            names = names[:max_pools] + ['Other']
+
+    ma_window = ma_window or max(1, count // 10)
+
+    return {
+        'timestamps': timestamps,
+        'total_amp': total_amp,
+        'total_usd': total_usd,
+        'usd_ma': moving_average(total_usd, ma_window),
+        'amp_ma': moving_average(total_amp, ma_window),
+        'names': names,
+        'pool_amp': pool_amp,
+        'pool_usd': pool_usd
+    }
+
+
+def format_timestamp(timestamp, span):
+    """
+    Axis label for a timestamp, showing the time of day for windows of two days or less.
+    """
+    moment = datetime.fromtimestamp(int(timestamp), tz=timezone.utc)
+    return moment.strftime('%H:%M' if span <= 2 * 86400 else '%b %d')
+
+
+def render_chart(series, title='', value='usd'):
+    """
+    Draw a stacked area chart of per-pool values with the total's moving average on top.
+
+    @params series: The dict from build_series()
+    @params title: Text drawn above the chart
+    @params value: 'usd' or 'amp'
+    @returns: The PIL Image
+    """
+    img = Image.new('RGB', (WIDTH, HEIGHT), color = (255, 255, 255))
+    d = ImageDraw.Draw(img)
+    fnt = load_font(22)
+    title_fnt = load_font(32)
+
+    x0, x1 = MARGIN_LEFT, WIDTH - MARGIN_RIGHT
+    y0, y1 = MARGIN_TOP, HEIGHT - MARGIN_BOTTOM
+
+    d.text((MARGIN_LEFT, 25), title, font=title_fnt, fill=(0, 0, 0))
+
+    timestamps = series['timestamps']
+    if len(timestamps) == 0:
+        d.text((x0, y0), 'No data for this window', font=fnt, fill=(0, 0, 0))
+        return img
+
+    pool_values = series[f'pool_{value}']
+    total = series[f'total_{value}']
+    average = series[f'{value}_ma']
+    prefix = '$' if value == 'usd' else ''
+
+    stacked = np.cumsum(pool_values, axis=0) if len(pool_values) else np.zeros((0, len(timestamps)))
+    top = max(float(stacked[-1].max()) if len(stacked) else 0.0, float(total.max()))
+    top = top * 1.05 or 1.0
+
+    ##
+    ## map every point to pixels at once
+    span = max(int(timestamps[-1] - timestamps[0]), 1)
+    xs = x0 + (timestamps - timestamps[0]) / span * (x1 - x0)
+
+    def to_y(values):
+        return y1 - values / top * (y1 - y0)
+
+    ##
+    ## horizontal grid lines and value labels
+    for tick in np.linspace(0, top, 6):
+        y = float(to_y(tick))
+        d.line([(x0, y), (x1, y)], fill=(225, 225, 225), width=1)
+        label = f"{prefix}{human_readable(tick)}"
+        d.text((x0 - 10 - d.textlength(label, font=fnt), y - 12), label, font=fnt, fill=(80, 80, 80))
+
+    ##
+    ## stacked areas, each band sits on top of the one before
+    lower = np.zeros(len(timestamps))
+    for i, upper in enumerate(stacked):
+        outline = np.concatenate([
+            np.column_stack([xs, to_y(upper)]),
+            np.column_stack([xs[::-1], to_y(lower[::-1])])
+        ])
+        d.polygon([tuple(point) for point in outline.tolist()], fill=COLORS[i % len(COLORS)])
+        lower = upper
+
+    ##
+    ## total and its moving average
+    d.line([tuple(point) for point in np.column_stack([xs, to_y(total)]).tolist()], fill=(0, 0, 0), width=2)
+    d.line([tuple(point) for point in np.column_stack([xs, to_y(average)]).tolist()], fill=(200, 0, 0), width=3)
+
+    ##
+    ## time axis
+    d.line([(x0, y1), (x1, y1)], fill=(0, 0, 0), width=2)
+    for tick in np.linspace(timestamps[0], timestamps[-1], 5):
+        x = x0 + (tick - timestamps[0]) / span * (x1 - x0)
+        label = format_timestamp(tick, span)
+        d.text((x - d.textlength(label, font=fnt) / 2, y1 + 12), label, font=fnt, fill=(80, 80, 80))
+
+    ##
+    ## legend, largest pool at the top
+    legend = [(name, COLORS[i % len(COLORS)]) for i, name in enumerate(series['names'])][::-1]
+    legend += [('Total', (0, 0, 0)), ('Moving avg', (200, 0, 0))]
+    for i, (name, color) in enumerate(legend):
+        y = y0 + i * 34
+        d.rectangle([x1 + 30, y, x1 + 52, y + 22], fill=color)
+        d.text((x1 + 64, y - 2), name[:20], font=fnt, fill=(0, 0, 0))
+
+    latest = f"{prefix}{human_readable(float(total[-1]))}"
+    change = float(total[-1] - total[0])
+    d.text((x1 - d.textlength(latest, font=title_fnt), 25), latest, font=title_fnt, fill=(0, 0, 0))
+    d.text((x1 + 30, y1 - 30), f"{'+' if change >= 0 else '-'}{prefix}{human_readable(abs(change))}", font=fnt, fill=(0, 0, 0))
+
+    return img
+
+
+def trend_chart(window='7d', value='usd', points=DEFAULT_SERIES_POINTS):
+    """
+    Read the history for a window and render it as a chart.
+
+    @params window: '24h', '7d', '30d' etc
+    @params value: 'usd' or 'amp'
+    @params points: The maximum number of points to plot
+    @returns: The PIL Image
+    """
+    totals, pools = get_pool_series(window, points)
+    series = build_series(totals, pools)
+    title = f"Flexa collateral {'USD' if value == 'usd' else 'AMP'}, last {window}"
+
+    return render_chart(series, title=title, value=value)
+
+
+if __name__ == '__main__':
+    ##
+    ## python -m utils.chart [dev] --window 30d --output chart.png
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Render a TVL trend chart')
+    parser.add_argument('env', nargs='?', choices=['dev'])
+    parser.add_argument('--window', default='7d')
+    parser.add_argument('--value', choices=['usd', 'amp'], default='usd')
+    parser.add_argument('--output', default='chart.png')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    trend_chart(args.window, args.value).save(args.output)
+    logger.info(f"Chart written to {args.output}")
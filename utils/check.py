@@ -0,0 +1,183 @@
+import os
+from utils.helpers import is_dev, get_env, get_cache_dir
+
+TWITTER_SETTINGS = ['TWITTER_API_KEY', 'TWITTER_API_SECRET', 'TWITTER_ACCESS_TOKEN', 'TWITTER_ACCESS_TOKEN_SECRET']
+DB_SETTINGS = ['DB_HOST', 'DB_NAME', 'DB_USER', 'DB_PASS']
+
+##
+## optional numeric settings, which otherwise fall back to their defaults silently when mistyped
+INT_SETTINGS = [
+    'TWEET_INTERVAL_MINUTES', 'DB_POOL_SIZE', 'HTTP_RETRIES', 'HTTP_POOL_SIZE', 'HTTP_CACHE_TTL',
+    'MULTICALL_CHUNK_SIZE', 'COLLECT_CONCURRENCY', 'ABI_CACHE_TTL',
+    'INDEXER_BLOCK_RANGE', 'INDEXER_MAX_BLOCKS', 'INDEXER_RECONCILE_EVERY', 'INDEXER_CONFIRMATIONS', 'RPC_FAILURE_THRESHOLD', 'SPOOL_FLUSH_BATCH', 'SPOOL_MAX_ATTEMPTS',
+    'TWITTER_IDENTITY_TTL', 'TWITTER_TWEETS_PER_DAY', 'TWITTER_UPLOADS_PER_DAY', 'TWITTER_BURST',
+    'TWITTER_MAX_ATTEMPTS', 'TWITTER_QUEUE_MAX_AGE'
+]
+FLOAT_SETTINGS = [
+    'HTTP_CONNECT_TIMEOUT', 'HTTP_READ_TIMEOUT', 'HTTP_BACKOFF', 'HTTP_BACKOFF_MAX', 'COLLECT_TIMEOUT',
+    'COLLECT_TIMEOUT_PRICE', 'COLLECT_TIMEOUT_POOLS', 'COLLECT_TIMEOUT_ABI', 'COLLECT_TIMEOUT_BLOCK',
+    'COLLECT_TIMEOUT_BALANCES', 'RPC_TIMEOUT', 'RPC_COOLDOWN', 'RPC_HEDGE_AFTER', 'RPC_HEDGE_BUDGET',
+    'SPOOL_FLUSH_INTERVAL', 'SPOOL_INLINE_FLUSH_TIME', 'TWITTER_PUBLISH_INTERVAL', 'PUBLISH_TIMEOUT', 'PUBLISH_TIMEOUT_TWITTER',
+    'PUBLISH_TIMEOUT_WEBHOOK', 'PUBLISH_TIMEOUT_ARCHIVE'
+]
+
+
+def is_placeholder(value):
+    """
+    Checks whether a setting is missing or still holds the .env.example placeholder.
+    """
+    return not value or value.startswith('your_') or value.endswith('_here')
+
+
+def check_config():
+    """
+    Validate the configuration for the current environment.
+
+    Only the environment and the local filesystem are looked at, so this runs without
+    loading tweepy, web3, PIL or mysql.connector, except that once the MySQL settings
+    are all there the database is asked for its schema version, see check_schema().
+
+    @returns: List of (level, message) tuples, level is 'error' or 'warning'
+    """
+    from utils.render import FONT_PATH, IMAGE_FORMATS
+    from utils.storage import BACKENDS, is_embedded
+    from utils.publish import SINKS, DEFAULT_SINKS, get_webhook_urls
+
+    prefix = 'DEV_' if is_dev() else ''
+    problems = []
+
+    backend = get_env('DB_BACKEND')
+    if backend and backend.lower() not in BACKENDS:
+        problems.append(('warning', f"DB_BACKEND={backend} is not one of {', '.join(BACKENDS)}, mysql will be used"))
+
+    sinks = [name.strip().lower() for name in (get_env('PUBLISH_SINKS') or ','.join(DEFAULT_SINKS)).split(',') if name.strip()]
+    for name in sinks:
+        if name not in SINKS:
+            problems.append(('warning', f"PUBLISH_SINKS has unknown sink {name}, it will be skipped"))
+
+    if 'webhook' in sinks and not get_webhook_urls():
+        problems.append(('error', f"The webhook sink is enabled but {prefix}WEBHOOK_URLS is not set"))
+
+    ##
+    ## Twitter credentials are only needed to post there, and the embedded database needs no server settings
+    required = (TWITTER_SETTINGS if 'twitter' in sinks else []) + ([] if is_embedded() else DB_SETTINGS)
+
+    for name in required:
+        if is_placeholder(get_env(f'{prefix}{name}')):
+            problems.append(('error', f"{prefix}{name} is not set"))
+
+    if not get_env('RPC_URLS') and not get_env('RPC_URL') and not get_env('ALCHEMY_KEY'):
+        problems.append(('error', "None of RPC_URLS, RPC_URL or ALCHEMY_KEY is set"))
+
+    if not get_env('ETHERSCAN_KEY'):
+        problems.append(('warning', "ETHERSCAN_KEY is not set, the cached or bundled ABI will be used"))
+
+    image_format = get_env('IMAGE_FORMAT')
+    if image_format and image_format.lower() not in IMAGE_FORMATS:
+        problems.append(('warning', f"IMAGE_FORMAT={image_format} is not one of {', '.join(IMAGE_FORMATS)}, jpeg will be used"))
+
+    for names, cast in ((INT_SETTINGS, int), (FLOAT_SETTINGS, float)):
+        for name in names:
+            value = get_env(name)
+            if not value:
+                continue
+            try:
+                cast(value)
+            except ValueError:
+                problems.append(('warning', f"{name}={value} is not a number, the default will be used"))
+
+    if not os.path.isfile(FONT_PATH):
+        problems.append(('error', f"Font not found at {FONT_PATH}"))
+
+    ##
+    ## the cache directory holds ABIs, checkpoints and the last run time
+    cache_dir = get_cache_dir()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        writable = os.access(cache_dir, os.W_OK)
+    except OSError:
+        writable = False
+
+    if not writable:
+        problems.append(('warning', f"Cache directory {cache_dir} is not writable"))
+
+    ##
+    ## snapshots left over from a database outage, the next run writes them first
+    from utils.spool import count_pending, count_failed
+    try:
+        pending = count_pending()
+        failed = count_failed()
+    except Exception as e:
+        problems.append(('warning', f"Could not read the snapshot spool: {e}"))
+    else:
+        if pending:
+            problems.append(('warning', f"{pending} snapshot(s) are spooled waiting for the database"))
+        if failed:
+            problems.append(('warning', f"{failed} snapshot(s) failed to write and were set aside, retry them with python -m utils.spool --requeue"))
+
+    from utils.twitter import count_queued
+    try:
+        queued = count_queued()
+    except Exception as e:
+        problems.append(('warning', f"Could not read the tweet queue: {e}"))
+    else:
+        if queued:
+            problems.append(('warning', f"{queued} tweet(s) are queued waiting for Twitter"))
+
+    if can_check_schema():
+        problems.extend(check_schema())
+
+    return problems
+
+
+def can_check_schema():
+    """
+    Checks whether --check will ask MySQL for its schema version, which needs mysql.connector.
+
+    The embedded database is created with the current schema, MySQL has to be
+    migrated, and without all of its settings there is nothing to connect to.
+    """
+    from utils.storage import is_embedded
+
+    prefix = 'DEV_' if is_dev() else ''
+    return not is_embedded() and not any(is_placeholder(get_env(f'{prefix}{name}')) for name in DB_SETTINGS)
+
+
+def check_schema():
+    """
+    Compare the MySQL schema version with the latest migration.
+
+    save_totals() writes the columns every migration adds, so an unmigrated
+    database fails each save and the snapshots pile up in the spool. Only read
+    queries are run, on one short lived connection rather than the pool, and a
+    database without the schema_migrations table counts as version 0.
+
+    @returns: List of (level, message) tuples
+    """
+    import mysql.connector
+    from utils.database import get_db_config
+    from utils.migrations import MIGRATIONS
+
+    try:
+        conn = mysql.connector.connect(**get_db_config(), connection_timeout=10)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = 'schema_migrations'"
+            )
+            version = 0
+            if cursor.fetchone()[0]:
+                cursor.execute("SELECT MAX(version) FROM schema_migrations")
+                version = cursor.fetchone()[0] or 0
+            cursor.close()
+        finally:
+            conn.close()
+    except Exception as e:
+        return [('error', f"Could not read the schema version from the database: {e}")]
+
+    latest = MIGRATIONS[-1][0]
+    if version < latest:
+        pending = ', '.join(str(migration_version) for migration_version, _, _ in MIGRATIONS if migration_version > version)
+        return [('error', f"The database schema is at version {version}, migration(s) {pending} are pending, run python -m utils.migrations{' dev' if is_dev() else ''}")]
+
+    return []
@@ -1,128 +1,572 @@
+import time
 import mysql.connector
+from mysql.connector import pooling
+from contextlib import contextmanager
 from utils import is_dev, get_env
+from utils.helpers import get_env_int
+from utils.storage import is_embedded, connect_sqlite
+from utils.metrics import timed
+from utils.amounts import to_wei, to_price, implied_price, usd_dollars
 
-def get_db_connection():
+##
+## one pool per environment, created lazily on first use
+_pools = {}
+
+DEFAULT_POOL_SIZE = 3
+DEFAULT_SERIES_POINTS = 200
+
+##
+## pool balances of the last saved batch per environment, see get_latest_pools()
+_latest_pools = {}
+
+
+def get_pool_size():
     """
-    Retrieves the database connection.
+    Retrieves the connection pool size from DB_POOL_SIZE.
     """
-    if is_dev():
-        conn = mysql.connector.connect(
-            host = get_env('DEV_DB_HOST'),
-            database = get_env('DEV_DB_NAME'),
-            user = get_env('DEV_DB_USER'),
-            password = get_env('DEV_DB_PASS')
-        )
-    else:
-        conn = mysql.connector.connect(
-            host = get_env('DB_HOST'),
-            database = get_env('DB_NAME'),
-            user = get_env('DB_USER'),
-            password = get_env('DB_PASS')
+    size = get_env_int('DB_POOL_SIZE', DEFAULT_POOL_SIZE)
+
+    ##
+    ## mysql.connector caps pools at 32 connections
+    return min(max(size, 1), 32)
+
+
+def get_db_config():
+    """
+    Retrieves the connection settings for the current environment.
+    """
+    prefix = 'DEV_' if is_dev() else ''
+
+    return {
+        'host': get_env(f'{prefix}DB_HOST'),
+        'database': get_env(f'{prefix}DB_NAME'),
+        'user': get_env(f'{prefix}DB_USER'),
+        'password': get_env(f'{prefix}DB_PASS')
+    }
+
+
+def get_db_pool():
+    """
+    Retrieves the connection pool for the current environment, creating it if needed.
+    """
+    key = 'dev' if is_dev() else 'prod'
+
+    if key not in _pools:
+        _pools[key] = pooling.MySQLConnectionPool(
+            pool_name = f'ampy_{key}',
+            pool_size = get_pool_size(),
+            pool_reset_session = True,
+            **get_db_config()
         )
-    
+
+    return _pools[key]
+
+
+def get_db_connection():
+    """
+    Checks a connection out of the pool, reconnecting it if it has gone stale.
+    Calling close() on the returned connection hands it back to the pool.
+
+    With DB_BACKEND=sqlite the embedded database file is opened instead, there
+    is no server to pool connections to.
+    """
+    if is_embedded():
+        return connect_sqlite()
+
+    conn = get_db_pool().get_connection()
+
+    ##
+    ## health check, the server may have dropped an idle pooled connection
+    try:
+        conn.ping(reconnect=True, attempts=2, delay=1)
+    except mysql.connector.Error:
+        conn.close()
+        raise
+
     return conn
 
+
+@contextmanager
+def db_session(conn=None):
+    """
+    Context manager for a unit of work on a single pooled connection.
+
+    Commits when the block exits cleanly, rolls back on error and always returns
+    the connection to the pool. If an existing connection is passed in, it is used
+    as-is and the outer session is left in charge of the transaction.
+
+    @params conn: An optional connection from an enclosing db_session
+    @yields: The connection to run queries on
+    """
+    if conn is not None:
+        yield conn
+        return
+
+    conn = get_db_connection()
+
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def is_reachable():
+    """
+    Checks whether the database accepts connections and queries right now.
+
+    @returns: True if a trivial query succeeds
+    """
+    try:
+        with db_session() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            finally:
+                cursor.close()
+    except Exception:
+        return False
+
+    return True
+
+
+@timed()
 def get_saved_totals():
     """
     Retrieves the saved totals from the database.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, amp, usd FROM totals ORDER BY id DESC LIMIT 2")
-    totals_result = cursor.fetchall()
-    return totals_result
+    with db_session() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT id, amp, usd FROM totals ORDER BY id DESC LIMIT 2")
+            return cursor.fetchall()
+        finally:
+            cursor.close()
 
+@timed()
 def get_saved_tvl(new_batch_id, old_batch_id):
     """
-    Retrieves the saved TVL from the database.
+    Retrieves the saved TVL from the database, reconstructed as full snapshots for both batches.
+
+    @params new_batch_id: The batch ID of the current totals row
+    @params old_batch_id: The batch ID of the previous totals row
+    @returns: List of (id, name, contract, amp_total, usd, batch_id) rows, previous batch first
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, name, contract, amp_total, usd, batch_id 
-        FROM tvl
-        WHERE batch_id = %s 
-        OR batch_id = %s 
-        ORDER BY batch_id ASC
-        """, (old_batch_id, new_batch_id))
-    tvl_result = cursor.fetchall()
-    return tvl_result
+    with db_session() as conn:
+        return get_snapshot(old_batch_id, conn=conn) + get_snapshot(new_batch_id, conn=conn)
+
+
+def get_snapshot(batch_id, conn=None):
+    """
+    Reconstructs the full pool snapshot for a batch.
+
+    Batches only store the pools that changed since the previous batch, so each
+    pool's state is its latest row at or before batch_id. Pools whose latest row
+    is a tombstone (empty name) had been removed by then. USD values use the
+    batch's own price so unchanged pools are valued at that batch's price.
+    Pools come back in the order they were first saved, however often they changed since.
+
+    @params batch_id: The totals ID of the batch
+    @params conn: An optional connection from an enclosing db_session
+    @returns: List of (id, name, contract, amp_total, usd, batch_id) rows, amp_total in integer
+              wei and usd in whole dollars
+    """
+    with db_session(conn) as session:
+        cursor = session.cursor()
+        try:
+            cursor.execute("SELECT amp, usd, price FROM totals WHERE id = %s", (batch_id,))
+            totals = cursor.fetchone()
+
+            ##
+            ## ordered by when each pool was first stored, its latest row moves on every change
+            cursor.execute("""
+                SELECT t.id, t.name, t.contract, t.amp_total
+                FROM tvl t
+                JOIN (
+                    SELECT contract, MAX(batch_id) AS batch_id, MIN(id) AS first_id
+                    FROM tvl
+                    WHERE batch_id <= %s
+                    GROUP BY contract
+                ) latest
+                ON t.contract = latest.contract AND t.batch_id = latest.batch_id
+                ORDER BY latest.first_id ASC
+                """, (batch_id,))
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+
+    if not totals:
+        return []
+
+    ##
+    ## the recorded price, or for older batches the price implied by the totals
+    price = to_price(totals[2]) if totals[2] is not None else implied_price(totals[0], totals[1])
+
+    return [
+        (id, name, contract, to_wei(amp), usd_dollars(to_wei(amp), price), batch_id)
+        for id, name, contract, amp in rows
+        if name
+    ]
+
+
+def get_latest_pools(conn=None):
+    """
+    Retrieves the pool balances of the most recently saved batch, for change detection.
+
+    The result is kept in memory per environment and only re-read from the database
+    when another writer has added a batch since.
+
+    @params conn: An optional connection from an enclosing db_session
+    @returns: Dict of lowercased contract => (name, amp_total, contract)
+    """
+    key = 'dev' if is_dev() else 'prod'
+
+    with db_session(conn) as session:
+        cursor = session.cursor()
+        try:
+            cursor.execute("SELECT MAX(id) FROM totals")
+            latest = cursor.fetchone()
+        finally:
+            cursor.close()
+
+        batch_id = latest[0] if latest else None
+        if batch_id is None:
+            return {}
+
+        cached = _latest_pools.get(key)
+        if cached and cached['batch_id'] == batch_id:
+            return cached['pools']
+
+        pools = {
+            row[2].lower(): (row[1], row[3], row[2])
+            for row in get_snapshot(batch_id, conn=session)
+        }
+
+    _latest_pools[key] = {'batch_id': batch_id, 'pools': pools}
+    return pools
+
+
+def diff_pools(data, previous):
+    """
+    Works out which pool rows need writing for a new batch.
+
+    @params data: List of pool data where each item contains [name, contract, amp_total, usd_value]
+    @params previous: Dict of lowercased contract => (name, amp_total, contract) from get_latest_pools()
+    @returns: The rows for new or changed pools, plus an empty named tombstone row
+              [ '', contract, 0, 0 ] for each pool that is no longer present
+    """
+    changed = []
+    seen = set()
+    for row in data:
+        key = row[1].lower()
+        seen.add(key)
+
+        saved = previous.get(key)
+        if saved is None or saved[:2] != (row[0], to_wei(row[2])):
+            changed.append(row)
+
+    for key, saved in previous.items():
+        if key not in seen:
+            changed.append(['', saved[2], 0, 0])
+
+    return changed
+
+
+def get_window_seconds(window):
+    """
+    Converts a window such as '24h', '7d' or '30d' (or a number of seconds) into seconds.
+    """
+    if isinstance(window, (int, float)):
+        return int(window)
+
+    units = {'h': 3600, 'd': 86400, 'w': 604800}
+    return int(window[:-1]) * units[window[-1].lower()]
+
+
+def get_totals_series(window='7d', points=DEFAULT_SERIES_POINTS, conn=None):
+    """
+    Retrieves the totals history for a time window, downsampled in the database.
+
+    The window is split into `points` equal buckets counted from its start and
+    the last batch in each bucket is returned, so the result size is bounded no
+    matter how much history exists. Served by the totals.created_at index.
+
+    @params window: '24h', '7d', '30d' etc, or a number of seconds
+    @params points: The maximum number of points to return
+    @params conn: An optional connection from an enclosing db_session
+    @returns: List of {'batch_id', 'timestamp', 'amp', 'usd', 'price', 'block_number'} dicts, oldest first
+    """
+    seconds = get_window_seconds(window)
+    points = max(1, points)
+    bucket_seconds = max(1, -(-seconds // points))
+    since = int(time.time()) - seconds
+
+    with db_session(conn) as session:
+        cursor = session.cursor()
+        try:
+            cursor.execute("""
+                SELECT t.id, UNIX_TIMESTAMP(t.created_at), t.amp, t.usd, t.price, t.block_number
+                FROM (
+                    SELECT LEAST(FLOOR((UNIX_TIMESTAMP(created_at) - %s) / %s), %s) AS bucket, MAX(id) AS id
+                    FROM totals
+                    WHERE created_at >= FROM_UNIXTIME(%s)
+                    GROUP BY bucket
+                ) b
+                JOIN totals t ON t.id = b.id
+                ORDER BY t.id ASC
+                """, (since, bucket_seconds, points - 1, since))
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+
+    series = []
+    for id, timestamp, amp, usd, price, block_number in rows:
+        ##
+        ## batches saved before prices were recorded fall back to the implied price
+        if price is None:
+            price = float(usd) / (float(amp) / 1e18) if amp else 0
+
+        series.append({
+            'batch_id': id,
+            'timestamp': int(timestamp),
+            'amp': int(amp),
+            'usd': float(usd),
+            'price': float(price),
+            'block_number': block_number
+        })
+
+    return series
 
 
-def save_totals(amp_total, usd_total):
+def get_pool_series(window='7d', points=DEFAULT_SERIES_POINTS, conn=None):
+    """
+    Retrieves the per-pool history for a time window at the same points as get_totals_series().
+
+    Reads the snapshot at the start of the window plus only the pool rows written
+    inside it (batches store changes), then carries each pool's balance forward to
+    every point as one pools x points array. USD is valued at each point's own price.
+
+    @params window: '24h', '7d', '30d' etc, or a number of seconds
+    @params points: The maximum number of points to return
+    @params conn: An optional connection from an enclosing db_session
+    @returns: Tuple of (totals series, dict of lowercased contract => {'name', 'contract', 'amp': [...], 'usd': [...]})
+              where the amp and usd lists line up with the totals series
+    """
+    with db_session(conn) as session:
+        totals = get_totals_series(window, points, conn=session)
+        if not totals:
+            return totals, {}
+
+        first_batch_id = totals[0]['batch_id']
+        last_batch_id = totals[-1]['batch_id']
+
+        initial = get_snapshot(first_batch_id, conn=session)
+
+        cursor = session.cursor()
+        try:
+            cursor.execute("""
+                SELECT name, contract, amp_total, batch_id
+                FROM tvl
+                WHERE batch_id > %s AND batch_id <= %s
+                ORDER BY batch_id ASC, id ASC
+                """, (first_batch_id, last_batch_id))
+            changes = cursor.fetchall()
+        finally:
+            cursor.close()
+
+    import numpy as np
+
+    ##
+    ## every pool state in order: the snapshot at the first point, then each change at
+    ## the first point whose batch includes it (tombstones have no name)
+    events = [(row[1], row[2], row[3], first_batch_id) for row in initial] + list(changes)
+    batch_ids = np.array([point['batch_id'] for point in totals], dtype=np.int64)
+    event_points = np.searchsorted(batch_ids, np.array([event[3] for event in events], dtype=np.int64))
+
+    keys = {}
+    event_pools = np.array([keys.setdefault(event[1].lower(), len(keys)) for event in events], dtype=np.int64)
+
+    ##
+    ## each cell holds the latest event at or before that point, -1 before the pool's first
+    latest = np.full((len(keys), len(totals)), -1, dtype=np.int64)
+    np.maximum.at(latest, (event_pools, event_points), np.arange(len(events)))
+    latest = np.maximum.accumulate(latest, axis=1)
+
+    ##
+    ## balances exceed int64, amp keeps the exact integers and usd works in floats;
+    ## the trailing entries are what -1 picks, no balance before a pool's first event
+    event_amp = np.array([int(event[2]) if event[0] else 0 for event in events] + [0], dtype=object)
+    amp = event_amp[latest]
+    usd = (amp.astype(float) / 1e18) * np.array([point['price'] for point in totals])
+
+    present = np.array([bool(event[0]) for event in events] + [False])[latest]
+
+    series = {}
+    for key, index in keys.items():
+        if not present[index].any():
+            continue
+
+        ##
+        ## a pool is named after its latest row that isn't a tombstone
+        last = latest[index][present[index]][-1]
+        series[key] = {
+            'name': events[last][0],
+            'contract': events[last][1],
+            'amp': amp[index].tolist(),
+            'usd': usd[index].tolist()
+        }
+
+    return totals, series
+
+
+@timed()
+def save_totals(amp_total, usd_total, conn=None, block_number=None, price=None, price_time=None, batch_key=None, created_at=None):
     """
     Saves the total AMP and USD values to the database.
     
     @params amp_total: The total AMP amount across all pools
     @params usd_total: The total USD value across all pools
+    @params conn: An optional connection to run the insert in an enclosing transaction
+    @params block_number: The block every pool balance was read at
+    @params price: The AMP price the batch was valued with
+    @params price_time: The unix time the price was published
+    @params batch_key: The spool key of the snapshot, so a replayed batch is only written once
+    @params created_at: The unix time the snapshot was collected, defaults to now
     @returns: The ID of the inserted record
     @raises mysql.connector.Error: If database connection or query fails
     """
-    conn = None
-    cursor = None
-    
+    if created_at is None:
+        created_at = int(time.time())
+
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("INSERT INTO totals (amp, usd) VALUES (%s, %s)", (amp_total, usd_total))
-        conn.commit()
-        
-        return cursor.lastrowid
+        with db_session(conn) as session:
+            cursor = session.cursor()
+            try:
+                cursor.execute(
+                    """
+                    INSERT INTO totals (amp, usd, block_number, price, price_time, batch_key, created_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, FROM_UNIXTIME(%s))
+                    """,
+                    (amp_total, usd_total, block_number, price, price_time, batch_key, created_at)
+                )
+                return cursor.lastrowid
+            finally:
+                cursor.close()
         
     except mysql.connector.Error as e:
         ##
         ## Log the error and re-raise with more context
         raise mysql.connector.Error(f"Database error while saving totals: {e}")
-        
-    finally:
-        ##
-        ## Ensure proper cleanup of database resources
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
 
 
 
-def save_tvl(data, batch_id):
+@timed()
+def save_tvl(data, batch_id, conn=None):
     """
     Saves the TVL data to the database.
     
     @params data: List of pool data where each item contains [name, contract, amp_total, usd_value]
     @params batch_id: The batch ID to associate with each TVL record
+    @params conn: An optional connection to run the insert in an enclosing transaction
     @returns: The last row ID inserted
     """
-    conn = None
-    cursor = None
-    
+    ##
+    ## Add batch_id to each data row
+    ## row format: [name, contract, amp_total, usd_value]
+    ## need to append batch_id: [name, contract, amp_total, usd_value, batch_id]
+    data_with_batch_id = [list(row) + [batch_id] for row in data]
+
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        ##
-        ## Add batch_id to each data row
-        data_with_batch_id = []
-        for row in data:
-            ##
-            ## row format: [name, contract, amp_total, usd_value]
-            ## need to append batch_id: [name, contract, amp_total, usd_value, batch_id]
-            row_with_batch = row + [batch_id]
-            data_with_batch_id.append(row_with_batch)
-        
-        cursor.executemany("INSERT INTO tvl (name, contract, amp_total, usd, batch_id) VALUES (%s, %s, %s, %s, %s)", data_with_batch_id)
-        conn.commit()
-        return cursor.lastrowid
+        with db_session(conn) as session:
+            cursor = session.cursor()
+            try:
+                cursor.executemany("INSERT INTO tvl (name, contract, amp_total, usd, batch_id) VALUES (%s, %s, %s, %s, %s)", data_with_batch_id)
+                return cursor.lastrowid
+            finally:
+                cursor.close()
         
     except mysql.connector.Error as e:
         ##
         ## Log the error and re-raise with more context
         raise mysql.connector.Error(f"Database error while saving TVL data: {e}")
-        
-    finally:
-        ##
-        ## Ensure proper cleanup of database resources
-        if cursor:
+
+
+def get_saved_batch_keys(batch_keys, conn=None):
+    """
+    Looks up which spooled batches are already in the database.
+
+    @params batch_keys: The spool keys to look for
+    @params conn: An optional connection from an enclosing db_session
+    @returns: Dict of batch_key => totals ID for the keys that were found
+    """
+    if not batch_keys:
+        return {}
+
+    with db_session(conn) as session:
+        cursor = session.cursor()
+        try:
+            placeholders = ', '.join(['%s'] * len(batch_keys))
+            cursor.execute(f"SELECT batch_key, id FROM totals WHERE batch_key IN ({placeholders})", tuple(batch_keys))
+            return dict(cursor.fetchall())
+        finally:
             cursor.close()
-        if conn:
-            conn.close()
\ No newline at end of file
+
+
+@timed()
+def save_batches(batches):
+    """
+    Saves several snapshots in one transaction, oldest first.
+
+    Each batch gets its totals header plus the TVL rows of the pools that changed
+    since the batch before it, so snapshots that piled up while the database was
+    unreachable are delta-encoded exactly as if they had been saved on time.
+    Batches whose key is already in the totals table are skipped, which makes
+    replaying a batch that was written but not yet cleared from the spool harmless.
+
+    @params batches: List of dicts with 'batch_key', 'data' ([name, contract, amp_total, usd_value] rows),
+                     'amp_total', 'usd_total', 'block_number', 'price', 'price_time' and 'created_at'
+    @returns: Dict of batch_key => (totals ID, last TVL row ID or None if no pool changed)
+    @raises mysql.connector.Error: If database connection or query fails
+    """
+    saved = {}
+    latest = None
+
+    with db_session() as conn:
+        existing = get_saved_batch_keys([batch['batch_key'] for batch in batches if batch.get('batch_key')], conn=conn)
+        previous = get_latest_pools(conn=conn)
+
+        for batch in batches:
+            if batch.get('batch_key') in existing:
+                saved[batch['batch_key']] = (existing[batch['batch_key']], None)
+                continue
+
+            changed = diff_pools(batch['data'], previous)
+
+            totals_id = save_totals(
+                batch['amp_total'],
+                batch['usd_total'],
+                conn=conn,
+                block_number=batch.get('block_number'),
+                price=batch.get('price'),
+                price_time=batch.get('price_time'),
+                batch_key=batch.get('batch_key'),
+                created_at=batch.get('created_at')
+            )
+            tvl_id = save_tvl(changed, totals_id, conn=conn) if changed else None
+
+            ##
+            ## the next batch in this transaction is diffed against this one
+            previous = {row[1].lower(): (row[0], to_wei(row[2]), row[1]) for row in batch['data']}
+            latest = totals_id
+            saved[batch.get('batch_key')] = (totals_id, tvl_id)
+
+    ##
+    ## remember what was just written so the next run doesn't need to read it back
+    if latest is not None:
+        _latest_pools['dev' if is_dev() else 'prod'] = {'batch_id': latest, 'pools': previous}
+
+    return saved
@@ -0,0 +1,216 @@
+import os
+import sys
+import logging
+from utils.helpers import is_dev, get_cache_dir
+from utils.database import db_session
+from utils.amounts import WEI_PER_AMP, to_wei
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 50000
+
+##
+## column name => arrow type name, amounts are exported exactly as text and as floats for scans
+TOTALS_COLUMNS = [
+    ('id', 'int64'),
+    ('created_at', 'int64'),
+    ('block_number', 'int64'),
+    ('amp_wei', 'string'),
+    ('amp', 'float64'),
+    ('usd', 'float64'),
+    ('price', 'float64'),
+    ('price_time', 'int64'),
+]
+TVL_COLUMNS = [
+    ('id', 'int64'),
+    ('batch_id', 'int64'),
+    ('name', 'string'),
+    ('contract', 'string'),
+    ('amp_wei', 'string'),
+    ('amp', 'float64'),
+    ('usd', 'int64'),
+]
+
+TOTALS_QUERY = """
+    SELECT id, UNIX_TIMESTAMP(created_at), block_number, amp, usd, price, price_time
+    FROM totals WHERE id > %s ORDER BY id ASC LIMIT %s
+"""
+TVL_QUERY = """
+    SELECT id, batch_id, name, contract, amp_total, usd
+    FROM tvl WHERE id > %s ORDER BY id ASC LIMIT %s
+"""
+
+
+def get_export_dir():
+    """
+    Default directory for the Parquet files of the current environment.
+    """
+    return os.path.join(get_cache_dir(), 'export_dev' if is_dev() else 'export')
+
+
+def to_float(value):
+    return None if value is None else float(value)
+
+
+def totals_columns(rows):
+    """
+    Turn totals rows into columns, amp as exact wei text plus AMP as a float.
+    """
+    columns = {name: [] for name, _ in TOTALS_COLUMNS}
+    for id, created_at, block_number, amp, usd, price, price_time in rows:
+        amp_wei = to_wei(amp)
+        columns['id'].append(id)
+        columns['created_at'].append(int(created_at))
+        columns['block_number'].append(block_number)
+        columns['amp_wei'].append(str(amp_wei))
+        columns['amp'].append(amp_wei / WEI_PER_AMP)
+        columns['usd'].append(to_float(usd))
+        columns['price'].append(to_float(price))
+        columns['price_time'].append(price_time)
+    return columns
+
+
+def tvl_columns(rows):
+    """
+    Turn tvl rows into columns. These are the stored change rows, a pool with an
+    empty name is a tombstone for a pool that disappeared in that batch.
+    """
+    columns = {name: [] for name, _ in TVL_COLUMNS}
+    for id, batch_id, name, contract, amp_total, usd in rows:
+        amp_wei = to_wei(amp_total)
+        columns['id'].append(id)
+        columns['batch_id'].append(batch_id)
+        columns['name'].append(name)
+        columns['contract'].append(contract)
+        columns['amp_wei'].append(str(amp_wei))
+        columns['amp'].append(amp_wei / WEI_PER_AMP)
+        columns['usd'].append(int(usd))
+    return columns
+
+
+def export_table(conn, query, columns, to_columns, path, chunk_size):
+    """
+    Stream one table into a Parquet file, a row group per chunk so memory stays flat.
+
+    Written to a temporary file and moved into place, so readers never see a half written export.
+
+    @returns: The number of rows written
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(name, getattr(pa, type_name)()) for name, type_name in columns])
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+
+    written = 0
+    last_id = 0
+    cursor = conn.cursor()
+    try:
+        with pq.ParquetWriter(tmp_path, schema, compression='zstd') as writer:
+            while True:
+                cursor.execute(query, (last_id, chunk_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+
+                writer.write_table(pa.Table.from_pydict(to_columns(rows), schema=schema))
+                written += len(rows)
+                last_id = rows[-1][0]
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        cursor.close()
+
+    os.replace(tmp_path, path)
+    return written
+
+
+def export_parquet(output_dir=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Export the whole totals and tvl history to totals.parquet and tvl.parquet.
+
+    Reads from whichever backend DB_BACKEND selects, in id order and in chunks,
+    so the export works the same on MySQL and on the embedded database.
+
+    @params output_dir: Where to write the files, defaults to get_export_dir()
+    @params chunk_size: Rows read and written at a time
+    @returns: Dict of table => row count
+    @raises RuntimeError: If pyarrow isn't installed
+    """
+    try:
+        import pyarrow
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow, install it with pip install pyarrow")
+
+    output_dir = output_dir or get_export_dir()
+    os.makedirs(output_dir, exist_ok=True)
+
+    with db_session() as conn:
+        counts = {
+            'totals': export_table(conn, TOTALS_QUERY, TOTALS_COLUMNS, totals_columns, os.path.join(output_dir, 'totals.parquet'), chunk_size),
+            'tvl': export_table(conn, TVL_QUERY, TVL_COLUMNS, tvl_columns, os.path.join(output_dir, 'tvl.parquet'), chunk_size),
+        }
+
+    logger.info(f"Exported {counts['totals']} totals and {counts['tvl']} tvl rows to {output_dir}")
+    return counts
+
+
+def query(sql, output_dir=None):
+    """
+    Run an analytics query over the exported Parquet files with DuckDB.
+
+    The files are exposed as the views totals and tvl, e.g.
+    SELECT date_trunc('day', to_timestamp(created_at)) AS day, max(amp) FROM totals GROUP BY day
+
+    @params sql: The query
+    @params output_dir: The export directory, defaults to get_export_dir()
+    @returns: Tuple of (column names, rows)
+    @raises RuntimeError: If duckdb isn't installed
+    """
+    try:
+        import duckdb
+    except ImportError:
+        raise RuntimeError("Analytics queries need duckdb, install it with pip install duckdb")
+
+    output_dir = output_dir or get_export_dir()
+
+    conn = duckdb.connect()
+    try:
+        for table in ('totals', 'tvl'):
+            path = os.path.join(output_dir, f'{table}.parquet').replace("'", "''")
+            conn.execute(f"CREATE VIEW {table} AS SELECT * FROM read_parquet('{path}')")
+
+        result = conn.execute(sql)
+        return [column[0] for column in result.description], result.fetchall()
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    ##
+    ## python -m utils.export [dev] [--output DIR] [--query SQL]
+    import argparse
+    from dotenv import load_dotenv
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Export the totals and tvl history to Parquet')
+    parser.add_argument('env', nargs='?', choices=['dev'], help="export the dev database")
+    parser.add_argument('--output', default=None, help="directory for totals.parquet and tvl.parquet, defaults to cache/export")
+    parser.add_argument('--query', default=None, help="run this SQL over the exported files with DuckDB instead of exporting")
+    args = parser.parse_args()
+
+    try:
+        if args.query:
+            columns, rows = query(args.query, args.output)
+            print('\t'.join(columns))
+            for row in rows:
+                print('\t'.join(str(value) for value in row))
+        else:
+            export_parquet(args.output)
+    except RuntimeError as e:
+        logger.error(e)
+        sys.exit(1)
@@ -1,18 +1,194 @@
-import sys, os
-import requests
+import sys, os, time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from contextlib import contextmanager
+from contextvars import ContextVar
+from utils.metrics import span
+
+##
+## shared keep-alive session used by run_curl
+_http_session = None
+_http_session_lock = threading.Lock()
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+##
+## responses kept for TTL reuse and conditional revalidation, keyed by URL + headers
+_response_cache = {}
+_response_cache_lock = threading.Lock()
+
+##
+## responses fetched during the current request_cache() block
+_request_cache = ContextVar('request_cache', default=None)
 
 def is_dev():
     """
     Checks if the bot is running in dev mode or not.
     """
-    if len(sys.argv) > 1 and sys.argv[1] == 'dev':
-        return True
-    return False
+    return 'dev' in sys.argv[1:]
+
+
+def get_http_session():
+    """
+    Retrieves the shared requests session, creating it on first use.
+
+    Returns
+    -------
+    requests.Session
+        A session whose keep-alive connection pool is sized by HTTP_POOL_SIZE.
+    """
+    global _http_session
+
+    with _http_session_lock:
+        if _http_session is None:
+            import requests
+            import requests.adapters
+
+            pool_size = get_env_int('HTTP_POOL_SIZE', 10)
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _http_session = session
+
+    return _http_session
+
+
+def get_http_timeout():
+    """
+    Retrieves the (connect, read) timeout tuple for HTTP requests.
+
+    Returns
+    -------
+    tuple
+        HTTP_CONNECT_TIMEOUT and HTTP_READ_TIMEOUT in seconds, defaulting to 5 and 20.
+    """
+    return (get_env_float('HTTP_CONNECT_TIMEOUT', 5), get_env_float('HTTP_READ_TIMEOUT', 20))
+
+
+def get_http_retries():
+    """
+    Retrieves how many times a transient HTTP failure is retried.
+
+    Returns
+    -------
+    int
+        HTTP_RETRIES, defaulting to 3.
+    """
+    return max(0, get_env_int('HTTP_RETRIES', 3))
+
+
+def get_retry_delay(attempt, response=None):
+    """
+    Work out how long to wait before retrying a request.
+
+    Parameters
+    ----------
+    attempt : int
+        The zero-based attempt that just failed.
+    response : requests.Response
+        The failed response, if the server sent one.
+
+    Returns
+    -------
+    float
+        The Retry-After header in seconds when present, otherwise exponential
+        backoff from HTTP_BACKOFF with full jitter, capped at HTTP_BACKOFF_MAX.
+    """
+    max_delay = get_env_float('HTTP_BACKOFF_MAX', 30)
+
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0), max_delay)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after).timestamp()
+                return min(max(retry_at - time.time(), 0), max_delay)
+            except (TypeError, ValueError):
+                pass
+
+    return random.uniform(0, min(get_env_float('HTTP_BACKOFF', 0.5) * (2 ** attempt), max_delay))
+
+
+def http_error(message, code=None, retryable=False):
+    """
+    Build the error result returned by run_curl.
+
+    Parameters
+    ----------
+    message : str
+        A human readable description of the failure.
+    code : int
+        The HTTP status code, if a response was received.
+    retryable : bool
+        Whether the failure was transient (timeouts, 429 and 5xx responses).
+
+    Returns
+    -------
+    dict
+        {'Status': 'Error', 'Message': message, 'Code': code, 'Retryable': retryable}
+    """
+    return {'Status': 'Error', 'Message': message, 'Code': code, 'Retryable': retryable}
+
+
+def get_http_cache_ttl():
+    """
+    Retrieves how long a cached HTTP response may be reused without asking the server.
+
+    Returns
+    -------
+    int
+        The HTTP_CACHE_TTL environment variable in seconds, or 0 to always revalidate.
+    """
+    return max(0, get_env_int('HTTP_CACHE_TTL', 0))
+
+
+def get_cache_key(url, headers=None):
+    """
+    Build the cache key for a request from its URL and headers.
+    """
+    return (url, tuple(sorted((headers or {}).items())))
+
+
+@contextmanager
+def request_cache():
+    """
+    Context manager that scopes a response cache to one run.
+
+    Inside the block, every URL + headers combination is fetched at most once and
+    later run_curl calls get the same response back, so a snapshot sees consistent
+    upstream data. The scope is carried by a ContextVar, so it follows work handed
+    to asyncio.to_thread.
+    """
+    if _request_cache.get() is not None:
+        yield
+        return
+
+    token = _request_cache.set({})
+    try:
+        yield
+    finally:
+        _request_cache.reset(token)
+
+
+def clear_response_cache():
+    """
+    Drops every response kept for TTL reuse and revalidation.
+    """
+    with _response_cache_lock:
+        _response_cache.clear()
 
 
 def run_curl(url, headers=None):
     """
     Make a GET request to the given URL and return a JSON response.
+
+    Responses are reused within a request_cache() block, for HTTP_CACHE_TTL seconds
+    across blocks, and otherwise revalidated with If-None-Match / If-Modified-Since
+    when the server sent an ETag or Last-Modified header.
     
     Parameters
     ----------
@@ -26,25 +202,118 @@ def run_curl(url, headers=None):
     data : dict
         A dictionary of the JSON response, or {'Status': 'Error', 'Message': <error message>} if the request fails.
     """
-    
+    key = get_cache_key(url, headers)
+
     ##
-    ## attempt to get data from API
-    ## if it fails, return error message
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        return {'Status': 'Error', 'Message': 'Error: likely due to rate limiting, sit tight for 2 minutes & try again.'}
+    ## already fetched during this run
+    scope = _request_cache.get()
+    if scope is not None and key in scope:
+        return scope[key]
+
+    with _response_cache_lock:
+        entry = _response_cache.get(key)
+
+    ttl = get_http_cache_ttl()
+    if entry and ttl and time.time() - entry['fetched_at'] < ttl:
+        data = entry['data']
+    else:
+        with span('run_curl', host=urlsplit(url).hostname):
+            data = fetch_json(url, headers, entry)
+
+    if scope is not None and not ('Status' in data and data['Status'] == 'Error'):
+        scope[key] = data
+
+    return data
+
+
+def fetch_json(url, headers=None, entry=None):
+    """
+    Perform the GET request behind run_curl, revalidating a previous response if possible.
+
+    Parameters
+    ----------
+    url : str
+        The URL to query.
+    headers : dict
+        A dictionary of headers to pass to the request.
+    entry : dict
+        A previously cached response with its validators, if any.
+
+    Returns
+    -------
+    data : dict
+        A dictionary of the JSON response, or {'Status': 'Error', 'Message': <error message>} if the request fails.
+    """
+    import requests
+
+    request_headers = dict(headers or {})
+    if entry:
+        if entry['etag']:
+            request_headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            request_headers['If-Modified-Since'] = entry['last_modified']
+
+    ##
+    ## attempt to get data from API, backing off and retrying transient failures
+    ## if it still fails, return error message
+    retries = get_http_retries()
+    for attempt in range(retries + 1):
+        try:
+            response = get_http_session().get(url, headers=request_headers, timeout=get_http_timeout())
+        except requests.exceptions.Timeout:
+            error = http_error('Error: request timed out, the API may be having issues.', retryable=True)
+            response = None
+        except requests.exceptions.ConnectionError:
+            error = http_error('Error: could not connect to the API.', retryable=True)
+            response = None
+        except requests.exceptions.RequestException as e:
+            return http_error(f"Error: request failed ({e.__class__.__name__}).")
+
+        if response is not None:
+            if response.status_code == 429:
+                error = http_error('Error: likely due to rate limiting, sit tight for 2 minutes & try again.', 429, retryable=True)
+            elif response.status_code in RETRY_STATUSES:
+                error = http_error(f"Error fetching data from API. Status: {response.status_code}. Please alert an admin.", response.status_code, retryable=True)
+            else:
+                break
+
+        if attempt < retries:
+            time.sleep(get_retry_delay(attempt, response))
+    else:
+        return error
+
+    ##
+    ## not modified, the cached copy is still current
+    if response.status_code == 304 and entry:
+        with _response_cache_lock:
+            entry['fetched_at'] = time.time()
+        return entry['data']
 
     ##
     ## check for 200 response
     # response.status_code = 403
     if response.status_code != 200:
-        return {'Status': 'Error', 'Message': f"Error fetching data from API. Status: {response.status_code}. Please alert an admin."}
+        return http_error(f"Error fetching data from API. Status: {response.status_code}. Please alert an admin.", response.status_code)
     
     ##
     ## parse the JSON response
-    data = response.json()
+    try:
+        data = response.json()
+    except ValueError:
+        return http_error('Error: API returned invalid JSON. Please alert an admin.', response.status_code)
+
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+
+    if etag or last_modified or get_http_cache_ttl():
+        with _response_cache_lock:
+            _response_cache[get_cache_key(url, headers)] = {
+                'data': data,
+                'etag': etag,
+                'last_modified': last_modified,
+                'fetched_at': time.time()
+            }
+
     return data
 
 def get_alchemy_key():
@@ -58,6 +327,75 @@ def get_alchemy_key():
     """
     return get_env('ALCHEMY_KEY')
 
+def get_rpc_url():
+    """
+    Retrieves the JSON-RPC endpoint used for on-chain reads.
+
+    Returns
+    -------
+    str
+        The RPC_URL environment variable if set (e.g. a local stand-in node),
+        otherwise the Alchemy mainnet endpoint.
+    """
+    return get_env('RPC_URL') or f"https://eth-mainnet.g.alchemy.com/v2/{get_alchemy_key()}"
+
+def get_rpc_urls():
+    """
+    Retrieves every JSON-RPC endpoint on-chain reads may be spread over.
+
+    Returns
+    -------
+    list
+        The comma separated RPC_URLS environment variable if set, otherwise
+        just get_rpc_url().
+    """
+    urls = [url.strip() for url in (get_env('RPC_URLS') or '').split(',') if url.strip()]
+    return urls or [get_rpc_url()]
+
+def get_cache_dir():
+    """
+    Retrieves the directory for local state such as cached ABIs and checkpoints.
+
+    Returns
+    -------
+    str
+        The CACHE_DIR environment variable, or cache/ in the project root.
+    """
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return get_env('CACHE_DIR') or os.path.join(base_dir, 'cache')
+
+def write_atomic(path, content):
+    """
+    Writes a file through a temporary file renamed over it, so a reader never sees it half written.
+
+    Parameters
+    ----------
+    path : str
+        The file to write, its directory is created if needed.
+    content : str or bytes
+        The new contents of the file.
+
+    Raises
+    ------
+    OSError
+        If the file can't be written, the temporary file is removed.
+    """
+    ##
+    ## unique per thread, daemon threads in one process may write the same file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    try:
+        with open(tmp_path, 'wb' if isinstance(content, bytes) else 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
 def get_etherscan_key():
     """
     Retrieves the Etherscan API key from the environment variables.
@@ -86,6 +424,26 @@ def get_env(value):
     return os.getenv(value)
 
 
+def get_env_int(value, default):
+    """
+    Retrieves an environment variable as an int, falling back to default if unset or invalid.
+    """
+    try:
+        return int(get_env(value) or default)
+    except ValueError:
+        return default
+
+
+def get_env_float(value, default):
+    """
+    Retrieves an environment variable as a float, falling back to default if unset or invalid.
+    """
+    try:
+        return float(get_env(value) or default)
+    except ValueError:
+        return default
+
+
 def human_readable(num):
     """
     Convert large numbers to human-readable format with K, M, B suffixes.
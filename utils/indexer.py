@@ -0,0 +1,205 @@
+import os
+import json
+import logging
+from utils.helpers import is_dev, get_env, get_env_int, get_cache_dir, write_atomic
+from utils.multicall import async_multicall
+from utils.metrics import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOCK_RANGE = 2000
+DEFAULT_MAX_BLOCKS = 50000
+DEFAULT_RECONCILE_EVERY = 24
+DEFAULT_CONFIRMATIONS = 12
+
+
+def is_enabled():
+    """
+    Checks whether incremental balance tracking is on, set INDEXER_ENABLED=1 to only re-read pools with new events.
+
+    Off by default, it relies on every balance change emitting a collateral manager
+    log that names the pool.
+    """
+    return (get_env('INDEXER_ENABLED') or '0') != '0'
+
+
+def get_state_path():
+    """
+    Path of the checkpoint file holding the last indexed block and pool balances.
+    """
+    return os.path.join(get_cache_dir(), 'indexer_dev.json' if is_dev() else 'indexer.json')
+
+
+def load_state():
+    """
+    Load the checkpoint, or None if there isn't a usable one.
+
+    @returns: {'block': int, 'runs': int, 'balances': {lowercased pool => [balance values]},
+               'recent': {lowercased pool => block of its last event, for events not yet confirmed},
+               'mismatch': True once a reconciliation found changes the logs missed}
+    """
+    try:
+        with open(get_state_path()) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(state, dict) or 'block' not in state or 'balances' not in state:
+        return None
+
+    return state
+
+
+def save_state(state):
+    """
+    Write the checkpoint atomically.
+    """
+    try:
+        write_atomic(get_state_path(), json.dumps(state))
+    except OSError as e:
+        logger.warning(f"Failed to save indexer checkpoint: {e}")
+
+
+async def find_touched_pools(w3, address, pools, from_block, to_block):
+    """
+    Find which pools the collateral manager emitted events about in a block range.
+
+    Logs are fetched with eth_getLogs in bounded ranges. A pool counts as touched
+    when its address appears anywhere in a log's topics or data, which covers both
+    address arguments and partitions that embed the pool address, without relying
+    on specific event signatures.
+
+    @params w3: The AsyncWeb3 instance
+    @params address: The collateral manager address
+    @params pools: Lowercased pool addresses without the 0x prefix
+    @params from_block: The first block to scan
+    @params to_block: The last block to scan
+    @returns: Dict of touched pool address, in the same form as pools => block of its latest event
+    """
+    block_range = max(1, get_env_int('INDEXER_BLOCK_RANGE', DEFAULT_BLOCK_RANGE))
+    touched = {}
+    log_count = 0
+
+    for start in range(from_block, to_block + 1, block_range):
+        with span('eth_getLogs'):
+            logs = await w3.eth.get_logs({
+                'address': address,
+                'fromBlock': start,
+                'toBlock': min(start + block_range - 1, to_block)
+            })
+        log_count += len(logs)
+
+        for log in logs:
+            haystack = ''.join(bytes(topic).hex() for topic in log['topics'][1:]) + bytes(log['data']).hex()
+            for pool in pools:
+                if pool in haystack:
+                    touched[pool] = max(touched.get(pool, 0), log['blockNumber'])
+
+    logger.info(f"Scanned {log_count} logs in blocks {from_block}-{to_block}, {len(touched)} pools touched")
+    return touched
+
+
+async def read_balances(w3, contract, calls, block_number, concurrency=None):
+    """
+    Read accountBalances for every pool at a block, re-reading only pools that changed.
+
+    Starting from the checkpointed balances, only pools that the collateral manager
+    logged events about since the checkpoint block (plus any pool not seen before)
+    are read again. Every INDEXER_RECONCILE_EVERY runs, when the checkpoint is
+    missing or more than INDEXER_MAX_BLOCKS behind, or when the logs can't be
+    fetched, every pool is read to reconcile.
+
+    The checkpoint only advances to INDEXER_CONFIRMATIONS blocks behind the head,
+    so the latest blocks are scanned again next run, and pools with events in them
+    are re-read until those events are confirmed. A reorg within that depth is
+    therefore picked up. A reconciliation that finds a balance the logs didn't
+    account for means they can't be relied on, and every pool is read from then on.
+
+    @params w3: The AsyncWeb3 instance
+    @params contract: The collateral manager AsyncContract
+    @params calls: List of (pool address, amp address) argument tuples
+    @params block_number: The block to read at
+    @params concurrency: The maximum number of multicall chunks in flight
+    @returns: List of balances in the same order as calls
+    """
+    pools = [call[0][2:].lower() for call in calls]
+    state = load_state()
+
+    reconcile_every = max(1, get_env_int('INDEXER_RECONCILE_EVERY', DEFAULT_RECONCILE_EVERY))
+    max_blocks = get_env_int('INDEXER_MAX_BLOCKS', DEFAULT_MAX_BLOCKS)
+    confirmations = max(0, get_env_int('INDEXER_CONFIRMATIONS', DEFAULT_CONFIRMATIONS))
+
+    reason = None
+    if state is None:
+        reason = 'no checkpoint'
+    elif state.get('mismatch'):
+        reason = f"logs missed balance changes before, remove {get_state_path()} to index again"
+    elif state['block'] > block_number:
+        reason = 'checkpoint is ahead of the requested block'
+    elif block_number - state['block'] > max_blocks:
+        reason = 'checkpoint is too far behind'
+    elif state.get('runs', 0) + 1 >= reconcile_every:
+        reason = 'periodic reconciliation'
+
+    touched = None
+    if state is not None and not state.get('mismatch') and (reason is None or reason == 'periodic reconciliation'):
+        try:
+            touched = await find_touched_pools(w3, contract.address, pools, state['block'] + 1, block_number)
+        except Exception as e:
+            if reason is None:
+                reason = f"failed to fetch logs ({e!r})"
+
+    ##
+    ## events in the unconfirmed tail, kept so their pools are re-read until the events are confirmed
+    confirmed = max(state['block'] if state else 0, block_number - confirmations)
+    recent = dict(state.get('recent', {})) if state else {}
+    for pool, block in (touched or {}).items():
+        recent[pool] = max(recent.get(pool, 0), block)
+
+    if reason is not None:
+        logger.info(f"Reading every pool balance: {reason}")
+        _, balances = await async_multicall(w3, contract, 'accountBalances', calls, block_identifier=block_number, concurrency=concurrency)
+
+        mismatch = bool(state and state.get('mismatch'))
+        if reason == 'periodic reconciliation' and touched is not None:
+            ##
+            ## a pool the logs say is unchanged has to still hold its checkpointed balance
+            saved = state['balances']
+            missed = [
+                pool for pool, balance in zip(pools, balances)
+                if pool in saved and pool not in recent and list(balance) != saved[pool]
+            ]
+            if missed:
+                logger.warning(f"Reconciliation found {len(missed)} pool balance(s) that changed without a collateral manager log, reading every pool from now on")
+                mismatch = True
+
+        save_state({
+            'block': max(0, block_number - confirmations),
+            'runs': 0,
+            'balances': {pool: list(balance) for pool, balance in zip(pools, balances)},
+            'recent': {},
+            'mismatch': mismatch
+        })
+        return balances
+
+    ##
+    ## re-read only what changed, everything else carries over from the checkpoint
+    saved = state['balances']
+    stale = [i for i, pool in enumerate(pools) if pool in recent or pool not in saved]
+
+    if stale:
+        _, fresh = await async_multicall(w3, contract, 'accountBalances', [calls[i] for i in stale], block_identifier=block_number, concurrency=concurrency)
+        for i, balance in zip(stale, fresh):
+            saved[pools[i]] = list(balance)
+
+    logger.info(f"Re-read {len(stale)} of {len(pools)} pool balances")
+
+    save_state({
+        'block': confirmed,
+        'runs': state.get('runs', 0) + 1,
+        'balances': {pool: saved[pool] for pool in pools},
+        'recent': {pool: block for pool, block in recent.items() if block > confirmed},
+        'mismatch': False
+    })
+
+    return [tuple(saved[pool]) for pool in pools]
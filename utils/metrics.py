@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import logging
+import threading
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'ampy'
+
+##
+## resolved from METRICS_ENABLED on first use, see is_enabled()
+_enabled = None
+
+##
+## events recorded since the last flush(), and running totals per (span, labels)
+_events = []
+_stats = {}
+_lock = threading.Lock()
+
+
+class Span:
+    """
+    Times the block it wraps and records it when the block exits, failed or not.
+    """
+    __slots__ = ('name', 'labels', 'started')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record(self.name, time.perf_counter() - self.started, self.labels, exc_type is None)
+        return False
+
+
+class NullSpan:
+    """
+    Stand-in returned by span() while metrics are off, it does nothing.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def is_enabled():
+    """
+    Checks whether timing spans are recorded, set METRICS_ENABLED=1 to turn them on.
+    """
+    global _enabled
+
+    if _enabled is None:
+        from utils.helpers import get_env
+        _enabled = (get_env('METRICS_ENABLED') or '0') != '0'
+
+    return _enabled
+
+
+def set_enabled(enabled):
+    """
+    Turn recording on or off regardless of METRICS_ENABLED, None goes back to the environment.
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def span(name, **labels):
+    """
+    Context manager timing a block of work.
+
+        with span('eth_call', method='aggregate3'):
+            ...
+
+    @params name: The span name, e.g. 'save_tvl'
+    @params labels: Extra low-cardinality fields attached to the event and metric
+    @returns: A Span, or the shared NullSpan when metrics are off
+    """
+    if not is_enabled():
+        return NULL_SPAN
+
+    return Span(name, labels)
+
+
+def timed(name=None, **labels):
+    """
+    Decorator wrapping every call of a function in a span, named after the function by default.
+    """
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not is_enabled():
+                return fn(*args, **kwargs)
+
+            with Span(span_name, labels):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record(name, seconds, labels=None, ok=True):
+    """
+    Record one finished span as an event and fold it into the running totals.
+    """
+    labels = labels or {}
+    event = {'ts': round(time.time(), 3), 'span': name, 'seconds': round(seconds, 6), 'ok': ok}
+    event.update(labels)
+
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+    with _lock:
+        _events.append(event)
+        stat = _stats.get(key)
+        if stat is None:
+            stat = _stats[key] = {'count': 0, 'errors': 0, 'sum': 0.0, 'last': 0.0}
+        stat['count'] += 1
+        stat['sum'] += seconds
+        stat['last'] = seconds
+        if not ok:
+            stat['errors'] += 1
+
+
+def get_events():
+    """
+    The events recorded since the last flush(), oldest first.
+    """
+    with _lock:
+        return list(_events)
+
+
+def get_log_path():
+    """
+    Path of the JSON lines file timing events are appended to.
+
+    @returns: METRICS_LOG, or metrics.jsonl inside the cache directory
+    """
+    from utils.helpers import get_env, get_cache_dir
+    return get_env('METRICS_LOG') or os.path.join(get_cache_dir(), 'metrics.jsonl')
+
+
+def get_textfile_path():
+    """
+    Path of the Prometheus textfile the totals are written to, or None to skip it.
+    """
+    from utils.helpers import get_env
+    return get_env('METRICS_TEXTFILE') or None
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(name, labels):
+    pairs = [('span', name)] + list(labels)
+    return '{' + ','.join(f'{k}="{escape_label(v)}"' for k, v in pairs) + '}'
+
+
+def render_prometheus():
+    """
+    Render the running totals in the Prometheus text / OpenMetrics exposition format.
+
+    @returns: The exposition text
+    """
+    with _lock:
+        stats = sorted(_stats.items())
+
+    lines = [
+        f'# HELP {PREFIX}_span_duration_seconds Time spent in each instrumented stage.',
+        f'# TYPE {PREFIX}_span_duration_seconds summary'
+    ]
+    for (name, labels), stat in stats:
+        lines.append(f"{PREFIX}_span_duration_seconds_sum{format_labels(name, labels)} {stat['sum']:.6f}")
+        lines.append(f"{PREFIX}_span_duration_seconds_count{format_labels(name, labels)} {stat['count']}")
+
+    lines += [
+        f'# HELP {PREFIX}_span_last_duration_seconds Duration of the most recent span.',
+        f'# TYPE {PREFIX}_span_last_duration_seconds gauge'
+    ]
+    for (name, labels), stat in stats:
+        lines.append(f"{PREFIX}_span_last_duration_seconds{format_labels(name, labels)} {stat['last']:.6f}")
+
+    lines += [
+        f'# HELP {PREFIX}_span_errors_total Spans that exited with an exception.',
+        f'# TYPE {PREFIX}_span_errors_total counter'
+    ]
+    for (name, labels), stat in stats:
+        lines.append(f"{PREFIX}_span_errors_total{format_labels(name, labels)} {stat['errors']}")
+
+    lines += [
+        f'# HELP {PREFIX}_last_flush_timestamp_seconds When these metrics were written.',
+        f'# TYPE {PREFIX}_last_flush_timestamp_seconds gauge',
+        f'{PREFIX}_last_flush_timestamp_seconds {time.time():.3f}'
+    ]
+
+    return '\n'.join(lines) + '\n'
+
+
+def flush():
+    """
+    Append the pending events to the JSON lines log and rewrite the Prometheus textfile.
+
+    Called once per run so nothing touches the disk while spans are being timed.
+    Does nothing while metrics are off.
+    """
+    if not is_enabled():
+        return
+
+    with _lock:
+        events = list(_events)
+        _events.clear()
+
+    if events:
+        path = get_log_path()
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'a') as f:
+                f.writelines(json.dumps(event) + '\n' for event in events)
+        except OSError as e:
+            logger.warning(f"Failed to write timing events: {e}")
+
+    path = get_textfile_path()
+    if path:
+        ##
+        ## node_exporter may read the file at any moment, so replace it atomically
+        from utils.helpers import write_atomic
+        try:
+            write_atomic(path, render_prometheus())
+        except OSError as e:
+            logger.warning(f"Failed to write metrics textfile: {e}")
+
+
+def summarize(events=None):
+    """
+    Total seconds per span name, largest first, for a one-line log summary.
+    """
+    totals = {}
+    for event in get_events() if events is None else events:
+        totals[event['span']] = totals.get(event['span'], 0.0) + event['seconds']
+
+    return dict(sorted(totals.items(), key=lambda item: -item[1]))
@@ -0,0 +1,200 @@
+import logging
+from utils.database import db_session
+from utils.storage import is_embedded
+
+logger = logging.getLogger(__name__)
+
+
+def column_exists(cursor, table, column):
+    """
+    Checks whether a column exists on a table in the current database.
+    """
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        """, (table, column))
+    return cursor.fetchone()[0] > 0
+
+
+def index_exists(cursor, table, index):
+    """
+    Checks whether an index exists on a table in the current database.
+    """
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        """, (table, index))
+    return cursor.fetchone()[0] > 0
+
+
+def add_column(cursor, table, column, definition):
+    """
+    Adds a column unless it already exists, MySQL has no ADD COLUMN IF NOT EXISTS.
+    """
+    if not column_exists(cursor, table, column):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def add_index(cursor, table, index, columns, unique=False):
+    """
+    Adds an index unless one with the same name already exists.
+    """
+    if not index_exists(cursor, table, index):
+        cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {index} ON {table} ({columns})")
+
+
+def migration_1(cursor):
+    """
+    Base schema, a no-op for databases created before migrations existed.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS totals (
+            id INT UNSIGNED NOT NULL AUTO_INCREMENT,
+            amp DECIMAL(40, 0) NOT NULL,
+            usd DECIMAL(20, 2) NOT NULL,
+            PRIMARY KEY (id)
+        )
+        """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tvl (
+            id INT UNSIGNED NOT NULL AUTO_INCREMENT,
+            name VARCHAR(255) NOT NULL,
+            contract VARCHAR(42) NOT NULL,
+            amp_total DECIMAL(40, 0) NOT NULL,
+            usd BIGINT NOT NULL,
+            batch_id INT UNSIGNED NOT NULL,
+            PRIMARY KEY (id)
+        )
+        """)
+
+
+def migration_2(cursor):
+    """
+    Timestamp each batch so history can be queried by time window.
+    Rows saved before this migration get the time it ran.
+    """
+    add_column(cursor, 'totals', 'created_at', "TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP")
+    add_index(cursor, 'totals', 'idx_totals_created_at', 'created_at')
+
+
+def migration_3(cursor):
+    """
+    Indexes behind get_saved_tvl(), get_snapshot() and the series queries.
+    """
+    add_index(cursor, 'tvl', 'idx_tvl_batch_id', 'batch_id')
+    add_index(cursor, 'tvl', 'idx_tvl_contract_batch_id', 'contract, batch_id')
+    add_index(cursor, 'tvl', 'idx_tvl_name_batch_id', 'name, batch_id')
+
+
+def migration_4(cursor):
+    """
+    Record the block every pool was read at and the price the batch was valued with.
+    """
+    add_column(cursor, 'totals', 'block_number', "BIGINT UNSIGNED NULL")
+    add_column(cursor, 'totals', 'price', "DOUBLE NULL")
+    add_column(cursor, 'totals', 'price_time', "BIGINT UNSIGNED NULL")
+    add_index(cursor, 'totals', 'idx_totals_block_number', 'block_number')
+
+
+def migration_5(cursor):
+    """
+    Key each batch by the spool entry it was written from, so replaying the spool is idempotent.
+    Batches saved before this migration have no key.
+    """
+    add_column(cursor, 'totals', 'batch_key', "CHAR(32) NULL")
+    add_index(cursor, 'totals', 'idx_totals_batch_key', 'batch_key', unique=True)
+
+
+##
+## append only, never edit or reorder a migration once it has shipped
+MIGRATIONS = [
+    (1, 'create totals and tvl tables', migration_1),
+    (2, 'add totals.created_at', migration_2),
+    (3, 'add tvl batch, contract and name indexes', migration_3),
+    (4, 'add totals block_number, price and price_time', migration_4),
+    (5, 'add totals.batch_key', migration_5),
+]
+
+
+def get_schema_version(cursor):
+    """
+    Retrieves the highest applied migration version, creating the tracking table if needed.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT UNSIGNED NOT NULL,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (version)
+        )
+        """)
+    cursor.execute("SELECT MAX(version) FROM schema_migrations")
+    version = cursor.fetchone()[0]
+    return version or 0
+
+
+def migrate():
+    """
+    Applies every pending migration in order.
+
+    DDL commits implicitly in MySQL, so each migration is written to be safe to
+    re-run if it fails part way through.
+
+    @returns: The schema version after migrating
+    """
+    if is_embedded():
+        return migrate_embedded()
+
+    with db_session() as conn:
+        cursor = conn.cursor()
+        try:
+            version = get_schema_version(cursor)
+
+            for migration_version, description, migration in MIGRATIONS:
+                if migration_version <= version:
+                    continue
+
+                logger.info(f"Applying migration {migration_version}: {description}")
+                migration(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (migration_version, description)
+                )
+                conn.commit()
+                version = migration_version
+        finally:
+            cursor.close()
+
+    return version
+
+
+def migrate_embedded():
+    """
+    Records every migration as applied on the embedded database.
+
+    Its schema is created up to date when the file is first opened, so the
+    migrations written for MySQL are never run against it.
+
+    @returns: The schema version
+    """
+    with db_session() as conn:
+        cursor = conn.cursor()
+        try:
+            version = get_schema_version(cursor)
+            cursor.executemany(
+                "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                [(migration_version, description) for migration_version, description, _ in MIGRATIONS if migration_version > version]
+            )
+        finally:
+            cursor.close()
+
+    return MIGRATIONS[-1][0]
+
+
+if __name__ == '__main__':
+    ##
+    ## python -m utils.migrations [dev]
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from dotenv import load_dotenv
+    load_dotenv()
+    logger.info(f"Schema is at version {migrate()}")
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+from web3 import Web3
+from eth_utils.abi import get_abi_output_types
+from utils.helpers import get_env, get_env_int
+from utils.metrics import span
+
+logger = logging.getLogger(__name__)
+
+##
+## Multicall3 is deployed at the same address on mainnet and most other chains.
+## can be overridden for local stand-in nodes that deploy it elsewhere.
+MULTICALL3_ADDRESS = '0xcA11bde05977b3631167028862bE2a173976CA11'
+
+MULTICALL3_ABI = [
+    {
+        'name': 'aggregate3',
+        'type': 'function',
+        'stateMutability': 'payable',
+        'inputs': [
+            {
+                'name': 'calls',
+                'type': 'tuple[]',
+                'components': [
+                    {'name': 'target', 'type': 'address'},
+                    {'name': 'allowFailure', 'type': 'bool'},
+                    {'name': 'callData', 'type': 'bytes'}
+                ]
+            }
+        ],
+        'outputs': [
+            {
+                'name': 'returnData',
+                'type': 'tuple[]',
+                'components': [
+                    {'name': 'success', 'type': 'bool'},
+                    {'name': 'returnData', 'type': 'bytes'}
+                ]
+            }
+        ]
+    }
+]
+
+DEFAULT_CHUNK_SIZE = 100
+
+
+def get_multicall_address():
+    """
+    Retrieves the Multicall3 address, allowing an override from the environment.
+
+    Returns
+    -------
+    str
+        The checksummed Multicall3 contract address.
+    """
+    return Web3.to_checksum_address(get_env('MULTICALL_ADDRESS') or MULTICALL3_ADDRESS)
+
+
+def get_chunk_size():
+    """
+    Retrieves the maximum number of calls to aggregate into a single eth_call.
+
+    Returns
+    -------
+    int
+        The chunk size from MULTICALL_CHUNK_SIZE, or DEFAULT_CHUNK_SIZE.
+    """
+    return max(1, get_env_int('MULTICALL_CHUNK_SIZE', DEFAULT_CHUNK_SIZE))
+
+
+def encode_calls(contract, fn_name, args_list):
+    """
+    Encode a list of calls to the same contract function as Multicall3 Call3 structs.
+
+    Parameters
+    ----------
+    contract : web3.contract.Contract
+        The contract instance the calls are made against.
+    fn_name : str
+        The name of the function to call.
+    args_list : list
+        A list of argument tuples, one per call.
+
+    Returns
+    -------
+    list
+        A list of (target, allowFailure, callData) tuples.
+    """
+    return [
+        (contract.address, True, contract.encode_abi(fn_name, args=list(args)))
+        for args in args_list
+    ]
+
+
+def decode_results(w3, contract, fn_name, results):
+    """
+    Decode the raw Multicall3 results for a single contract function in bulk.
+
+    Parameters
+    ----------
+    w3 : web3.Web3 or web3.AsyncWeb3
+        The web3 instance whose codec is used for decoding.
+    contract : web3.contract.Contract
+        The contract instance the calls were made against.
+    fn_name : str
+        The name of the function that was called.
+    results : list
+        The (success, returnData) tuples returned by aggregate3.
+
+    Returns
+    -------
+    list
+        The decoded return values, or None for any call that failed.
+    """
+    output_types = get_abi_output_types(contract.get_function_by_name(fn_name).abi)
+
+    decoded = []
+    for success, return_data in results:
+        if not success or not return_data:
+            decoded.append(None)
+            continue
+
+        try:
+            decoded.append(w3.codec.decode(output_types, bytes(return_data)))
+        except Exception as e:
+            logger.warning(f"Failed to decode {fn_name} result: {e}")
+            decoded.append(None)
+
+    return decoded
+
+
+async def async_multicall(w3, contract, fn_name, args_list, block_identifier=None, chunk_size=None, concurrency=None):
+    """
+    Read the same contract function for many argument sets via Multicall3 aggregate3,
+    reading chunks concurrently.
+
+    Every chunk is pinned to a single block so the results form a consistent snapshot.
+    If a chunk fails, or an individual call inside a chunk fails, those calls are
+    retried one by one against the same block.
+
+    Parameters
+    ----------
+    w3 : web3.AsyncWeb3
+        The async web3 instance to use.
+    contract : web3.contract.AsyncContract
+        The contract instance to read from.
+    fn_name : str
+        The name of the function to call.
+    args_list : list
+        A list of argument tuples, one per call.
+    block_identifier : int
+        The block number to read at. Defaults to the latest block number.
+    chunk_size : int
+        The maximum number of calls per aggregate3 request.
+    concurrency : int
+        The maximum number of aggregate3 requests in flight at once.
+
+    Returns
+    -------
+    tuple
+        (block_number, results) where results are in the same order as args_list.
+    """
+    if block_identifier is None:
+        block_identifier = await w3.eth.block_number
+
+    chunk_size = chunk_size or get_chunk_size()
+    multicall_contract = w3.eth.contract(address=get_multicall_address(), abi=MULTICALL3_ABI)
+    chunks = [args_list[start:start + chunk_size] for start in range(0, len(args_list), chunk_size)]
+    semaphore = asyncio.Semaphore(concurrency or max(len(chunks), 1))
+
+    async def read_chunk(chunk):
+        async with semaphore:
+            try:
+                with span('eth_call', method='aggregate3'):
+                    raw = await multicall_contract.functions.aggregate3(
+                        encode_calls(contract, fn_name, chunk)
+                    ).call(block_identifier=block_identifier)
+                decoded = decode_results(w3, contract, fn_name, raw)
+            except Exception as e:
+                logger.warning(f"Multicall chunk of {len(chunk)} {fn_name} calls failed, falling back to single calls: {e}")
+                decoded = [None] * len(chunk)
+
+            for i, value in enumerate(decoded):
+                if value is None:
+                    with span('eth_call', method=fn_name):
+                        decoded[i] = await getattr(contract.functions, fn_name)(*chunk[i]).call(block_identifier=block_identifier)
+
+            return decoded
+
+    chunk_results = await asyncio.gather(*(read_chunk(chunk) for chunk in chunks))
+
+    return block_identifier, [value for chunk in chunk_results for value in chunk]
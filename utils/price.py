@@ -1,18 +1,42 @@
-from utils import run_curl
+from utils import run_curl, get_env
+from utils.metrics import timed
+from utils.amounts import parse_price
 
-def get_price():
-	##
-    ## get the price from pyth so it's closer to the value on app.flexa.co
-    url = 'https://hermes.pyth.network/v2/updates/price/latest?ids[]=0xd37e4513ebe235fff81e453d400debaf9a49a5df2b7faa11b3831d35d7e72cb7'
-    
+##
+## get the price from pyth so it's closer to the value on app.flexa.co
+PRICE_URL = 'https://hermes.pyth.network/v2/updates/price/latest?ids[]=0xd37e4513ebe235fff81e453d400debaf9a49a5df2b7faa11b3831d35d7e72cb7'
+
+@timed('get_price')
+def get_price_data():
+    """
+    Get the AMP price from pyth along with the time it was published.
+
+    Returns
+    -------
+    dict
+        {'price': <exact AMP price in USD as a Decimal>, 'publish_time': <unix timestamp>}, or
+        {'Status': 'Error', 'Message': <error message>} if the request fails.
+    """
     ##
     ## attempt to get data from API
     ## if it fails, return error message
-    data = run_curl(url)
+    data = run_curl(get_env('PYTH_PRICE_URL') or PRICE_URL)
     
     if 'Status' in data and data['Status'] == 'Error':
-        return data['Message']
+        return data
+
+    price = data['parsed'][0]['price']
+    amp_price = parse_price(price['price'], price['expo'])
 
-    amp_price = int(data['parsed'][0]['price']['price']) / (10 ** abs(data['parsed'][0]['price']['expo']))
+    return {
+        'price': amp_price,
+        'publish_time': int(price['publish_time'])
+    }
+
+def get_price():
+    data = get_price_data()
+
+    if 'Status' in data and data['Status'] == 'Error':
+        return data['Message']
 
-    return amp_price
\ No newline at end of file
+    return data['price']
@@ -0,0 +1,293 @@
+import os
+import json
+import time
+import shutil
+import logging
+import mimetypes
+import threading
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit
+from utils.helpers import is_dev, get_env, get_env_float, get_cache_dir, get_http_session
+from utils.metrics import span
+
+logger = logging.getLogger(__name__)
+
+SINKS = ['twitter', 'webhook', 'archive']
+DEFAULT_SINKS = ['twitter']
+
+DEFAULT_TIMEOUT = 60
+
+
+class Report(NamedTuple):
+    """
+    One run's output, rendered once and handed to every sink unchanged.
+    """
+    text: str                    # the tweet text
+    table: str                   # the rendered table as plain text
+    image: bytes                 # the table image, encoded
+    filename: str                # image filename, its extension gives the type
+    created_at: float            # unix time the report was rendered
+    batch_id: Optional[int] = None
+
+    @property
+    def content_type(self):
+        return mimetypes.guess_type(self.filename)[0] or 'application/octet-stream'
+
+
+def build_report(text, table, img, batch_id=None):
+    """
+    Encode the image and freeze everything the sinks need into a Report.
+
+    @params text: The tweet text
+    @params table: The PrettyTable, or its text
+    @params img: The PIL Image of the table
+    @params batch_id: The totals ID of the batch reported on, None for previews
+    @returns: Report
+    """
+    from utils.render import encode_image
+
+    buffer, filename = encode_image(img)
+    return Report(text, str(table), buffer.getvalue(), filename, time.time(), batch_id)
+
+
+def get_sink_names():
+    """
+    Retrieves the sinks to publish to from PUBLISH_SINKS, a comma separated list of twitter, webhook and archive.
+    """
+    value = get_env('PUBLISH_SINKS')
+    if not value:
+        return list(DEFAULT_SINKS)
+
+    names = []
+    for name in value.split(','):
+        name = name.strip().lower()
+        if name in SINKS and name not in names:
+            names.append(name)
+        elif name:
+            logger.warning(f"Unknown publish sink {name}, skipping it")
+
+    return names
+
+
+def get_webhook_urls():
+    """
+    Retrieves the comma separated WEBHOOK_URLS (or DEV_WEBHOOK_URLS in dev).
+    """
+    prefix = 'DEV_' if is_dev() else ''
+    return [url.strip() for url in (get_env(f'{prefix}WEBHOOK_URLS') or '').split(',') if url.strip()]
+
+
+def get_archive_dir():
+    """
+    Retrieves where the archive sink keeps reports, ARCHIVE_DIR or cache/archive.
+    """
+    return get_env('ARCHIVE_DIR') or os.path.join(get_cache_dir(), 'archive_dev' if is_dev() else 'archive')
+
+
+def get_timeout(sink):
+    """
+    Retrieves the timeout in seconds for a sink.
+
+    @params sink: The sink's kind, e.g. 'twitter', 'webhook' or 'archive'
+    @returns: PUBLISH_TIMEOUT_<SINK> if set, otherwise PUBLISH_TIMEOUT, otherwise DEFAULT_TIMEOUT
+    """
+    return get_env_float(f'PUBLISH_TIMEOUT_{sink.upper()}', get_env_float('PUBLISH_TIMEOUT', DEFAULT_TIMEOUT))
+
+
+class Sink:
+    """
+    Somewhere a report is published to.
+
+    send() blocks and returns 'sent' or 'queued' (accepted, delivered later),
+    raising or returning 'failed' when the report didn't get through.
+    """
+    kind = None
+
+    @property
+    def name(self):
+        return self.kind
+
+    def send(self, report):
+        raise NotImplementedError
+
+
+class TwitterSink(Sink):
+    """
+    Posts through the rate limited tweet queue, see utils.twitter.TwitterPublisher.
+    """
+    kind = 'twitter'
+
+    def __init__(self, publisher):
+        self.publisher = publisher
+
+    def send(self, report):
+        from utils.twitter import enqueue
+
+        entry_id = enqueue(report.text, report.image, report.filename)
+        status = self.publisher.publish_due().get(entry_id, 'queued')
+
+        if status == 'queued':
+            next_attempt = self.publisher.get_next_attempt()
+            when = time.strftime('%H:%M', time.localtime(next_attempt)) if next_attempt else 'the next run'
+            logger.info(f"Tweet {entry_id} queued, next attempt at {when}")
+
+        return status
+
+
+class WebhookSink(Sink):
+    """
+    POSTs the report to an HTTP webhook as multipart/form-data.
+
+    The payload_json part holds the text (also as content), table, batch ID and
+    timestamp, and the file part holds the image, which is the shape Discord
+    webhooks accept and is easy to handle anywhere else.
+    """
+    kind = 'webhook'
+
+    def __init__(self, url):
+        self.url = url
+
+    @property
+    def name(self):
+        ##
+        ## host only, webhook URLs carry their secret in the path
+        return f"webhook:{urlsplit(self.url).hostname}"
+
+    def send(self, report):
+        payload = {
+            'content': report.text,
+            'text': report.text,
+            'table': report.table,
+            'batch_id': report.batch_id,
+            'created_at': int(report.created_at)
+        }
+
+        response = get_http_session().post(
+            self.url,
+            data={'payload_json': json.dumps(payload)},
+            files={'file': (report.filename, report.image, report.content_type)},
+            timeout=get_timeout(self.kind)
+        )
+        response.raise_for_status()
+        return 'sent'
+
+
+class ArchiveSink(Sink):
+    """
+    Writes the report's text, table and image to disk.
+
+    By default every report gets its own timestamped directory under ARCHIVE_DIR,
+    written to a temporary directory first and renamed into place. With flat=True
+    the files go straight into the directory, replacing the previous report,
+    which is what dry runs use.
+    """
+    kind = 'archive'
+
+    def __init__(self, directory=None, flat=False):
+        self.directory = directory or get_archive_dir()
+        self.flat = flat
+
+    def write(self, directory, report):
+        with open(os.path.join(directory, 'tweet.txt'), 'w') as f:
+            f.write(f"{report.text}\n{report.table}\n")
+        with open(os.path.join(directory, report.filename), 'wb') as f:
+            f.write(report.image)
+
+    def send(self, report):
+        if self.flat:
+            os.makedirs(self.directory, exist_ok=True)
+            self.write(self.directory, report)
+            return 'sent'
+
+        name = time.strftime('%Y%m%d-%H%M%S', time.gmtime(report.created_at))
+        if report.batch_id is not None:
+            name = f"{name}-{report.batch_id}"
+
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+
+        os.makedirs(tmp_path, exist_ok=True)
+        try:
+            self.write(tmp_path, report)
+            os.replace(tmp_path, path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        return 'sent'
+
+
+def build_sinks(names=None, publisher=None):
+    """
+    Create the configured sinks.
+
+    @params names: Sink kinds, defaults to get_sink_names()
+    @params publisher: The TwitterPublisher for the twitter sink, which is left out without one
+    @returns: List of Sink
+    """
+    sinks = []
+
+    for name in names if names is not None else get_sink_names():
+        if name == 'twitter':
+            if publisher is not None:
+                sinks.append(TwitterSink(publisher))
+        elif name == 'webhook':
+            urls = get_webhook_urls()
+            if not urls:
+                logger.warning("The webhook sink is enabled but WEBHOOK_URLS is empty")
+            sinks.extend(WebhookSink(url) for url in urls)
+        elif name == 'archive':
+            sinks.append(ArchiveSink())
+
+    return sinks
+
+
+def dispatch(report, sinks):
+    """
+    Publish a report to every sink concurrently, a failing or slow sink doesn't hold up the others.
+
+    Sinks block, so each runs in its own daemon thread and is given until its
+    timeout. Sinks also bound their own requests by it, and a sink that still
+    overruns is reported as failed and left behind, it can't keep the process
+    from exiting.
+
+    @params report: The Report
+    @params sinks: List of Sink from build_sinks()
+    @returns: Dict of sink name => 'sent', 'queued' or 'failed'
+    """
+    results = {}
+
+    def run(sink):
+        try:
+            with span('publish', sink=sink.kind):
+                results[sink] = sink.send(report)
+        except Exception as e:
+            results[sink] = e
+
+    started = time.monotonic()
+    threads = []
+    for sink in sinks:
+        thread = threading.Thread(target=run, args=(sink,), name=f'publish-{sink.kind}', daemon=True)
+        thread.start()
+        threads.append((sink, thread))
+
+    statuses = {}
+    for sink, thread in threads:
+        timeout = get_timeout(sink.kind)
+        thread.join(max(0, started + timeout - time.monotonic()))
+
+        result = TimeoutError(f"no result after {timeout:g}s") if thread.is_alive() else results.get(sink)
+        if isinstance(result, Exception):
+            logger.error(f"❌ Publishing to {sink.name} failed: {result!r}")
+            result = 'failed'
+        elif result == 'failed':
+            logger.error(f"❌ Publishing to {sink.name} failed")
+
+        ##
+        ## several webhooks may share a host
+        name = sink.name
+        while name in statuses:
+            name = f"{sink.name}#{len(statuses)}"
+        statuses[name] = result
+
+    return statuses
@@ -0,0 +1,130 @@
+import os
+from io import BytesIO
+from functools import lru_cache
+from utils.helpers import get_env
+from utils.metrics import timed
+
+FONT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'UbuntuMono-R.ttf')
+FONT_SIZE = 30
+
+IMAGE_FORMATS = {
+    'jpeg': ('JPEG', 'jpg'),
+    'png': ('PNG', 'png')
+}
+
+##
+## matches the default line spacing ImageDraw.multiline_text uses
+LINE_SPACING = 4
+PADDING = 20
+
+
+@lru_cache(maxsize=8)
+def load_font(size=FONT_SIZE):
+    """
+    Load the table font once per size and keep it in memory for later renders.
+    """
+    from PIL import ImageFont
+
+    return ImageFont.truetype(FONT_PATH, size)
+
+
+def build_table(rows):
+    """
+    Build the pool table shown in the tweet image.
+
+    @params rows: List of [name, 30 day APY, USD, AMP, change] rows from build_pool_rows()
+    @returns: The PrettyTable instance
+    """
+    import prettytable as pt
+
+    ##
+    ## setup columns and alignment
+    table = pt.PrettyTable(['Pool', '30D', 'USD', 'AMP', 'Change'])
+    table.align['Pool'] = 'l'
+    table.align['30D'] = 'r'
+    table.align['USD'] = 'r'
+    table.align['AMP'] = 'r'
+    table.align['Change'] = 'r'
+    table.padding_width = 1
+    table.header_style = 'upper'
+
+    ##
+    ## add rows to table
+    table.add_rows(rows)
+
+    return table
+
+
+def measure_text(text, font):
+    """
+    Measure multiline text straight from the font metrics, without drawing it.
+
+    Uses the same line height as ImageDraw.multiline_text so the result matches
+    what ImageDraw.textbbox would report for the text drawn at (0, 0).
+
+    @params text: The text to measure
+    @params font: The FreeTypeFont to measure with
+    @returns: (right, bottom) of the text's bounding box
+    """
+    lines = text.split('\n')
+    line_height = font.getbbox('A')[3] + LINE_SPACING
+
+    right = max(font.getbbox(line)[2] for line in lines)
+    bottom = line_height * (len(lines) - 1) + font.getbbox(lines[-1])[3]
+
+    return right, bottom
+
+
+@timed()
+def render_table(table, size=FONT_SIZE):
+    """
+    Render the table text onto an image sized to fit it.
+
+    @params table: The PrettyTable (or any text) to render
+    @params size: The font size
+    @returns: The PIL Image
+    """
+    from PIL import Image, ImageDraw
+
+    text = f'{table}'
+    fnt = load_font(size)
+    right, bottom = measure_text(text, fnt)
+
+    img = Image.new('RGB', (right + PADDING * 2, bottom + PADDING * 2), color = (255, 255, 255))
+    d = ImageDraw.Draw(img)
+    d.multiline_text((PADDING, PADDING), text, font=fnt, fill=(0, 0, 0), spacing=LINE_SPACING)
+
+    return img
+
+
+def get_image_format():
+    """
+    Retrieves the image format for the tweet, 'jpeg' (default) or 'png', from IMAGE_FORMAT.
+    """
+    image_format = (get_env('IMAGE_FORMAT') or 'jpeg').lower()
+    return image_format if image_format in IMAGE_FORMATS else 'jpeg'
+
+
+@timed()
+def encode_image(img, image_format=None):
+    """
+    Encode an image into an in-memory buffer ready for upload.
+
+    PNG output is saved as single channel grayscale, which keeps the black on
+    white text table small and sharp compared to JPEG.
+
+    @params img: The PIL Image to encode
+    @params image_format: 'jpeg' or 'png', defaults to get_image_format()
+    @returns: Tuple of (BytesIO positioned at the start, filename with matching extension)
+    """
+    image_format = image_format or get_image_format()
+    pil_format, extension = IMAGE_FORMATS[image_format]
+
+    buffer = BytesIO()
+    if pil_format == 'PNG':
+        img.convert('L').save(buffer, pil_format, optimize=True)
+    else:
+        img.save(buffer, pil_format)
+    buffer.seek(0)
+
+    return buffer, f'twitter.{extension}'
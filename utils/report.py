@@ -0,0 +1,123 @@
+from utils.helpers import get_sign
+from utils.amounts import AMP_DECIMALS, USD_DECIMALS, to_wei, to_scaled, usd_cents, format_scaled, format_column
+
+
+def get_pool_key(contract):
+    """
+    Normalise a pool contract address so DB rows and flexa pools can be matched on it.
+
+    Pool display names aren't used as keys since tvl() strips "wallet" from them.
+    """
+    return contract.lower()
+
+
+def build_summary(saved_totals, amp_price):
+    """
+    Build the tweet text from the last two totals rows.
+
+    @params saved_totals: The [current, previous] rows from get_saved_totals()
+    @params amp_price: The exact AMP price in USD used to value the change in staked AMP
+    @returns: The tweet text
+    """
+    tweet_text = ''
+
+    ##
+    ## Calculate the total spending capacity and change.
+    current_spending = to_scaled(saved_totals[0][2], USD_DECIMALS)
+
+    total_spending = f"${format_scaled(current_spending, USD_DECIMALS)}"
+
+    tweet_text += f"Spending Capacity: {total_spending}\n"
+
+    ##
+    ## staked amp total and change, in exact wei
+    current_amp = to_wei(saved_totals[0][1])
+    previous_amp = to_wei(saved_totals[1][1])
+
+    total_amp_change = abs(current_amp - previous_amp)
+    sign = get_sign(current_amp, previous_amp)
+
+    if total_amp_change == 0:
+        sign = ''
+
+    change_usd = usd_cents(total_amp_change, amp_price)
+    total_amp = f"{format_scaled(current_amp, AMP_DECIMALS)} ({sign}{format_scaled(total_amp_change, AMP_DECIMALS)} AMP, ${format_scaled(change_usd, USD_DECIMALS)} USD)"
+
+    tweet_text += f"Staked AMP: {total_amp}\n"
+
+    return tweet_text
+
+
+def build_pool_rows(saved_tvl, current_batch_id, previous_batch_id, apy_result):
+    """
+    Build the table rows comparing the current batch against the previous one.
+
+    Current batch, previous batch and APY data are indexed by pool contract address,
+    so the rows come out of a single pass. Pools that are new in the current batch
+    show "NEW" as their change, and pools missing from it are listed with a zero
+    balance and their full previous amount as the change.
+
+    @params saved_tvl: The rows from get_saved_tvl() for both batches
+    @params current_batch_id: The batch ID of the current totals row
+    @params previous_batch_id: The batch ID of the previous totals row
+    @params apy_result: The flexa collateral_pools response
+    @returns: List of [name, 30 day APY, USD, AMP, change] rows
+    """
+    current_pools = {}
+    previous_pools = {}
+    for row in saved_tvl:
+        if row[5] == current_batch_id:
+            current_pools[get_pool_key(row[2])] = row
+        elif row[5] == previous_batch_id:
+            previous_pools[get_pool_key(row[2])] = row
+
+    ##
+    ## flexa pool ids look like <chain>:<namespace>:<contract>
+    apys = {}
+    for apy_pool in apy_result.get('data', []):
+        ids = apy_pool['id'].split(':')
+        apys[get_pool_key(ids[2])] = apy_pool['reward_rate']['30_day']['label']
+
+    ##
+    ## gather each column as exact integers first, then format whole columns at once
+    names, rates, usd, amp, changes = [], [], [], [], []
+    for key, row in current_pools.items():
+        current_pool_amp = to_wei(row[3])
+
+        previous = previous_pools.get(key)
+        if previous is None:
+            changes.append('NEW')
+        else:
+            changes.append(current_pool_amp - to_wei(previous[3]))
+
+        names.append(row[1])
+        rates.append(apys.get(key, 'N/A'))
+        usd.append(int(row[4]))
+        amp.append(current_pool_amp)
+
+    ##
+    ## pools that dropped out since the previous batch
+    for key, row in previous_pools.items():
+        if key in current_pools:
+            continue
+
+        names.append(row[1])
+        rates.append(apys.get(key, 'N/A'))
+        usd.append(0)
+        amp.append(0)
+        changes.append(-to_wei(row[3]))
+
+    deltas = [change for change in changes if change != 'NEW' and change != 0]
+    formatted_deltas = iter(format_column([abs(change) for change in deltas], AMP_DECIMALS))
+
+    change_column = []
+    for change in changes:
+        if change == 'NEW' or change == 0:
+            change_column.append(change)
+        else:
+            change_column.append(f"{'+' if change > 0 else '-'}{next(formatted_deltas)}")
+
+    return [
+        list(row)
+        for row in zip(names, rates, [f"${value}" for value in format_column(usd)], format_column(amp, AMP_DECIMALS), change_column)
+    ]
@@ -0,0 +1,330 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from urllib.parse import urlsplit
+from web3.providers.async_base import AsyncJSONBaseProvider
+from web3 import AsyncHTTPProvider
+from utils.helpers import get_env, get_env_int, get_env_float
+from utils.metrics import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN = 30
+DEFAULT_WINDOW = 50
+
+##
+## bounds for the adaptive hedge delay, a multiple of the primary's typical latency
+HEDGE_MULTIPLIER = 3
+HEDGE_MIN = 0.1
+HEDGE_MAX = 2.0
+HEDGE_UNMEASURED = 1.0
+
+##
+## hedges allowed as a fraction of requests, so a slow patch can't multiply the load on every endpoint
+DEFAULT_HEDGE_BUDGET = 0.1
+HEDGE_BURST = 2
+
+##
+## smoothing for the latency average, higher reacts faster
+EWMA_ALPHA = 0.3
+
+##
+## JSON-RPC errors that mean the endpoint is throttling or broken, not that the call itself failed
+ENDPOINT_ERROR_CODES = {429, -32005}
+
+##
+## error messages from a node that hasn't synced up to the requested block yet or has pruned its state,
+## the same call at the same block works on a node that has it
+BLOCK_UNAVAILABLE_ERRORS = (
+    'header not found', 'unknown block', 'block not found', 'missing trie node',
+    'historical state', 'state is not available', 'invalid block tag'
+)
+
+
+class EndpointError(Exception):
+    """
+    An endpoint answered with an error that says nothing about the request itself.
+    """
+
+
+def is_endpoint_error(error):
+    """
+    Checks whether a JSON-RPC error object is the endpoint's fault, so another endpoint should be asked.
+    """
+    if not isinstance(error, dict):
+        return False
+
+    message = str(error.get('message', '')).lower()
+    return (
+        error.get('code') in ENDPOINT_ERROR_CODES
+        or 'rate limit' in message
+        or any(text in message for text in BLOCK_UNAVAILABLE_ERRORS)
+    )
+
+
+class Endpoint:
+    """
+    One JSON-RPC endpoint with its rolling latency, error rate and circuit breaker state.
+    """
+    def __init__(self, url, window=DEFAULT_WINDOW):
+        self.url = url
+        self.provider = AsyncHTTPProvider(url, exception_retry_configuration=None)
+        self.outcomes = deque(maxlen=window)
+        self.latency = None
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    @property
+    def name(self):
+        """
+        host:port of the endpoint, safe to log since API keys live in the path.
+        """
+        parts = urlsplit(self.url)
+        return f"{parts.hostname}:{parts.port}" if parts.port else parts.hostname
+
+    @property
+    def error_rate(self):
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def is_available(self, now):
+        """
+        Closed circuits are always available, open ones again once their cooldown is over.
+        """
+        return now >= self.open_until
+
+    def score(self):
+        """
+        Lower is better, the latency average inflated by the recent error rate.
+        Endpoints without measurements score 0 so they get tried.
+        """
+        if self.latency is None:
+            return 0.0
+        return self.latency * (1 + 4 * self.error_rate)
+
+    def record_latency(self, seconds):
+        self.latency = seconds if self.latency is None else EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * self.latency
+
+    def record_success(self, seconds):
+        self.outcomes.append(True)
+        self.record_latency(seconds)
+
+        if self.consecutive_failures >= get_failure_threshold():
+            logger.info(f"RPC endpoint {self.name} recovered")
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record_failure(self, cooldown):
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+
+        if self.consecutive_failures >= get_failure_threshold():
+            if self.open_until == 0.0:
+                logger.warning(f"RPC endpoint {self.name} failed {self.consecutive_failures} times in a row, pausing it for {cooldown:.0f}s")
+            self.open_until = time.monotonic() + cooldown
+
+
+def get_failure_threshold():
+    """
+    Consecutive failures before an endpoint's circuit opens, from RPC_FAILURE_THRESHOLD.
+    """
+    return max(1, get_env_int('RPC_FAILURE_THRESHOLD', DEFAULT_FAILURE_THRESHOLD))
+
+
+class FailoverProvider(AsyncJSONBaseProvider):
+    """
+    Async web3 provider spreading reads over several JSON-RPC endpoints.
+
+    Each request goes to the healthy endpoint with the best rolling latency. If it
+    hasn't answered within the hedge delay the next best endpoint is asked too,
+    and whichever answers first wins, within a budget of RPC_HEDGE_BUDGET hedges per
+    request so hedging can't snowball into overload. Failures move on to the next endpoint straight
+    away, and an endpoint that fails RPC_FAILURE_THRESHOLD times in a row is skipped
+    for RPC_COOLDOWN seconds before it is given another chance.
+
+    Only use it for reads, a hedged request may reach more than one endpoint.
+    """
+    logger = logging.getLogger('utils.rpc.FailoverProvider')
+
+    def __init__(self, urls, **kwargs):
+        if not urls:
+            raise ValueError('FailoverProvider needs at least one endpoint')
+
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.timeout = get_env_float('RPC_TIMEOUT', DEFAULT_TIMEOUT)
+        self.cooldown = get_env_float('RPC_COOLDOWN', DEFAULT_COOLDOWN)
+
+        self.hedge_budget = get_env_float('RPC_HEDGE_BUDGET', DEFAULT_HEDGE_BUDGET)
+        self.requests = 0
+        self.hedges = 0
+
+        hedge_after = get_env('RPC_HEDGE_AFTER')
+        try:
+            self.hedge_after = float(hedge_after) if hedge_after else None
+        except ValueError:
+            self.hedge_after = None
+
+        super().__init__(**kwargs)
+
+    def __str__(self):
+        return f"RPC failover over {', '.join(endpoint.name for endpoint in self.endpoints)}"
+
+    def rank(self):
+        """
+        Endpoints in the order they should be tried.
+
+        Available endpoints come first, fastest first. If every circuit is open the
+        one due back soonest is tried anyway, rather than failing the run outright.
+        """
+        now = time.monotonic()
+        available = sorted((e for e in self.endpoints if e.is_available(now)), key=lambda e: e.score())
+        waiting = sorted((e for e in self.endpoints if not e.is_available(now)), key=lambda e: e.open_until)
+
+        return available + waiting
+
+    def get_hedge_delay(self, endpoint):
+        """
+        How long to wait on an endpoint before asking the next one as well, None to never hedge.
+
+        RPC_HEDGE_AFTER fixes the delay in seconds (0 turns hedging off), otherwise
+        it is a multiple of the endpoint's typical latency.
+        """
+        if self.hedge_after is not None:
+            return self.hedge_after or None
+
+        if endpoint.latency is None:
+            return HEDGE_UNMEASURED
+
+        return min(max(endpoint.latency * HEDGE_MULTIPLIER, HEDGE_MIN), HEDGE_MAX)
+
+    def can_hedge(self):
+        """
+        Whether another hedge fits in the budget, a small burst is allowed on top.
+        """
+        return self.hedges < self.requests * self.hedge_budget + HEDGE_BURST
+
+    async def attempt(self, endpoint, method, params):
+        """
+        Send one request to one endpoint, recording how it went.
+        """
+        started = time.monotonic()
+        try:
+            with span('rpc', endpoint=endpoint.name, method=method):
+                response = await asyncio.wait_for(endpoint.provider.make_request(method, params), self.timeout)
+
+            error = response.get('error') if isinstance(response, dict) else None
+            if is_endpoint_error(error):
+                raise EndpointError(f"{endpoint.name} returned {error}")
+        except asyncio.CancelledError:
+            ##
+            ## lost a hedge race, it took at least this long so its average has to reflect that
+            endpoint.record_latency(time.monotonic() - started)
+            raise
+        except Exception:
+            endpoint.record_failure(self.cooldown)
+            raise
+
+        endpoint.record_success(time.monotonic() - started)
+        return response
+
+    async def make_request(self, method, params):
+        candidates = self.rank()
+        pending = {}
+        last_error = None
+
+        def launch():
+            endpoint = candidates.pop(0)
+            task = asyncio.ensure_future(self.attempt(endpoint, method, params))
+            pending[task] = endpoint
+            return endpoint
+
+        self.requests += 1
+        primary = launch()
+
+        try:
+            while pending:
+                hedge_delay = self.get_hedge_delay(primary) if candidates and self.can_hedge() else None
+                done, _ = await asyncio.wait(pending, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    ##
+                    ## too slow, ask the next endpoint as well and take whichever answers first
+                    self.hedges += 1
+                    primary = launch()
+                    self.logger.debug(f"Hedging {method} to {primary.name}")
+                    continue
+
+                for task in done:
+                    endpoint = pending.pop(task)
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        last_error = e
+                        self.logger.debug(f"{method} failed on {endpoint.name}: {e!r}")
+
+                ##
+                ## nothing in flight anymore, fail over to the next endpoint
+                if not pending and candidates:
+                    primary = launch()
+        finally:
+            for task in pending:
+                if task.done():
+                    ##
+                    ## finished alongside the winner, mark any error as seen
+                    if not task.cancelled():
+                        task.exception()
+                else:
+                    task.cancel()
+
+        raise last_error
+
+    async def make_batch_request(self, batch_requests):
+        last_error = None
+
+        for endpoint in self.rank():
+            started = time.monotonic()
+            try:
+                response = await asyncio.wait_for(endpoint.provider.make_batch_request(batch_requests), self.timeout)
+
+                for item in response if isinstance(response, list) else []:
+                    error = item.get('error') if isinstance(item, dict) else None
+                    if is_endpoint_error(error):
+                        raise EndpointError(f"{endpoint.name} returned {error}")
+            except Exception as e:
+                endpoint.record_failure(self.cooldown)
+                last_error = e
+                continue
+
+            endpoint.record_success(time.monotonic() - started)
+            return response
+
+        raise last_error
+
+    async def is_connected(self, show_traceback=False):
+        for endpoint in self.rank():
+            if await endpoint.provider.is_connected(show_traceback=show_traceback):
+                return True
+        return False
+
+    async def disconnect(self):
+        for endpoint in self.endpoints:
+            await endpoint.provider.disconnect()
+
+    def get_stats(self):
+        """
+        Current health of every endpoint, for logging.
+
+        @returns: List of {'endpoint', 'latency', 'error_rate', 'open'} dicts
+        """
+        now = time.monotonic()
+        return [
+            {
+                'endpoint': endpoint.name,
+                'latency': endpoint.latency,
+                'error_rate': endpoint.error_rate,
+                'open': not endpoint.is_available(now)
+            }
+            for endpoint in self.endpoints
+        ]
@@ -0,0 +1,323 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from decimal import Decimal
+from utils.helpers import is_dev, get_env_int, get_env_float, get_cache_dir
+from utils.storage import local_session
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 60
+DEFAULT_FLUSH_BATCH = 50
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_INLINE_FLUSH_TIME = 10
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS snapshots (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        batch_key TEXT NOT NULL UNIQUE,
+        payload TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT
+    );
+    CREATE TABLE IF NOT EXISTS failed_snapshots (
+        id INTEGER PRIMARY KEY,
+        batch_key TEXT NOT NULL UNIQUE,
+        payload TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        attempts INTEGER NOT NULL,
+        last_error TEXT,
+        failed_at REAL NOT NULL
+    );
+"""
+
+##
+## one flush at a time, the daemon's flusher thread and tvl() may both ask for one
+_flush_lock = threading.Lock()
+
+
+def get_spool_path():
+    """
+    Path of the local SQLite spool holding snapshots not yet written to MySQL.
+    """
+    return os.path.join(get_cache_dir(), 'spool_dev.sqlite3' if is_dev() else 'spool.sqlite3')
+
+
+def spool_session():
+    """
+    Connection to the spool, a snapshot is on disk once append() returns.
+    """
+    return local_session(get_spool_path(), SCHEMA)
+
+
+def append(data, amp_total, usd_total, block_number=None, price=None, price_time=None):
+    """
+    Durably queue a snapshot for saving, without touching MySQL.
+
+    Wei amounts stay exact integers in the JSON payload and the Decimal USD total
+    and price are kept as strings.
+
+    @params data: List of [name, contract, amp_total, usd_value] pool rows
+    @params amp_total: The total AMP amount across all pools
+    @params usd_total: The total USD value across all pools
+    @params block_number: The block every pool balance was read at
+    @params price: The AMP price the batch was valued with
+    @params price_time: The unix time the price was published
+    @returns: The snapshot's batch key
+    """
+    batch_key = uuid.uuid4().hex
+    payload = {
+        'data': [list(row) for row in data],
+        'amp_total': amp_total,
+        'usd_total': str(usd_total),
+        'block_number': block_number,
+        'price': None if price is None else str(price),
+        'price_time': price_time
+    }
+
+    with spool_session() as conn:
+        conn.execute(
+            "INSERT INTO snapshots (batch_key, payload, created_at) VALUES (?, ?, ?)",
+            (batch_key, json.dumps(payload), time.time())
+        )
+
+    return batch_key
+
+
+def count_pending():
+    """
+    Number of snapshots waiting to be written, 0 if there is no spool yet.
+    """
+    if not os.path.isfile(get_spool_path()):
+        return 0
+
+    with spool_session() as conn:
+        return conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+
+
+def count_failed():
+    """
+    Number of snapshots set aside after failing to write, 0 if there is no spool yet.
+    """
+    if not os.path.isfile(get_spool_path()):
+        return 0
+
+    with spool_session() as conn:
+        return conn.execute("SELECT COUNT(*) FROM failed_snapshots").fetchone()[0]
+
+
+def is_pending(batch_key):
+    """
+    Checks whether a snapshot is still spooled, rather than written or set aside.
+    """
+    with spool_session() as conn:
+        return conn.execute("SELECT 1 FROM snapshots WHERE batch_key = ?", (batch_key,)).fetchone() is not None
+
+
+def load_pending(conn, limit):
+    """
+    The oldest spooled snapshots as save_batches() input.
+
+    @returns: Tuple of (batches, list of (id, error) for payloads that can't be decoded)
+    """
+    rows = conn.execute(
+        "SELECT id, batch_key, payload, created_at, attempts FROM snapshots ORDER BY id ASC LIMIT ?",
+        (limit,)
+    ).fetchall()
+
+    batches = []
+    broken = []
+    for id, batch_key, payload, created_at, attempts in rows:
+        try:
+            batch = json.loads(payload)
+            batch['usd_total'] = Decimal(batch['usd_total'])
+            batch['price'] = None if batch['price'] is None else Decimal(batch['price'])
+        except Exception as e:
+            broken.append((id, f"Unreadable payload: {e!r}"))
+            continue
+
+        batch['batch_key'] = batch_key
+        batch['created_at'] = int(created_at)
+        batch['id'] = id
+        batch['attempts'] = attempts
+        batches.append(batch)
+
+    return batches, broken
+
+
+def set_aside(conn, failures):
+    """
+    Move snapshots out of the spool into failed_snapshots, so newer ones can be written.
+
+    @params conn: A spool connection
+    @params failures: List of (id, error)
+    """
+    now = time.time()
+    for id, error in failures:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO failed_snapshots (id, batch_key, payload, created_at, attempts, last_error, failed_at)
+            SELECT id, batch_key, payload, created_at, attempts, ?, ? FROM snapshots WHERE id = ?
+            """,
+            (error, now, id)
+        )
+        conn.execute("DELETE FROM snapshots WHERE id = ?", (id,))
+
+        logger.error(f"Set aside spooled snapshot {id} after it failed to write: {error}")
+
+
+def requeue_failed():
+    """
+    Put every set aside snapshot back in the spool, e.g. once pending migrations have run.
+
+    @returns: The number of snapshots requeued
+    """
+    with spool_session() as conn:
+        ##
+        ## the original ids keep them ahead of anything spooled since
+        count = conn.execute(
+            """
+            INSERT OR IGNORE INTO snapshots (id, batch_key, payload, created_at, attempts, last_error)
+            SELECT id, batch_key, payload, created_at, 0, last_error FROM failed_snapshots
+            """
+        ).rowcount
+        conn.execute("DELETE FROM failed_snapshots")
+
+    return count
+
+
+def flush(limit=None, budget=None):
+    """
+    Write spooled snapshots to MySQL, oldest first, until the spool is empty or a write fails.
+
+    Each round saves up to SPOOL_FLUSH_BATCH snapshots in one transaction and then
+    clears them from the spool. If the process dies in between, the batch keys
+    make the next flush skip what was already written. On failure the snapshots
+    stay spooled, in order, for the next attempt.
+
+    A snapshot that keeps failing while the database is up (bad data, a constraint,
+    a schema that needs migrating) would block everything behind it, so once it has
+    failed SPOOL_MAX_ATTEMPTS times on its own it is moved to failed_snapshots,
+    see requeue_failed(). Failures during an outage don't count towards that.
+
+    With a budget no new transaction is started once it has run out, whatever
+    is left is written by a later flush.
+
+    @params limit: Snapshots per transaction, defaults to SPOOL_FLUSH_BATCH
+    @params budget: Optional seconds after which to stop flushing
+    @returns: Dict of batch_key => (totals ID, last TVL row ID or None) for everything written
+    """
+    from utils.database import save_batches, is_reachable
+
+    batch_limit = limit or max(1, get_env_int('SPOOL_FLUSH_BATCH', DEFAULT_FLUSH_BATCH))
+    max_attempts = max(1, get_env_int('SPOOL_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS))
+    limit = batch_limit
+    deadline = time.monotonic() + budget if budget is not None else None
+    saved = {}
+
+    with _flush_lock:
+        while True:
+            with spool_session() as conn:
+                batches, broken = load_pending(conn, limit)
+                if broken:
+                    set_aside(conn, broken)
+            if broken:
+                continue
+            if not batches:
+                break
+
+            try:
+                written = save_batches(batches)
+            except Exception as e:
+                if len(batches) > 1:
+                    ##
+                    ## one bad snapshot fails the whole transaction, retry the oldest
+                    ## on its own to find out whether it is to blame
+                    limit = 1
+                    continue
+
+                batch = batches[0]
+                if not is_reachable():
+                    logger.warning(f"Could not write spooled snapshots to the database, keeping them for the next flush: {e}")
+                    break
+
+                ##
+                ## the database is up, so it is this snapshot that fails
+                attempts = batch['attempts'] + 1
+                with spool_session() as conn:
+                    conn.execute(
+                        "UPDATE snapshots SET attempts = ?, last_error = ? WHERE id = ?",
+                        (attempts, str(e), batch['id'])
+                    )
+                    if attempts >= max_attempts:
+                        set_aside(conn, [(batch['id'], str(e))])
+
+                if attempts >= max_attempts:
+                    limit = batch_limit
+                    continue
+
+                logger.warning(f"Could not write spooled snapshot {batch['id']} (attempt {attempts} of {max_attempts}), keeping it for the next flush: {e}")
+                break
+
+            with spool_session() as conn:
+                conn.executemany("DELETE FROM snapshots WHERE id = ?", [(batch['id'],) for batch in batches])
+
+            saved.update(written)
+            if len(batches) > 1:
+                logger.info(f"Flushed {len(batches)} spooled snapshots to the database")
+
+            limit = batch_limit
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+
+    return saved
+
+
+def start_flusher(stop, interval=None):
+    """
+    Flush the spool in a background thread every SPOOL_FLUSH_INTERVAL seconds until `stop` is set.
+
+    Lets the daemon catch up on snapshots spooled during a database outage
+    without waiting for the next tweet.
+
+    @params stop: A threading.Event that ends the thread
+    @params interval: Seconds between flushes, defaults to SPOOL_FLUSH_INTERVAL
+    @returns: The started thread
+    """
+    interval = interval or max(1, get_env_float('SPOOL_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL))
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                if count_pending():
+                    flush()
+            except Exception as e:
+                logger.warning(f"Spool flush failed: {e}")
+
+    thread = threading.Thread(target=run, name='spool-flusher', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    ##
+    ## python -m utils.spool [dev] [--requeue]
+    import argparse
+    from dotenv import load_dotenv
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Inspect the snapshot spool')
+    parser.add_argument('env', nargs='?', choices=['dev'], help="use the dev spool")
+    parser.add_argument('--requeue', action='store_true', help="move set aside snapshots back into the spool so the next flush retries them")
+    args = parser.parse_args()
+
+    if args.requeue:
+        logger.info(f"Requeued {requeue_failed()} snapshot(s)")
+
+    logger.info(f"{count_pending()} snapshot(s) spooled, {count_failed()} set aside")
@@ -0,0 +1,203 @@
+import os
+import math
+import sqlite3
+import threading
+from decimal import Decimal
+from contextlib import contextmanager
+from fractions import Fraction
+from utils.helpers import is_dev, get_env, get_cache_dir
+
+BACKENDS = ['mysql', 'sqlite']
+DEFAULT_BACKEND = 'mysql'
+
+##
+## the schema migrations build on MySQL, created in one go for an embedded database.
+## amounts are TEXT since SQLite integers are 64 bit and it has no decimal type,
+## created_at holds unix seconds
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS totals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        amp TEXT NOT NULL,
+        usd TEXT NOT NULL,
+        created_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+        block_number INTEGER,
+        price TEXT,
+        price_time INTEGER,
+        batch_key TEXT
+    );
+    CREATE TABLE IF NOT EXISTS tvl (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        contract TEXT NOT NULL,
+        amp_total TEXT NOT NULL,
+        usd INTEGER NOT NULL,
+        batch_id INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_totals_created_at ON totals (created_at);
+    CREATE INDEX IF NOT EXISTS idx_totals_block_number ON totals (block_number);
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_totals_batch_key ON totals (batch_key);
+    CREATE INDEX IF NOT EXISTS idx_tvl_batch_id ON tvl (batch_id);
+    CREATE INDEX IF NOT EXISTS idx_tvl_contract_batch_id ON tvl (contract, batch_id);
+    CREATE INDEX IF NOT EXISTS idx_tvl_name_batch_id ON tvl (name, batch_id);
+"""
+
+##
+## database files whose schema was already created by this process
+_initialised = set()
+_initialised_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Retrieves the storage backend from DB_BACKEND, mysql (default) or sqlite.
+    """
+    backend = (get_env('DB_BACKEND') or DEFAULT_BACKEND).lower()
+    return backend if backend in BACKENDS else DEFAULT_BACKEND
+
+
+def is_embedded():
+    """
+    Checks whether history is kept in a local database file rather than on a MySQL server.
+    """
+    return get_backend() == 'sqlite'
+
+
+def get_sqlite_path():
+    """
+    Path of the embedded database for the current environment, from DB_PATH or DEV_DB_PATH.
+    """
+    prefix = 'DEV_' if is_dev() else ''
+    return get_env(f'{prefix}DB_PATH') or os.path.join(get_cache_dir(), 'ampy_dev.sqlite3' if is_dev() else 'ampy.sqlite3')
+
+
+def to_sqlite(value):
+    """
+    Convert a query parameter to something SQLite stores without losing precision.
+    """
+    if isinstance(value, (Decimal, Fraction)):
+        return str(value)
+    if isinstance(value, int) and not isinstance(value, bool) and abs(value) > 2 ** 63 - 1:
+        return str(value)
+    return value
+
+
+class SQLiteCursor:
+    """
+    Adapts a sqlite3 cursor to the mysql.connector calls utils.database makes.
+    """
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    @staticmethod
+    def convert(params):
+        return tuple(to_sqlite(param) for param in params)
+
+    def execute(self, sql, params=()):
+        self.cursor.execute(sql.replace('%s', '?'), self.convert(params))
+
+    def executemany(self, sql, rows):
+        self.cursor.executemany(sql.replace('%s', '?'), [self.convert(row) for row in rows])
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    def close(self):
+        self.cursor.close()
+
+
+class SQLiteConnection:
+    """
+    A SQLite database behind the connection API utils.database expects from mysql.connector.
+
+    The MySQL functions the queries use are registered as SQL functions over
+    unix seconds, which is how created_at is stored here.
+    """
+    def __init__(self, path, check_same_thread=True):
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=check_same_thread)
+        self.db.create_function('FROM_UNIXTIME', 1, lambda timestamp: timestamp, deterministic=True)
+        self.db.create_function('UNIX_TIMESTAMP', 1, lambda timestamp: timestamp, deterministic=True)
+        self.db.create_function('FLOOR', 1, lambda value: None if value is None else math.floor(value), deterministic=True)
+        self.db.create_function('LEAST', 2, lambda a, b: None if a is None or b is None else min(a, b), deterministic=True)
+
+    def cursor(self):
+        return SQLiteCursor(self.db.cursor())
+
+    def commit(self):
+        self.db.commit()
+
+    def rollback(self):
+        self.db.rollback()
+
+    def ping(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        self.db.close()
+
+
+def create_schema(conn):
+    """
+    Create the embedded schema, safe to run against an existing database.
+    """
+    conn.db.executescript(SQLITE_SCHEMA)
+
+
+def connect_sqlite(path=None):
+    """
+    Open the embedded database, creating the file and schema on first use.
+
+    WAL lets readers carry on while a batch is written, and synchronous=NORMAL
+    only syncs at checkpoints, which is safe in WAL mode and keeps writes fast.
+
+    @params path: The database file, defaults to get_sqlite_path()
+    @returns: A SQLiteConnection
+    """
+    path = path or get_sqlite_path()
+
+    with _initialised_lock:
+        if path not in _initialised:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            conn = SQLiteConnection(path)
+            try:
+                conn.db.execute("PRAGMA journal_mode=WAL")
+                create_schema(conn)
+            finally:
+                conn.close()
+            _initialised.add(path)
+
+    conn = SQLiteConnection(path)
+    conn.db.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+@contextmanager
+def local_session(path, schema):
+    """
+    Context manager for a local state file such as the spool, committing when the block exits cleanly.
+
+    Runs in WAL mode with synchronous=FULL, so whatever the block wrote is on
+    disk once it exits, even if the process dies straight after.
+
+    @params path: The SQLite file, created along with its directory if needed
+    @params schema: CREATE ... IF NOT EXISTS statements run on every open
+    @yields: The sqlite3 connection
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.executescript(schema)
+
+        with conn:
+            yield conn
+    finally:
+        conn.close()
@@ -0,0 +1,494 @@
+import io
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from utils.helpers import is_dev, get_env_int, get_env_float, get_cache_dir, write_atomic
+from utils.storage import local_session
+from utils.metrics import span
+
+logger = logging.getLogger(__name__)
+
+DAY = 86400
+
+DEFAULT_IDENTITY_TTL = DAY
+DEFAULT_TWEETS_PER_DAY = 17
+DEFAULT_UPLOADS_PER_DAY = 100
+DEFAULT_BURST = 2
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_MAX_AGE = DAY
+DEFAULT_PUBLISH_INTERVAL = 60
+
+##
+## backoff for transient failures, doubling from RETRY_BASE up to RETRY_MAX seconds
+RETRY_BASE = 60
+RETRY_MAX = 3600
+
+##
+## uploaded media ids expire after 24 hours, a queued tweet re-uploads a little before that
+MEDIA_TTL = 23 * 3600
+
+##
+## per-endpoint windows and the per-user / per-app daily caps, as (remaining, reset) header pairs
+RATE_LIMIT_HEADERS = [
+    ('x-rate-limit-remaining', 'x-rate-limit-reset'),
+    ('x-user-limit-24hour-remaining', 'x-user-limit-24hour-reset'),
+    ('x-app-limit-24hour-remaining', 'x-app-limit-24hour-reset'),
+]
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        text TEXT NOT NULL,
+        image BLOB,
+        filename TEXT,
+        media_id TEXT,
+        media_uploaded_at REAL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        last_error TEXT,
+        tweet_id TEXT,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (status, id);
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        endpoint TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        blocked_until REAL NOT NULL DEFAULT 0
+    );
+"""
+
+##
+## one drain of the queue at a time, the daemon's publisher thread and tweet() may both start one
+_publish_lock = threading.Lock()
+
+
+def get_outbox_path():
+    """
+    Path of the local SQLite queue of tweets waiting to be posted.
+    """
+    return os.path.join(get_cache_dir(), 'outbox_dev.sqlite3' if is_dev() else 'outbox.sqlite3')
+
+
+def outbox_session():
+    """
+    Connection to the outbox, a tweet is on disk once enqueue() returns.
+    """
+    return local_session(get_outbox_path(), SCHEMA)
+
+
+def get_identity_path():
+    """
+    Path of the file caching the account the credentials were last verified as.
+    """
+    return os.path.join(get_cache_dir(), 'twitter_identity_dev.json' if is_dev() else 'twitter_identity.json')
+
+
+def get_credentials_key(*credentials):
+    """
+    Fingerprint of the credentials, so a cached identity is dropped when they change
+    without the credentials themselves being written to disk.
+    """
+    return hashlib.sha256('\0'.join(credential or '' for credential in credentials).encode()).hexdigest()
+
+
+def load_identity(credentials_key):
+    """
+    The username verified for these credentials, or None if it is unknown or older than TWITTER_IDENTITY_TTL.
+    """
+    try:
+        with open(get_identity_path()) as f:
+            identity = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    ttl = get_env_int('TWITTER_IDENTITY_TTL', DEFAULT_IDENTITY_TTL)
+    if not isinstance(identity, dict) or identity.get('key') != credentials_key:
+        return None
+    if time.time() - identity.get('verified_at', 0) > ttl:
+        return None
+
+    return identity.get('username')
+
+
+def save_identity(credentials_key, username):
+    """
+    Cache a verified username, written atomically.
+    """
+    try:
+        write_atomic(get_identity_path(), json.dumps({'key': credentials_key, 'username': username, 'verified_at': time.time()}))
+    except OSError as e:
+        logger.warning(f"Failed to cache the Twitter identity: {e}")
+
+
+def clear_identity():
+    """
+    Forget the cached identity, e.g. after Twitter rejects the credentials.
+    """
+    try:
+        os.remove(get_identity_path())
+    except OSError:
+        pass
+
+
+def enqueue(text, image, filename):
+    """
+    Durably queue a tweet for posting.
+
+    Every tweet is a full report, so tweets still waiting in the queue are
+    superseded by the new one rather than posted late. Reports can come more
+    often than TWITTER_TWEETS_PER_DAY allows and the queue stays at one entry.
+
+    @params text: The tweet text
+    @params image: The encoded image bytes
+    @params filename: The image filename, its extension tells Twitter the type
+    @returns: The outbox entry ID
+    """
+    now = time.time()
+    with outbox_session() as conn:
+        superseded = conn.execute("UPDATE outbox SET status = 'superseded', image = NULL WHERE status = 'queued'").rowcount
+        if superseded:
+            logger.info(f"Dropped {superseded} queued tweet(s) superseded by a newer report")
+
+        return conn.execute(
+            "INSERT INTO outbox (text, image, filename, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)",
+            (text, image, filename, now, now)
+        ).lastrowid
+
+
+def count_queued():
+    """
+    Number of tweets waiting to be posted, 0 if there is no outbox yet.
+    """
+    if not os.path.isfile(get_outbox_path()):
+        return 0
+
+    with outbox_session() as conn:
+        return conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'queued'").fetchone()[0]
+
+
+def get_retry_delay(attempts):
+    """
+    Seconds before retrying after a transient failure, exponential with jitter.
+    """
+    return random.uniform(RETRY_BASE / 2, min(RETRY_BASE * (2 ** attempts), RETRY_MAX))
+
+
+def get_response_data(response):
+    """
+    The data object of a v2 response, whether tweepy returned a Response or a requests.Response.
+    """
+    if hasattr(response, 'json'):
+        return response.json().get('data')
+    return response.data
+
+
+class RateLimiter:
+    """
+    A token bucket per Twitter endpoint, persisted in the outbox so limits hold across runs.
+
+    Each bucket refills at the endpoint's daily allowance spread evenly over the
+    day and holds at most `burst` tokens, so a backlog goes out steadily rather
+    than all at once. Rate limit headers from Twitter override the local estimate,
+    and an exhausted limit blocks the endpoint until Twitter says it resets.
+    """
+    def __init__(self, per_day, burst=DEFAULT_BURST):
+        self.per_day = per_day
+        self.burst = max(1, burst)
+
+    def load(self, conn, endpoint, now):
+        """
+        Current (tokens, blocked_until) for an endpoint, refilled up to now.
+        """
+        row = conn.execute("SELECT tokens, updated_at, blocked_until FROM rate_limits WHERE endpoint = ?", (endpoint,)).fetchone()
+        if row is None:
+            return float(self.burst), 0.0
+
+        tokens, updated_at, blocked_until = row
+        rate = self.per_day[endpoint] / DAY
+        return min(float(self.burst), tokens + max(0.0, now - updated_at) * rate), blocked_until
+
+    def store(self, conn, endpoint, tokens, blocked_until, now):
+        conn.execute(
+            "INSERT OR REPLACE INTO rate_limits (endpoint, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?)",
+            (endpoint, tokens, now, blocked_until)
+        )
+
+    def get_wait(self, conn, endpoint, now):
+        """
+        Seconds until a request to the endpoint is allowed, 0 if it is allowed now.
+        """
+        tokens, blocked_until = self.load(conn, endpoint, now)
+        if now < blocked_until:
+            return blocked_until - now
+        if tokens >= 1:
+            return 0.0
+        return (1 - tokens) * DAY / self.per_day[endpoint]
+
+    def take(self, conn, endpoint, now):
+        """
+        Spend a token on a request that is about to be made.
+        """
+        tokens, blocked_until = self.load(conn, endpoint, now)
+        self.store(conn, endpoint, tokens - 1, blocked_until, now)
+
+    def update(self, conn, endpoint, headers, now):
+        """
+        Correct an endpoint's bucket from the rate limit headers of a response.
+        """
+        if not headers:
+            return
+
+        tokens, blocked_until = self.load(conn, endpoint, now)
+
+        for remaining_header, reset_header in RATE_LIMIT_HEADERS:
+            try:
+                remaining = int(headers.get(remaining_header))
+                reset = float(headers.get(reset_header) or 0)
+            except (TypeError, ValueError):
+                continue
+
+            tokens = min(tokens, remaining)
+            if remaining <= 0 and reset > now:
+                blocked_until = max(blocked_until, reset)
+
+        self.store(conn, endpoint, tokens, blocked_until, now)
+
+
+class TwitterPublisher:
+    """
+    Posts queued tweets without ever sleeping on Twitter.
+
+    Entries are sent oldest first while the rate limiter allows it. A 429 or a
+    server error leaves the entry queued with a next attempt time instead of
+    blocking, a rejected tweet is marked failed, and an uploaded image is kept
+    so a retried tweet doesn't upload it again.
+    """
+    def __init__(self, api, client):
+        self.api = api
+        self.client = client
+        self.limiter = RateLimiter(
+            {
+                'media_upload': max(1, get_env_int('TWITTER_UPLOADS_PER_DAY', DEFAULT_UPLOADS_PER_DAY)),
+                'create_tweet': max(1, get_env_int('TWITTER_TWEETS_PER_DAY', DEFAULT_TWEETS_PER_DAY)),
+            },
+            burst=get_env_int('TWITTER_BURST', DEFAULT_BURST)
+        )
+        self.max_attempts = max(1, get_env_int('TWITTER_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS))
+        self.max_age = get_env_int('TWITTER_QUEUE_MAX_AGE', DEFAULT_MAX_AGE)
+
+    def expire(self, conn, now):
+        """
+        Drop queued tweets older than TWITTER_QUEUE_MAX_AGE, their numbers are out of date by now.
+        """
+        if self.max_age <= 0:
+            return
+
+        expired = conn.execute(
+            "UPDATE outbox SET status = 'expired', image = NULL WHERE status = 'queued' AND created_at < ?",
+            (now - self.max_age,)
+        ).rowcount
+        if expired:
+            logger.warning(f"Dropped {expired} queued tweet(s) older than {self.max_age}s")
+
+    def get_next(self):
+        """
+        The oldest queued entry, or None if the queue is empty.
+        """
+        with outbox_session() as conn:
+            self.expire(conn, time.time())
+            return conn.execute("""
+                SELECT id, text, image, filename, media_id, media_uploaded_at, attempts, next_attempt_at
+                FROM outbox WHERE status = 'queued' ORDER BY id ASC LIMIT 1
+                """).fetchone()
+
+    def get_wait(self, endpoint):
+        with outbox_session() as conn:
+            return self.limiter.get_wait(conn, endpoint, time.time())
+
+    def call(self, endpoint, request):
+        """
+        Make one rate limited request, spending a token and reading back its rate limit headers.
+        """
+        import tweepy
+
+        with outbox_session() as conn:
+            self.limiter.take(conn, endpoint, time.time())
+
+        try:
+            with span(endpoint):
+                response = request()
+        except tweepy.HTTPException as e:
+            with outbox_session() as conn:
+                self.limiter.update(conn, endpoint, e.response.headers if e.response is not None else None, time.time())
+            raise
+
+        ##
+        ## tweepy.API keeps the raw response of its last request, v2 responses carry their own headers
+        raw = response if hasattr(response, 'headers') else getattr(self.api, 'last_response', None)
+        with outbox_session() as conn:
+            self.limiter.update(conn, endpoint, getattr(raw, 'headers', None), time.time())
+
+        return response
+
+    def mark(self, entry_id, **fields):
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        with outbox_session() as conn:
+            conn.execute(f"UPDATE outbox SET {assignments} WHERE id = ?", (*fields.values(), entry_id))
+
+    def publish(self, entry):
+        """
+        Try to post one queued entry.
+
+        @returns: 'sent', 'queued' (retry later, with the reason logged) or 'failed'
+        """
+        import tweepy
+
+        entry_id, text, image, filename, media_id, media_uploaded_at, attempts, _ = entry
+        now = time.time()
+
+        if media_id is not None and now - (media_uploaded_at or 0) > MEDIA_TTL:
+            media_id = None
+        upload = media_id is None and image is not None
+
+        ##
+        ## only start when every request this tweet needs is allowed, so an image
+        ## isn't uploaded just to expire while the tweet waits
+        wait = max(self.get_wait('create_tweet'), self.get_wait('media_upload') if upload else 0)
+        if wait:
+            self.mark(entry_id, next_attempt_at=now + wait)
+            return 'queued'
+
+        try:
+            if upload:
+                ##
+                ## upload straight from memory, the filename only tells tweepy the type
+                media = self.call('media_upload', lambda: self.api.media_upload(filename=filename, file=io.BytesIO(image)))
+                media_id = str(media.media_id)
+                self.mark(entry_id, media_id=media_id, media_uploaded_at=time.time())
+
+            response = self.call('create_tweet', lambda: self.client.create_tweet(text=text, media_ids=[media_id] if media_id else None))
+            data = get_response_data(response)
+
+        except tweepy.TooManyRequests:
+            ##
+            ## not the tweet's fault, so it doesn't count as an attempt
+            wait = max(self.get_wait('create_tweet'), self.get_wait('media_upload'), RETRY_BASE)
+            self.mark(entry_id, next_attempt_at=time.time() + wait, last_error='rate limited')
+            logger.warning(f"Twitter rate limit reached, tweet {entry_id} stays queued for {wait / 60:.0f} minutes")
+            return 'queued'
+
+        except tweepy.Forbidden as e:
+            if 'duplicate' in str(e).lower():
+                ##
+                ## an earlier attempt got through before the run could record it
+                self.mark(entry_id, status='sent', image=None, last_error=str(e))
+                logger.warning(f"Tweet {entry_id} had already been posted")
+                return 'sent'
+
+            if "453" in str(e):
+                logger.error("❌ Twitter API Error 453: Your API access level doesn't include posting tweets")
+                logger.error("You need 'Elevated' or 'Enterprise' access to post tweets")
+                logger.error("Visit: https://developer.twitter.com/en/portal/products")
+            else:
+                logger.error(f"❌ Twitter API Forbidden Error: {e}")
+            self.mark(entry_id, status='failed', attempts=attempts + 1, last_error=str(e))
+            return 'failed'
+
+        except tweepy.Unauthorized as e:
+            logger.error(f"❌ Twitter API Unauthorized: {e}")
+            logger.error("Check your API credentials in the .env file")
+            clear_identity()
+            self.mark(entry_id, status='failed', attempts=attempts + 1, last_error=str(e))
+            return 'failed'
+
+        except tweepy.BadRequest as e:
+            logger.error(f"❌ Twitter rejected tweet {entry_id}: {e}")
+            self.mark(entry_id, status='failed', attempts=attempts + 1, last_error=str(e))
+            return 'failed'
+
+        except Exception as e:
+            ##
+            ## server errors and dropped connections, retried later rather than waited out
+            attempts += 1
+            if attempts >= self.max_attempts:
+                logger.error(f"❌ Giving up on tweet {entry_id} after {attempts} attempts: {e}")
+                self.mark(entry_id, status='failed', attempts=attempts, last_error=str(e))
+                return 'failed'
+
+            delay = get_retry_delay(attempts)
+            logger.warning(f"Posting tweet {entry_id} failed, retrying in {delay / 60:.0f} minutes: {e}")
+            self.mark(entry_id, attempts=attempts, next_attempt_at=time.time() + delay, last_error=str(e))
+            return 'queued'
+
+        if not data:
+            logger.error("Tweet response didn't contain data")
+            self.mark(entry_id, status='failed', attempts=attempts + 1, last_error='no data in response')
+            return 'failed'
+
+        self.mark(entry_id, status='sent', image=None, tweet_id=str(data['id']), last_error=None)
+        logger.info(f"Tweet posted successfully: {data['id']}")
+        return 'sent'
+
+    def publish_due(self):
+        """
+        Post queued tweets oldest first until the queue is empty or the next one has to wait.
+
+        Order is kept, so nothing is posted while an older tweet is still waiting.
+
+        @returns: Dict of outbox entry ID => 'sent', 'queued' or 'failed' for every entry looked at
+        """
+        results = {}
+
+        with _publish_lock:
+            while True:
+                entry = self.get_next()
+                if entry is None:
+                    break
+
+                if entry[7] > time.time():
+                    results[entry[0]] = 'queued'
+                    break
+
+                status = self.publish(entry)
+                results[entry[0]] = status
+                if status == 'queued':
+                    break
+
+        return results
+
+    def get_next_attempt(self):
+        """
+        Unix time the oldest queued tweet will next be tried, None if nothing is queued.
+        """
+        entry = self.get_next()
+        return entry[7] if entry else None
+
+
+def start_publisher(stop, publisher, interval=None):
+    """
+    Post queued tweets in a background thread every TWITTER_PUBLISH_INTERVAL seconds until `stop` is set.
+
+    @params stop: A threading.Event that ends the thread
+    @params publisher: The TwitterPublisher
+    @params interval: Seconds between checks, defaults to TWITTER_PUBLISH_INTERVAL
+    @returns: The started thread
+    """
+    interval = interval or max(1, get_env_float('TWITTER_PUBLISH_INTERVAL', DEFAULT_PUBLISH_INTERVAL))
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                if count_queued():
+                    publisher.publish_due()
+            except Exception as e:
+                logger.warning(f"Publishing queued tweets failed: {e}")
+
+    thread = threading.Thread(target=run, name='twitter-publisher', daemon=True)
+    thread.start()
+    return thread